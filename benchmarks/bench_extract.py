@@ -0,0 +1,174 @@
+"""
+Benchmarks the extract engines against a local mock of the plants api.
+Each engine runs in a fresh interpreter so wall time and peak RSS are
+measured the same way the scheduled task would see them.
+
+Run from the repository root:
+    python -m benchmarks.bench_extract --plants 200 --latency 0.05
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipeline import extract, state
+
+SAMPLE_INTERVAL = 0.01  # Time in seconds between RSS samples
+
+
+def make_handler(num_plants: int, latency: float) -> type:
+    """Returns a request handler serving plants 1 to num_plants"""
+
+    class MockPlantsHandler(BaseHTTPRequestHandler):
+        """Answers /api/plants/<id> like the real api"""
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Responds with a plant body, or a 404 past the last plant"""
+            time.sleep(latency)
+            plant_id = int(self.path.rstrip('/').split('/')[-1])
+            if 1 <= plant_id <= num_plants:
+                status = 200
+                body = {'plant_id': plant_id, 'name': f'Plant {plant_id}',
+                        'temperature': 12.5, 'soil_moisture': 30.1,
+                        'recording_taken': '2025-11-13T12:00:00'}
+            else:
+                status = 404
+                body = {'error': 'plant not found', 'plant_id': plant_id}
+
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            """Keeps the benchmark output clean"""
+
+    return MockPlantsHandler
+
+
+class MockPlantsServer(ThreadingHTTPServer):
+    """Threaded server with a listen backlog big enough for every concurrent client"""
+    request_queue_size = 256
+
+
+def start_mock_api(num_plants: int, latency: float) -> ThreadingHTTPServer:
+    """Starts the mock api on a free local port in a background thread"""
+    server = MockPlantsServer(('127.0.0.1', 0),
+                              make_handler(num_plants, latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def read_rss_kb(pid: int) -> int:
+    """Returns the resident set size of a process in kB, 0 if it has exited"""
+    try:
+        with open(f'/proc/{pid}/status', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def child_pids(pid: int) -> list[int]:
+    """Returns all descendant pids of a process"""
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children', 'r', encoding='utf-8') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        return []
+    descendants = list(children)
+    for child in children:
+        descendants.extend(child_pids(child))
+    return descendants
+
+
+def run_engine(engine: str) -> None:
+    """Runs one extract in this process and prints its measurements as json"""
+    peak_kb = 0
+    running = True
+
+    def sample() -> None:
+        nonlocal peak_kb
+        pid = os.getpid()
+        while running:
+            total = read_rss_kb(pid) + sum(read_rss_kb(c) for c in child_pids(pid))
+            peak_kb = max(peak_kb, total)
+            time.sleep(SAMPLE_INTERVAL)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    extract.extract_data(engine)
+    wall_time = time.perf_counter() - start
+    running = False
+    sampler.join()
+
+    with open(extract.OUTPUT_FILE, 'r', encoding='utf-8') as f:
+        fetched = len(json.load(f))
+
+    print(json.dumps({'engine': engine, 'wall_time': wall_time,
+                      'peak_rss_mb': peak_kb / 1024, 'plants': fetched}))
+
+
+def benchmark(num_plants: int, latency: float, engines: tuple) -> list[dict]:
+    """Runs every engine in its own interpreter against the same mock api"""
+    server = start_mock_api(num_plants, latency)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/api/plants/'
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for engine in engines:
+            env = dict(os.environ, BENCH_BASE_URL=base_url,
+                       BENCH_OUTPUT_FOLDER=f'{tmp_dir}/')
+            completed = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_extract', '--run', engine],
+                env=env, capture_output=True, text=True, check=True)
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    server.shutdown()
+    return results
+
+
+def main() -> None:
+    """Parses arguments and prints a comparison table"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plants', type=int, default=200,
+                        help='Number of plants served by the mock api')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds the mock api waits before each response')
+    parser.add_argument('--run', choices=extract.ENGINES,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        extract.BASE_URL = os.environ['BENCH_BASE_URL']
+        extract.OUTPUT_FOLDER = os.environ['BENCH_OUTPUT_FOLDER']
+        extract.OUTPUT_FILE = f'{extract.OUTPUT_FOLDER}plant_data_raw.json'
+        extract.REPORT_FOLDER = f'{extract.OUTPUT_FOLDER}reports/'
+        extract.REPORT_FILE = f'{extract.REPORT_FOLDER}{args.run}_report.json'
+        state.STATE_FOLDER = f'{extract.OUTPUT_FOLDER}{args.run}_state/'
+        run_engine(args.run)
+        return
+
+    results = benchmark(args.plants, args.latency, ('pool', 'async'))
+    print(f'{"engine":<8}{"plants":>8}{"wall time (s)":>16}{"peak RSS (MB)":>16}')
+    for result in results:
+        print(f'{result["engine"]:<8}{result["plants"]:>8}'
+              f'{result["wall_time"]:>16.2f}{result["peak_rss_mb"]:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Benchmarks the row by row and bulk staging load paths against a local
+stand-in database. The stand-in is an in-memory sqlite database built from
+schema.sql and the migrations, which runs the SQL Server backend's
+statements and counts the round trips each path would make to RDS, so the
+network cost can be added to the measured wall time. Also times
+building executemany params, against the original row by row loop.
+
+Run from the repository root:
+    python -m benchmarks.bench_load --rtt 0.002
+"""
+import argparse
+import re
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from pipeline.backends import SqliteBackend, SqlServerBackend, get_sqlite_schema
+from pipeline.migrate import apply_migrations
+from pipeline.load import TABLES, FOREIGN_TABLES, READING_TABLE, upload_all_tables, to_sql_params
+
+SIZES = (1_000, 10_000, 100_000)
+ROWWISE_MAX_ROWS = 10_000  # The row by row path is too slow to run on more
+NUM_PLANTS = 50
+RTT = 0.002  # Round trip time in seconds to add for each statement sent
+PARAMS_SIZE = 100_000
+PARAMS_BUDGET = 1.0  # Time in seconds building params for PARAMS_SIZE readings may take
+
+
+def to_sqlite(sql: str) -> str:
+    """Rewrites the SQL Server temporary tables and day casts the loader uses into sqlite"""
+    sql = sql.replace('CREATE TABLE #', 'CREATE TEMP TABLE ')
+    sql = re.sub(r'CAST\((\w+) AS DATE\)', r'DATE(\1)', sql)
+    return sql.replace('#', '')
+
+
+def get_wire_size(value) -> int:
+    """Returns roughly how many bytes SQL Server sends for a value"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    return 8
+
+
+class StandInCursor:
+    """A sqlite cursor that counts round trips the way pyodbc would make them"""
+
+    def __init__(self, connection: 'StandInConnection'):
+        self.connection = connection
+        self.cursor = connection.db.cursor()
+        self.fast_executemany = False
+
+    def execute(self, sql: str, *params):
+        """Runs one statement in one round trip"""
+        self.connection.round_trips += 1
+        if len(params) == 1 and isinstance(params[0], (tuple, list)):
+            params = params[0]
+        return self.cursor.execute(to_sqlite(sql), params)
+
+    def executemany(self, sql: str, params: list) -> None:
+        """Runs a statement per row, in one round trip only with fast_executemany"""
+        self.connection.round_trips += 1 if self.fast_executemany else len(params)
+        self.cursor.executemany(to_sqlite(sql), params)
+
+    @property
+    def rowcount(self) -> int:
+        """Returns the number of rows the last statement changed"""
+        return self.cursor.rowcount
+
+    @property
+    def description(self) -> tuple:
+        """Describes the columns of the last query"""
+        return self.cursor.description
+
+    def count_bytes(self, rows: list) -> list:
+        """Adds the size rows would take on the wire to the connection's total"""
+        self.connection.bytes_fetched += sum(get_wire_size(value) for row in rows for value in row)
+        return rows
+
+    def fetchone(self):
+        """Returns the next row of the last query"""
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.count_bytes([row])
+        return row
+
+    def fetchmany(self, size: int) -> list:
+        """Returns up to size more rows of the last query, streamed with the query's results"""
+        return self.count_bytes(self.cursor.fetchmany(size))
+
+    def fetchall(self):
+        """Returns every remaining row of the last query"""
+        return self.count_bytes(self.cursor.fetchall())
+
+    def close(self) -> None:
+        """Closes the cursor"""
+        self.cursor.close()
+
+
+class StandInConnection:
+    """An in-memory sqlite database with the schema.sql tables and every migration"""
+
+    def __init__(self):
+        # typed columns are read back as python values, as pyodbc returns them
+        self.db = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+        self.round_trips = 0
+        self.bytes_fetched = 0
+        self.db.executescript(get_sqlite_schema())
+        apply_migrations(self.db, SqliteBackend())
+
+    def cursor(self) -> StandInCursor:
+        """Returns a round trip counting cursor"""
+        return StandInCursor(self)
+
+    def count_rows(self) -> dict:
+        """Returns the number of rows in every table"""
+        return {table['table_name']: self.db.execute(
+            f"SELECT COUNT(*) FROM {table['table_name']}").fetchone()[0]
+            for table in TABLES + FOREIGN_TABLES}
+
+
+def make_clean_table(num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Returns a synthetic clean table of readings from NUM_PLANTS plants"""
+    rng = np.random.default_rng(seed)
+    plant_ids = np.arange(num_rows) % NUM_PLANTS + 1
+    time_taken = pd.Timestamp('2025-11-13') + pd.to_timedelta(np.arange(num_rows), unit='s')
+
+    return pd.DataFrame({
+        'plant_id': plant_ids,
+        'species_name': [f'plant {i}' for i in plant_ids],
+        'species_scientific_name': [f'Plantus {i}' for i in plant_ids],
+        'country_name': [f'country {i % 5}' for i in plant_ids],
+        'city_name': [f'city {i % 10}' for i in plant_ids],
+        'origin_latitude': plant_ids / 10,
+        'origin_longitude': plant_ids / 10 + 1,
+        'image_original_url': [f'http://example.com/{i}/original.jpg' for i in plant_ids],
+        'image_regular_url': [f'http://example.com/{i}/regular.jpg' for i in plant_ids],
+        'image_medium_url': [f'http://example.com/{i}/medium.jpg' for i in plant_ids],
+        'image_small_url': [f'http://example.com/{i}/small.jpg' for i in plant_ids],
+        'image_thumbnail_url': [f'http://example.com/{i}/thumbnail.jpg' for i in plant_ids],
+        'license_number': plant_ids % 3,
+        'license_name': [f'license {i % 3}' for i in plant_ids],
+        'license_url': [f'http://example.com/license/{i % 3}' for i in plant_ids],
+        'botanist_name': [f'botanist {i % 5}' for i in plant_ids],
+        'botanist_email': [f'botanist{i % 5}@example.com' for i in plant_ids],
+        'botanist_phone': [f'4412345678{i % 5}' for i in plant_ids],
+        'reading_last_watered': time_taken - pd.Timedelta(hours=2),
+        'reading_time_taken': time_taken,
+        'reading_soil_moisture': rng.normal(40, 10, num_rows),
+        'reading_temperature': rng.normal(15, 3, num_rows),
+        'reading_error': rng.random(num_rows) < 0.05,
+        'reading_alert': rng.random(num_rows) < 0.01
+    })
+
+
+def bench_load(clean_table: pd.DataFrame, bulk: bool, rtt: float) -> tuple[float, int, dict]:
+    """Loads the table into a fresh stand-in, returning total time, round trips and row counts"""
+    conn = StandInConnection()
+    start = time.perf_counter()
+    upload_all_tables(conn, clean_table, bulk=bulk, backend=SqlServerBackend())
+    wall_time = time.perf_counter() - start
+
+    return wall_time + conn.round_trips * rtt, conn.round_trips, conn.count_rows()
+
+
+def to_sql_params_rowwise(df: pd.DataFrame, unique_col: str) -> list[tuple]:
+    """The original row by row params loop, kept as a reference point"""
+    df = df.reset_index()
+    sql_params = []
+    for index, row in enumerate(df.to_numpy()):
+        sql_params.append(tuple(np.append(row[1:], df[unique_col][index])))
+
+    return sql_params
+
+
+def bench_sql_params(num_rows: int) -> bool:
+    """Times building reading params both ways, returning False if over budget"""
+    columns = [col for col in READING_TABLE['columns'] if col != 'botanist_id']
+    df = make_clean_table(num_rows)[[*columns, 'botanist_email']]
+
+    start = time.perf_counter()
+    to_sql_params(df[[*df.columns, 'reading_time_taken']])
+    column_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    to_sql_params_rowwise(df, 'reading_time_taken')
+    row_time = time.perf_counter() - start
+
+    print(f'sql params for {num_rows} rows: column-wise {column_time:.3f}s, '
+          f'row by row {row_time:.3f}s ({row_time / column_time:.0f}x slower)')
+
+    return column_time <= PARAMS_BUDGET
+
+
+def main() -> None:
+    """Compares both load paths at every size"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='Numbers of readings to load')
+    parser.add_argument('--rtt', type=float, default=RTT,
+                        help='Round trip time in seconds to the database')
+    args = parser.parse_args()
+
+    print(f'{"rows":>8} {"path":>8} {"round trips":>12} {"seconds":>9}')
+    for size in args.sizes:
+        clean_table = make_clean_table(size)
+        bulk_time, bulk_trips, bulk_rows = bench_load(clean_table, True, args.rtt)
+        print(f'{size:>8} {"bulk":>8} {bulk_trips:>12} {bulk_time:>9.3f}')
+
+        if size > ROWWISE_MAX_ROWS:
+            continue
+        row_time, row_trips, row_rows = bench_load(clean_table, False, args.rtt)
+        print(f'{size:>8} {"rowwise":>8} {row_trips:>12} {row_time:>9.3f}'
+              f'   ({row_time / bulk_time:.0f}x slower)')
+        if row_rows != bulk_rows:
+            print(f'Loaded rows differ: {row_rows} != {bulk_rows}')
+            sys.exit(1)
+
+    if not bench_sql_params(PARAMS_SIZE):
+        print('Building sql params went over its time budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmarks the reading queries before and after the schema migrations, on a
+local SQLite database seeded with a few days of minute readings. Prints each
+query's plan and time on both schemas: the summary's last day of readings,
+one plant's readings for the dashboard, the loader's duplicate check on plant
+and time, and the retention purge.
+
+Run from the repository root:
+    python -m benchmarks.bench_queries --days 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+from pipeline.backends import SqliteBackend
+from pipeline.migrate import apply_migrations, purge_readings, RETENTION_HOURS
+
+NUM_PLANTS = 50
+DAYS = 3
+REPEATS = 5  # Times each query is run, the fastest is reported
+NUM_PROBES = 1_000  # Duplicate checks the loader makes for one batch of readings
+END_TIME = datetime(2025, 11, 16)
+
+QUERIES = {
+    'summary last day': ("""
+        SELECT * FROM reading WHERE reading_time_taken >= ?;""",
+        (END_TIME - timedelta(days=1),)),
+    'one plant': ("""
+        SELECT reading_time_taken, reading_soil_moisture, reading_temperature
+        FROM reading WHERE plant_id = ? ORDER BY reading_time_taken;""",
+        (7,)),
+    'duplicate check': ("""
+        SELECT 1 FROM reading WHERE plant_id = ? AND reading_time_taken = ?;""",
+        (7, END_TIME - timedelta(minutes=30)))
+}
+
+
+def seed(path: str, days: int) -> int:
+    """Fills a new database with a reading a minute from every plant, returning the count"""
+    backend = SqliteBackend(path, migrate=False)
+    minutes = days * 24 * 60
+    times = [END_TIME - timedelta(minutes=minute) for minute in range(minutes)]
+    rng = np.random.default_rng(0)
+
+    with backend.connection() as conn:
+        cur = conn.cursor()
+        backend.bulk_insert(cur, 'plant', ['plant_id'],
+                            [(plant_id,) for plant_id in range(1, NUM_PLANTS + 1)])
+        params = [(plant_id, time_taken, float(moisture), float(temperature))
+                  for time_taken in times
+                  for plant_id, moisture, temperature in zip(
+                      range(1, NUM_PLANTS + 1), rng.normal(40, 10, NUM_PLANTS),
+                      rng.normal(15, 3, NUM_PLANTS))]
+        backend.bulk_insert(cur, 'reading', ['plant_id', 'reading_time_taken',
+                                             'reading_soil_moisture', 'reading_temperature'],
+                            params)
+    backend.db.close()
+
+    return len(params)
+
+
+def get_plan(conn, sql: str, params: tuple) -> str:
+    """Returns SQLite's query plan as one line"""
+    return '; '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+
+
+def time_query(conn, sql: str, params: tuple, repeats: int) -> float:
+    """Returns the fastest of repeats runs of a query, fetching every row"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def bench_schema(path: str, migrated: bool) -> dict:
+    """Returns the plan and time of every query, and the purge, on one copy of the data"""
+    backend = SqliteBackend(path, migrate=False)
+    results = {}
+    with backend.connection() as conn:
+        if migrated:
+            apply_migrations(conn, backend)
+
+        for name, (sql, params) in QUERIES.items():
+            # the loader checks every reading in a batch, one probe at a time
+            probes = NUM_PROBES if name == 'duplicate check' else 1
+            results[name] = (get_plan(conn, sql, params),
+                             time_query(conn, sql, params, REPEATS) * probes)
+
+        start = time.perf_counter()
+        purge_readings(conn, backend, now=END_TIME)
+        results['retention purge'] = ('', time.perf_counter() - start)
+    backend.db.close()
+
+    return results
+
+
+def main() -> None:
+    """Seeds the database once, then compares every query on the old and migrated schemas"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=DAYS,
+                        help='Days of minute readings to seed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        seeded = os.path.join(folder, 'seeded.db')
+        num_readings = seed(seeded, args.days)
+        print(f'Seeded {num_readings} readings from {NUM_PLANTS} plants over {args.days} days, '
+              f'keeping {RETENTION_HOURS}h\n')
+
+        results = {}
+        for migrated in (False, True):
+            path = os.path.join(folder, f'{migrated}.db')
+            shutil.copy(seeded, path)
+            results[migrated] = bench_schema(path, migrated)
+
+    for name in results[False]:
+        (before_plan, before), (after_plan, after) = results[False][name], results[True][name]
+        change = (f'{before / after:.1f}x faster' if after <= before
+                  else f'{after / before:.1f}x slower')
+        print(f'{name}: {before * 1000:.1f}ms -> {after * 1000:.1f}ms ({change})')
+        if before_plan:
+            print(f'    before: {before_plan}\n    after:  {after_plan}')
+
+    if 'SCAN' in results[True]['duplicate check'][0]:
+        print('The duplicate check still scans the reading table')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmarks summarising readings by fetching every reading and grouping in
+pandas, against grouping in the database and fetching only the aggregates
+and the ranked readings percentiles need. Runs on the local stand-in
+database from bench_load, seeded with a reading a minute from every plant,
+and reports the bytes each path fetches and its wall time for 1, 7 and 30
+days of readings. The time to send the fetched bytes and round trips from
+RDS is added to the local time, as the stand-in has no network.
+
+Run from the repository root:
+    python -m benchmarks.bench_summary --days 1 7 30 --mbps 100
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+from benchmarks.bench_load import StandInConnection, RTT
+from summary.create_summaries import get_reading_data, generate_summary, generate_summary_in_sql
+
+DAYS = (1, 7, 30)
+NUM_PLANTS = 50
+END_TIME = datetime(2025, 12, 1)
+SEED_BATCH = 100_000  # Readings inserted at a time while seeding
+MBPS = 100  # Bandwidth in megabits per second between the summary and RDS
+
+
+def seed(conn: StandInConnection, days: int) -> int:
+    """Fills the stand-in with days of minute readings from every plant, returning the count"""
+    rng = np.random.default_rng(0)
+    plant_ids = np.arange(1, NUM_PLANTS + 1)
+    conn.db.executemany('INSERT INTO plant (plant_id) VALUES (?);',
+                        [(int(plant_id),) for plant_id in plant_ids])
+
+    minutes = days * 24 * 60
+    for start in range(0, minutes, SEED_BATCH // NUM_PLANTS):
+        batch = range(start, min(start + SEED_BATCH // NUM_PLANTS, minutes))
+        num_rows = len(batch) * NUM_PLANTS
+        times = [END_TIME - timedelta(minutes=minute + 1) for minute in batch]
+        conn.db.executemany("""
+            INSERT INTO reading (plant_id, reading_time_taken, reading_last_watered,
+                reading_soil_moisture, reading_temperature, reading_error, reading_alert)
+            VALUES (?, ?, ?, ?, ?, ?, ?);""", zip(
+            np.tile(plant_ids, len(batch)).tolist(),
+            np.repeat(times, NUM_PLANTS).tolist(),
+            np.repeat(times, NUM_PLANTS).tolist(),
+            rng.normal(40, 10, num_rows).tolist(),
+            rng.normal(15, 3, num_rows).tolist(),
+            (rng.random(num_rows) < 0.05).tolist(),
+            (rng.random(num_rows) < 0.01).tolist()))
+
+    return minutes * NUM_PLANTS
+
+
+def bench_path(conn: StandInConnection, summarise, mbps: float,
+               rtt: float) -> tuple[float, int, object]:
+    """Runs one summary path, returning its time with the network's, bytes fetched and summary"""
+    conn.bytes_fetched = 0
+    conn.round_trips = 0
+    start = time.perf_counter()
+    summary = summarise()
+    wall_time = time.perf_counter() - start
+
+    network_time = conn.bytes_fetched * 8 / (mbps * 1e6) + conn.round_trips * rtt
+    return wall_time + network_time, conn.bytes_fetched, summary
+
+
+def main() -> None:
+    """Seeds the largest window once, then compares both paths on every window"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, nargs='+', default=DAYS,
+                        help='Days of readings to summarise')
+    parser.add_argument('--mbps', type=float, default=MBPS,
+                        help='Bandwidth in megabits per second to RDS')
+    parser.add_argument('--rtt', type=float, default=RTT,
+                        help='Round trip time in seconds to RDS')
+    args = parser.parse_args()
+
+    conn = StandInConnection()
+    num_readings = seed(conn, max(args.days))
+    print(f'Seeded {num_readings} readings from {NUM_PLANTS} plants\n')
+
+    print(f'{"days":>5} {"path":>8} {"MB fetched":>11} {"seconds":>9}')
+    for days in args.days:
+        start = END_TIME - timedelta(days=days)
+        pandas_time, pandas_bytes, expected = bench_path(
+            conn, lambda: generate_summary(get_reading_data(conn, start, END_TIME)),
+            args.mbps, args.rtt)
+        sql_time, sql_bytes, summary = bench_path(
+            conn, lambda: generate_summary_in_sql(conn, start, END_TIME), args.mbps, args.rtt)
+
+        print(f'{days:>5} {"pandas":>8} {pandas_bytes / 1e6:>11.2f} {pandas_time:>9.3f}')
+        change = (f'{pandas_time / sql_time:.1f}x faster' if sql_time <= pandas_time
+                  else f'{sql_time / pandas_time:.1f}x slower')
+        print(f'{days:>5} {"sql":>8} {sql_bytes / 1e6:>11.3f} {sql_time:>9.3f}'
+              f'   ({pandas_bytes / sql_bytes:.0f}x fewer bytes, {change})')
+
+        if not np.allclose(summary[expected.columns].to_numpy(dtype=float),
+                           expected.to_numpy(dtype=float)):
+            print(f'Summaries differ over {days} days')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
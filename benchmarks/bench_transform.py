@@ -0,0 +1,178 @@
+"""
+Micro-benchmarks for the transform stage, on synthetic tables.
+Exits with status 1 if any step is slower than its budget, so it can
+guard against regressions.
+
+Run from the repository root:
+    python -m benchmarks.bench_transform
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from pipeline.transform import format_errors, flatten_to_columns, get_nested
+
+SIZES = (10_000, 100_000, 1_000_000)
+ROWWISE_MAX_ROWS = 10_000  # The row by row reference is too slow to run on more
+FORMAT_ERRORS_BUDGET = 1.0  # Time in seconds format_errors may take at any size
+FLATTEN_SIZES = (1_000, 10_000, 100_000)
+
+
+def make_readings(num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Returns a synthetic reading table where about 1 in 20 readings is an error"""
+    rng = np.random.default_rng(seed)
+    errors = np.where(rng.random(num_rows) < 0.05, 'Sensor fault', None)
+
+    return pd.DataFrame({
+        'reading_temperature': rng.normal(15, 3, num_rows),
+        'reading_soil_moisture': rng.normal(40, 10, num_rows),
+        'reading_error': errors
+    })
+
+
+def format_errors_rowwise(data: pd.DataFrame) -> pd.DataFrame:
+    """The original row by row format_errors, kept as a reference point"""
+    for i in range(len(data['reading_temperature'])):
+
+        if pd.notna(data.loc[i, 'reading_error']):
+            data.loc[i, 'reading_error'] = True
+        else:
+            data.loc[i, 'reading_error'] = False
+
+    return data
+
+
+def make_raw_plants(num_plants: int) -> list[dict]:
+    """Returns synthetic raw plants shaped like the api's responses"""
+    return [{
+        'plant_id': i,
+        'name': f'plant {i}',
+        'scientific_name': [f'Plantus {i}'],
+        'origin_location': {'country': 'France', 'city': 'Lyon',
+                            'latitude': 45.7 + i / 1e6, 'longitude': 4.8},
+        'images': {'original_url': f'http://example.com/{i}.jpg', 'license': 45,
+                   'license_name': 'CC-BY', 'license_url': 'http://example.com/l'},
+        'botanist': {'name': 'Crabby', 'email': f'botanist{i % 10}@example.com',
+                     'phone': '+44 1234567890'},
+        'last_watered': '2025-11-13T10:00:00',
+        'recording_taken': '2025-11-13T12:00:00',
+        'soil_moisture': 30.5, 'temperature': 12.25,
+        'error': None if i % 20 else 'Sensor fault'
+    } for i in range(num_plants)]
+
+
+def flatten_data_rowwise(raw_data: list[dict]) -> list[dict]:
+    """The original dict-per-plant flatten_data, kept as a reference point"""
+    rows = []
+    for plant in raw_data:
+        row = {
+            'plant_id': plant.get('plant_id'),
+            'species_name': plant.get('name'),
+            'species_scientific_name': plant.get('scientific_name'),
+            'country_name': get_nested(plant, 'origin_location', 'country'),
+            'city_name': get_nested(plant, 'origin_location', 'city'),
+            'origin_latitude': get_nested(plant, 'origin_location', 'latitude'),
+            'origin_longitude': get_nested(plant, 'origin_location', 'longitude'),
+            'image_original_url': get_nested(plant, 'images', 'original_url'),
+            'image_regular_url': get_nested(plant, 'images', 'regular_url'),
+            'image_medium_url': get_nested(plant, 'images', 'medium_url'),
+            'image_small_url': get_nested(plant, 'images', 'small_url'),
+            'image_thumbnail_url': get_nested(plant, 'images', 'thumbnail'),
+            'license_number': get_nested(plant, 'images', 'license'),
+            'license_name': get_nested(plant, 'images', 'license_name'),
+            'license_url': get_nested(plant, 'images', 'license_url'),
+            'botanist_name': get_nested(plant, 'botanist', 'name'),
+            'botanist_email': get_nested(plant, 'botanist', 'email'),
+            'botanist_phone': get_nested(plant, 'botanist', 'phone'),
+            'reading_last_watered': plant.get('last_watered'),
+            'reading_time_taken': plant.get('recording_taken'),
+            'reading_soil_moisture': plant.get('soil_moisture'),
+            'reading_temperature': plant.get('temperature'),
+            'reading_error': plant.get('error')
+        }
+        if row.get('species_scientific_name'):
+            row['species_scientific_name'] = row['species_scientific_name'][0]
+        rows.append(row)
+
+    return rows
+
+
+def measure(func, raw_data: list[dict]) -> tuple[pd.DataFrame, float, float]:
+    """Returns the table func builds, the seconds it took and its peak memory in MB"""
+    start = time.perf_counter()
+    table = pd.DataFrame(func(raw_data))
+    elapsed = time.perf_counter() - start
+
+    # tracing slows everything down, so memory is measured on a second run
+    tracemalloc.start()
+    pd.DataFrame(func(raw_data))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return table, elapsed, peak / 1024 ** 2
+
+
+def bench_flatten(sizes: tuple) -> bool:
+    """Prints flatten throughput and peak memory, and returns True if the
+    columnar and row by row tables were identical at every size"""
+    identical = True
+    print(f'{"flatten":<16}{"plants":>10}{"rows/s":>14}{"peak MB":>10}'
+          f'{"old rows/s":>14}{"old peak MB":>13}')
+    for size in sizes:
+        raw_data = make_raw_plants(size)
+        columnar, columnar_time, columnar_peak = measure(flatten_to_columns, raw_data)
+        rowwise, rowwise_time, rowwise_peak = measure(flatten_data_rowwise, raw_data)
+        identical = identical and columnar.equals(rowwise)
+        print(f'{"":<16}{size:>10}{size / columnar_time:>14,.0f}{columnar_peak:>10.1f}'
+              f'{size / rowwise_time:>14,.0f}{rowwise_peak:>13.1f}')
+
+    return identical
+
+
+def time_call(func, data: pd.DataFrame) -> float:
+    """Returns the time in seconds func takes on a copy of data"""
+    data = data.copy()
+    start = time.perf_counter()
+    func(data)
+    return time.perf_counter() - start
+
+
+def bench_format_errors(sizes: tuple) -> bool:
+    """Prints format_errors timings and returns True if all were in budget"""
+    in_budget = True
+    print(f'{"format_errors":<16}{"rows":>10}{"vectorized (s)":>16}{"row by row (s)":>16}')
+    for size in sizes:
+        data = make_readings(size)
+        vectorized = time_call(format_errors, data)
+        rowwise = (f'{time_call(format_errors_rowwise, data):>16.4f}'
+                   if size <= ROWWISE_MAX_ROWS else f'{"-":>16}')
+        print(f'{"":<16}{size:>10}{vectorized:>16.4f}{rowwise}')
+        in_budget = in_budget and vectorized <= FORMAT_ERRORS_BUDGET
+
+    return in_budget
+
+
+def main() -> None:
+    """Runs every transform benchmark"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='Numbers of rows to benchmark format_errors on')
+
+    parser.add_argument('--flatten-sizes', type=int, nargs='+', default=FLATTEN_SIZES,
+                        help='Numbers of plants to flatten')
+    args = parser.parse_args()
+
+    if not bench_flatten(tuple(args.flatten_sizes)):
+        print('The columnar flatten built a different table')
+        sys.exit(1)
+
+    if not bench_format_errors(tuple(args.sizes)):
+        print('A transform step went over its time budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
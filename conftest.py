@@ -0,0 +1,9 @@
+"""Fixtures shared by every test module"""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def fake_state_folder(monkeypatch, tmp_path):
+    """Keeps state written between runs out of the working directory"""
+    monkeypatch.delenv('STATE_FOLDER', raising=False)
+    monkeypatch.setattr('pipeline.state.STATE_FOLDER', f'{tmp_path}/state/')
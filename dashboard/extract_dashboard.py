@@ -1,28 +1,13 @@
 """Extracts all data from the RDS to be displayed on the dashboard"""
-import pyodbc
-from dotenv import load_dotenv
-from os import environ
 import pandas as pd
-
-
-def get_db_connection() -> pyodbc.Connection:
-    """Returns a live connection to the database"""
-    load_dotenv()
-    conn = pyodbc.connect(
-        f"DRIVER={{ODBC Driver 18 for SQL Server}};"
-        f"SERVER={environ['DB_HOST']}, {environ['DB_PORT']};"
-        f"DATABASE={environ['DB_NAME']};"
-        f"UID={environ['DB_USER']};"
-        f"PWD={environ['DB_PASSWORD']};"
-        'TrustServerCertificate=yes;'
-    )
-
-    return conn
+from pipeline.db import get_pool
 
 
 def get_all_data() -> pd.DataFrame:
-    """Returns a dataframe of all tables joined"""
-    conn = get_db_connection()
+    """
+    Returns a dataframe of all tables joined, on a pooled connection that
+    outlives each rerun and session of the dashboard
+    """
     query = """
             SELECT *
             FROM reading r
@@ -34,7 +19,8 @@ def get_all_data() -> pd.DataFrame:
             JOIN country co ON co.country_id = ci.country_id
             """
 
-    data = pd.read_sql_query(query, conn)
+    with get_pool().connection() as conn:
+        data = pd.read_sql_query(query, conn)
 
     return data
 
@@ -0,0 +1,11 @@
+-- A plant can only take one reading at a time, and loads check for a
+-- reading by plant and time before inserting it, so index both together.
+-- Keep the first of any readings loaded twice before adding the index.
+DELETE FROM reading
+WHERE reading_id NOT IN (
+    SELECT MIN(reading_id)
+    FROM reading
+    GROUP BY plant_id, reading_time_taken
+);
+
+CREATE UNIQUE INDEX ix_reading_plant_time ON reading (plant_id, reading_time_taken);
@@ -0,0 +1,3 @@
+-- The summary reads the last day of readings and the retention purge
+-- deletes the oldest, both by time alone
+CREATE INDEX ix_reading_time ON reading (reading_time_taken);
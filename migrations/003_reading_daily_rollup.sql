@@ -0,0 +1,22 @@
+-- Daily rollups of each plant's readings, added to as readings are loaded,
+-- so a day's summary reads a row per plant instead of every reading.
+-- Means and standard deviations come from the counts, sums and sums of squares
+CREATE TABLE reading_daily (
+    plant_id INT NOT NULL,
+    rollup_day DATE NOT NULL,
+    reading_count INT NOT NULL DEFAULT 0,
+    error_count INT NOT NULL DEFAULT 0,
+    alert_count INT NOT NULL DEFAULT 0,
+    temperature_count INT NOT NULL DEFAULT 0, -- temperatures which aren't null
+    temperature_sum FLOAT NOT NULL DEFAULT 0,
+    temperature_sumsq FLOAT NOT NULL DEFAULT 0,
+    temperature_min FLOAT,
+    temperature_max FLOAT,
+    moisture_count INT NOT NULL DEFAULT 0, -- moistures which aren't null
+    moisture_sum FLOAT NOT NULL DEFAULT 0,
+    moisture_sumsq FLOAT NOT NULL DEFAULT 0,
+    moisture_min FLOAT,
+    moisture_max FLOAT,
+    PRIMARY KEY (plant_id, rollup_day),
+    FOREIGN KEY (plant_id) REFERENCES plant(plant_id)
+);
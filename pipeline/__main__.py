@@ -0,0 +1,4 @@
+"""Lets the whole pipeline run with python -m pipeline"""
+from pipeline.run import main
+
+main()
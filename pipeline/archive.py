@@ -0,0 +1,263 @@
+# pylint: disable=logging-fstring-interpolation
+"""
+The long-term archive of daily summaries and raw readings, as zstd
+compressed Parquet partitioned by year and month, e.g.
+summaries/year=2025/month=11/day-2025-11-13.parquet. Closed months are
+compacted into one month file, and reads only open the partitions, and row
+groups, a date range and set of plants can be in. The archive is on S3, or
+any local folder, through pyarrow's filesystems
+
+Run from the repository root:
+    python -m pipeline.archive --compact
+"""
+import argparse
+import logging
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from os import environ
+from typing import Iterable
+from dotenv import load_dotenv
+import pandas as pd
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+DAY_FILE = 'day-{day}.parquet'
+MONTH_FILE = 'month-{year}-{month:02d}.parquet'
+ROW_GROUP_SIZE = 10_000  # Rows in each row group, sorted by plant so groups can be skipped
+
+
+def get_filesystem(uri: str = None) -> tuple[pafs.FileSystem, str]:
+    """
+    Returns the filesystem and root folder of an archive URI, by default the
+    ARCHIVE_URI env var or BUCKET_NAME. S3_ENDPOINT points S3 URIs at a
+    stand-in such as MinIO
+    """
+    load_dotenv()
+    uri = uri or environ.get('ARCHIVE_URI') or f"s3://{environ['BUCKET_NAME']}"
+    if uri.startswith('s3://'):
+        filesystem = pafs.S3FileSystem(access_key=environ.get('ACCESS_KEY'),
+                                       secret_key=environ.get('SECRET_ACCESS_KEY'),
+                                       region=environ.get('REGION'),
+                                       endpoint_override=environ.get('S3_ENDPOINT'))
+        return filesystem, uri.removeprefix('s3://').rstrip('/')
+
+    return pafs.LocalFileSystem(), os.path.abspath(uri)
+
+
+def get_months(start: date, end: date) -> list[tuple[int, int]]:
+    """Returns the year and month of every month from start up to end"""
+    months = []
+    year, month = start.year, start.month
+    while date(year, month, 1) < end:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return months
+
+
+class Archive:
+    """
+    Writes each day's summary to its own file in its month's partition, and
+    compacts a month's day files into a single month file. A day file always
+    wins over the month file's rows for that day, so a day can be rewritten
+    after its month was compacted, and a compaction that dies before
+    deleting its day files leaves nothing counted twice
+    """
+    prefix = 'summaries'
+    date_column = 'summary_date'
+
+    def __init__(self, uri: str = None, filesystem: pafs.FileSystem = None):
+        if filesystem is None:
+            self.filesystem, root = get_filesystem(uri)
+        else:
+            self.filesystem, root = filesystem, uri
+        self.root = f'{root}/{self.prefix}'
+
+    def get_month_folder(self, year: int, month: int) -> str:
+        """Returns the partition folder of a month"""
+        return f'{self.root}/year={year}/month={month:02d}'
+
+    def get_day_path(self, day: date) -> str:
+        """Returns the path of a day's file"""
+        return f'{self.get_month_folder(day.year, day.month)}/{DAY_FILE.format(day=day)}'
+
+    def get_month_files(self, year: int, month: int) -> tuple[dict, str]:
+        """Returns a month's day files by day, and its month file's path if it has one"""
+        folder = self.get_month_folder(year, month)
+        selector = pafs.FileSelector(folder, allow_not_found=True)
+        day_files, month_file = {}, None
+        for info in self.filesystem.get_file_info(selector):
+            if info.base_name.startswith('day-') and info.base_name.endswith('.parquet'):
+                day = info.base_name.removeprefix('day-').removesuffix('.parquet')
+                day_files[date.fromisoformat(day)] = info.path
+            elif info.base_name == MONTH_FILE.format(year=year, month=month):
+                month_file = info.path
+
+        return day_files, month_file
+
+    @contextmanager
+    def open_output(self, path: str):
+        """
+        Opens a stream to a temporary file that replaces the file at path only
+        once the block finishes, and is deleted if it fails. S3 streams are
+        multipart uploads, sent a part at a time, which complete whenever they
+        are closed, so a failed write must never be streamed to path itself
+        """
+        self.filesystem.create_dir(path.rsplit('/', 1)[0], recursive=True)
+        temp_path = f'{path}.tmp'
+        try:
+            with self.filesystem.open_output_stream(temp_path) as sink:
+                yield sink
+        except BaseException:
+            if self.filesystem.get_file_info(temp_path).type != pafs.FileType.NotFound:
+                self.filesystem.delete_file(temp_path)
+            raise
+        self.filesystem.move(temp_path, path)
+
+    def write_table(self, df: pd.DataFrame, path: str) -> None:
+        """Writes a table sorted by plant and day, replacing the file at path"""
+        df = df.sort_values(['plant_id', self.date_column], ignore_index=True)
+        with self.open_output(path) as sink:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), sink,
+                           compression='zstd', row_group_size=ROW_GROUP_SIZE)
+
+    def write_day(self, df: pd.DataFrame, day: date) -> str:
+        """Writes a day's table, replacing any written before, and returns its path"""
+        path = self.get_day_path(day)
+        self.write_table(df.assign(**{self.date_column: day}), path)
+        logging.info(f'Archived {self.prefix} of {day} to {path}')
+
+        return path
+
+    def write_day_batches(self, batches: Iterable[pa.RecordBatch], schema: pa.Schema,
+                          day: date) -> str:
+        """
+        Streams a day's record batches into its file, each compressed and sent
+        as its own row group, so only one batch is held in memory however
+        large the day is. Replaces any file written before and returns its path
+        """
+        path = self.get_day_path(day)
+        schema = schema.append(pa.field(self.date_column, pa.date32()))
+        rows = 0
+        with self.open_output(path) as sink, \
+                pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+            for batch in batches:
+                day_column = pa.array([day] * batch.num_rows, pa.date32())
+                writer.write_batch(pa.RecordBatch.from_arrays([*batch.columns, day_column],
+                                                              schema=schema))
+                rows += batch.num_rows
+        logging.info(f'Archived {rows} {self.prefix} of {day} to {path}')
+
+        return path
+
+    def get_days(self, start: date, end: date) -> set[date]:
+        """Returns every day from start up to end that has been archived"""
+        days = set()
+        for year, month in get_months(start, end):
+            day_files, month_file = self.get_month_files(year, month)
+            days.update(day_files)
+            if month_file is not None:
+                table = pq.read_table(month_file, filesystem=self.filesystem,
+                                      columns=[self.date_column])
+                days.update(table.column(self.date_column).unique().to_pylist())
+
+        return {day for day in days if start <= day < end}
+
+    def get_missing_days(self, start: date, end: date) -> list[date]:
+        """Returns every day from start up to end that hasn't been archived, in order"""
+        archived = self.get_days(start, end)
+        days = (start + timedelta(days=offset) for offset in range((end - start).days))
+
+        return [day for day in days if day not in archived]
+
+    def read_file(self, path: str, start: date, end: date, plant_ids: list = None,
+                  skip_days: list = None) -> pd.DataFrame:
+        """Reads the rows of one file from start up to end, for the given plants only"""
+        filters = [(self.date_column, '>=', start), (self.date_column, '<', end)]
+        if plant_ids is not None:
+            filters.append(('plant_id', 'in', list(plant_ids)))
+        if skip_days:
+            filters.append((self.date_column, 'not in', list(skip_days)))
+
+        return pq.read_table(path, filesystem=self.filesystem, filters=filters).to_pandas()
+
+    def read(self, start: date, end: date, plant_ids: list = None) -> pd.DataFrame:
+        """
+        Returns the summaries of every day from start up to end, of the given
+        plants or all of them, only opening the months and day files in range
+        """
+        tables = []
+        for year, month in get_months(start, end):
+            day_files, month_file = self.get_month_files(year, month)
+            if month_file is not None:
+                tables.append(self.read_file(month_file, start, end, plant_ids,
+                                             skip_days=list(day_files)))
+            tables += [self.read_file(path, start, end, plant_ids)
+                       for day, path in day_files.items() if start <= day < end]
+
+        tables = [table for table in tables if not table.empty]
+        if not tables:
+            return pd.DataFrame(columns=['plant_id', self.date_column])
+        return (pd.concat(tables, ignore_index=True)
+                .sort_values([self.date_column, 'plant_id'], ignore_index=True))
+
+    def compact_month(self, year: int, month: int) -> int:
+        """
+        Merges a month's day files into its month file, then deletes them.
+        Returns the number of day files merged
+        """
+        day_files, month_file = self.get_month_files(year, month)
+        if not day_files:
+            return 0
+
+        tables = [pq.read_table(path, filesystem=self.filesystem).to_pandas()
+                  for path in day_files.values()]
+        if month_file is not None:
+            month_table = pq.read_table(month_file, filesystem=self.filesystem).to_pandas()
+            tables.append(month_table[~month_table[self.date_column].isin(list(day_files))])
+
+        path = f'{self.get_month_folder(year, month)}/{MONTH_FILE.format(year=year, month=month)}'
+        self.write_table(pd.concat(tables, ignore_index=True), path)
+        for day_file in day_files.values():
+            self.filesystem.delete_file(day_file)
+        logging.info(f'Compacted {len(day_files)} day files into {path}')
+
+        return len(day_files)
+
+    def compact(self, before: date = None) -> list[tuple[int, int]]:
+        """Compacts every month that ended before the given day, by default today"""
+        before = before or datetime.now(timezone.utc).date()
+        selector = pafs.FileSelector(self.root, recursive=True, allow_not_found=True)
+        months = {tuple(int(part.split('=')[1]) for part in info.path.split('/')[-3:-1])
+                  for info in self.filesystem.get_file_info(selector)
+                  if info.base_name.startswith('day-')}
+
+        compacted = []
+        for year, month in sorted(months):
+            if date(year + month // 12, month % 12 + 1, 1) <= before:
+                self.compact_month(year, month)
+                compacted.append((year, month))
+
+        return compacted
+
+
+class ReadingArchive(Archive):
+    """The archive of every raw reading, written a day at a time before they are purged"""
+    prefix = 'readings'
+    date_column = 'reading_date'
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--compact', action='store_true',
+                        help='Merge the day files of every closed month into month files')
+    parser.add_argument('--uri', help='Archive to use, the ARCHIVE_URI env var by default')
+    args = parser.parse_args()
+
+    if args.compact:
+        Archive(args.uri).compact()
+        ReadingArchive(args.uri).compact()
@@ -0,0 +1,321 @@
+# pylint: disable=c-extension-no-member
+"""
+Storage backends the loader writes through: SQL Server on RDS, or an
+embedded SQLite database built from the same schema.sql, so loads can be
+benchmarked, replayed and tested on one machine with no network
+"""
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from os import environ
+import pandas as pd
+import pyodbc
+from pipeline.db import get_pool
+
+BULK_BATCH_SIZE = 10_000  # Number of rows sent in one round trip by a bulk insert
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'schema.sql')
+SQLITE_PATH = './data/plants.db'
+
+_backends = {}
+
+
+class StorageBackend(ABC):
+    """
+    The statements whose syntax differs between databases: bulk inserts,
+    staging tables, key lookups, inserting a row for its new id, and the
+    catalogue and batched deletes that migrations and retention use.
+    Everything else the loader sends is plain SQL that every backend runs
+    """
+    name = None
+
+    @abstractmethod
+    def connection(self):
+        """Lends a connection for a block, committing if it finishes"""
+
+    def get_max_connections(self) -> int:
+        """Returns how many connections can be lent at the same time"""
+        return 1
+
+    def get_staging_table(self, table_name: str) -> str:
+        """Returns the name of the temporary table a table is staged in"""
+        return f'staging_{table_name}'
+
+    @abstractmethod
+    def create_staging_table(self, cur: pyodbc.Cursor, table_name: str,
+                             column_types: dict) -> str:
+        """Creates an empty temporary staging table and returns its name"""
+
+    def drop_staging_table(self, cur: pyodbc.Cursor, staging_table: str) -> None:
+        """Drops a staging table once it has been merged"""
+        cur.execute(f'DROP TABLE {staging_table};')
+
+    def bulk_insert(self, cur: pyodbc.Cursor, table_name: str, columns: list[str],
+                    params: list[tuple]) -> None:
+        """Inserts every row of params, BULK_BATCH_SIZE rows at a time"""
+        insert_query = f"""
+        INSERT INTO
+            {table_name} ({', '.join(columns)})
+        VALUES
+            ({', '.join('?' for _ in columns)});"""
+        for start in range(0, len(params), BULK_BATCH_SIZE):
+            cur.executemany(insert_query, params[start:start + BULK_BATCH_SIZE])
+
+    def lookup_keys(self, cur: pyodbc.Cursor, table_name: str, key_column: str,
+                    id_column: str) -> dict:
+        """Returns a mapping of every non-null key in a table to its id"""
+        cur.execute(f"""
+                SELECT {key_column}, {id_column}
+                FROM {table_name}
+                WHERE {key_column} IS NOT NULL;""")
+
+        return dict(cur.fetchall())
+
+    @abstractmethod
+    def get_insert_returning_id_query(self, table_name: str, columns: list[str],
+                                      unique_col: str) -> str:
+        """Returns an insert of one row, if its key is new, that returns the row's id"""
+
+    def insert_returning_id(self, cur: pyodbc.Cursor, table_name: str, columns: list[str],
+                            unique_col: str, params: tuple):
+        """Inserts one row unless its key already exists, and returns the row's id"""
+        key = params[columns.index(unique_col)]
+        cur.execute(self.get_insert_returning_id_query(table_name, columns, unique_col),
+                    (*params, key))
+        inserted = cur.fetchone()
+        if inserted is None:
+            # added since the key was last looked up
+            cur.execute(f'SELECT {table_name}_id FROM {table_name} WHERE {unique_col} = ?;',
+                        (key,))
+            inserted = cur.fetchone()
+
+        return inserted[0]
+
+    @abstractmethod
+    def get_day_expression(self, column: str) -> str:
+        """Returns an expression for the day a datetime column falls on"""
+
+    @abstractmethod
+    def has_table(self, cur: pyodbc.Cursor, table_name: str) -> bool:
+        """Returns True if the table exists"""
+
+    @abstractmethod
+    def delete_readings_before(self, cur: pyodbc.Cursor, cutoff: datetime,
+                               batch_size: int) -> int:
+        """Deletes up to batch_size readings taken before cutoff, returning how many"""
+
+
+class SqlServerBackend(StorageBackend):
+    """
+    The RDS SQL Server database, through the shared connection pool, brought
+    up to date with the migrations when it is first used unless migrate is False
+    """
+    name = 'sqlserver'
+
+    def __init__(self, migrate: bool = True):
+        self.migrate = migrate
+        self._migrated = False
+        self._lock = threading.Lock()
+
+    def apply_pending_migrations(self) -> None:
+        """Applies any migrations the database lacks, once per process"""
+        with self._lock:
+            if self._migrated:
+                return
+            # pylint: disable=import-outside-toplevel
+            from pipeline.migrate import apply_migrations
+            with get_pool().connection() as conn:
+                apply_migrations(conn, self)
+            self._migrated = True
+
+    def connection(self):
+        """Lends a pooled connection for a block, committing if it finishes"""
+        if self.migrate and not self._migrated:
+            self.apply_pending_migrations()
+        return get_pool().connection()
+
+    def get_max_connections(self) -> int:
+        """Returns the size of the connection pool"""
+        return get_pool().size
+
+    def get_staging_table(self, table_name: str) -> str:
+        """Returns a session temporary table name, which SQL Server marks with #"""
+        return f'#staging_{table_name}'
+
+    def create_staging_table(self, cur: pyodbc.Cursor, table_name: str,
+                             column_types: dict) -> str:
+        """Creates an empty session temporary staging table and returns its name"""
+        staging_table = self.get_staging_table(table_name)
+        cur.execute(f"""
+        CREATE TABLE {staging_table} (
+            {', '.join(f'{col} {col_type}' for col, col_type in column_types.items())}
+        );""")
+
+        return staging_table
+
+    def bulk_insert(self, cur: pyodbc.Cursor, table_name: str, columns: list[str],
+                    params: list[tuple]) -> None:
+        """Inserts every row of params, sending each batch in one round trip"""
+        cur.fast_executemany = True
+        super().bulk_insert(cur, table_name, columns, params)
+
+    def get_insert_returning_id_query(self, table_name: str, columns: list[str],
+                                      unique_col: str) -> str:
+        """Returns an insert of one row, if its key is new, that outputs the row's id"""
+        return f"""
+        INSERT INTO
+            {table_name} ({', '.join(columns)})
+        OUTPUT INSERTED.{table_name}_id
+        SELECT
+            {', '.join('?' for _ in columns)}
+        WHERE NOT EXISTS
+            (SELECT 1 FROM {table_name} WHERE {unique_col} = ?);"""
+
+    def get_day_expression(self, column: str) -> str:
+        """Returns an expression for the day a datetime column falls on"""
+        return f'CAST({column} AS DATE)'
+
+    def has_table(self, cur: pyodbc.Cursor, table_name: str) -> bool:
+        """Returns True if the table exists"""
+        cur.execute('SELECT 1 FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = ?;',
+                    (table_name,))
+        return cur.fetchone() is not None
+
+    def delete_readings_before(self, cur: pyodbc.Cursor, cutoff: datetime,
+                               batch_size: int) -> int:
+        """Deletes up to batch_size readings taken before cutoff, returning how many"""
+        cur.execute('DELETE TOP (?) FROM reading WHERE reading_time_taken < ?;',
+                    (batch_size, cutoff))
+
+        return cur.rowcount
+
+
+def to_sqlite_time(value: datetime) -> str:
+    """Stores a datetime as naive UTC text, like a DATETIME2 column holds it"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(' ')
+
+
+def get_sqlite_schema(path: str = None) -> str:
+    """Returns schema.sql with its SQL Server only syntax rewritten for SQLite"""
+    with open(path or SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        schema = f.read()
+
+    # an INTEGER PRIMARY KEY is SQLite's auto-incrementing rowid, like IDENTITY
+    return re.sub(r'INT IDENTITY\s*\(1,\s*1\)', 'INTEGER', schema)
+
+
+class SqliteBackend(StorageBackend):
+    """
+    An embedded SQLite database with the schema.sql tables, created on first
+    use and brought up to date with the migrations unless migrate is False.
+    Times are stored as naive UTC and read back as datetimes, and foreign
+    keys are enforced as they are on RDS
+    """
+    name = 'sqlite'
+
+    def __init__(self, path: str = None, migrate: bool = True):
+        self.path = path or SQLITE_PATH
+        self.migrate = migrate
+        self.db = None
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """Opens the database, creating its tables if it is new"""
+        if self.path != ':memory:':
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+
+        db = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES,
+                             check_same_thread=False)
+        db.execute('PRAGMA foreign_keys = ON;')
+        has_schema = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reading';").fetchone()
+        if not has_schema:
+            db.executescript(get_sqlite_schema())
+            if self.migrate:
+                # pylint: disable=import-outside-toplevel
+                from pipeline.migrate import apply_migrations
+                apply_migrations(db, self)
+
+        return db
+
+    @contextmanager
+    def connection(self):
+        """Lends the database for a block, committing if it finishes"""
+        with self._lock:
+            if self.db is None:
+                self.db = self.connect()
+            try:
+                yield self.db
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+
+    def create_staging_table(self, cur: pyodbc.Cursor, table_name: str,
+                             column_types: dict) -> str:
+        """Creates an empty temporary staging table and returns its name"""
+        staging_table = self.get_staging_table(table_name)
+        cur.execute(f"""
+        CREATE TEMP TABLE {staging_table} (
+            {', '.join(f'{col} {col_type}' for col, col_type in column_types.items())}
+        );""")
+
+        return staging_table
+
+    def get_insert_returning_id_query(self, table_name: str, columns: list[str],
+                                      unique_col: str) -> str:
+        """Returns an insert of one row, if its key is new, that returns the row's id"""
+        return f"""
+        INSERT INTO
+            {table_name} ({', '.join(columns)})
+        SELECT
+            {', '.join('?' for _ in columns)}
+        WHERE NOT EXISTS
+            (SELECT 1 FROM {table_name} WHERE {unique_col} = ?)
+        RETURNING {table_name}_id;"""
+
+    def get_day_expression(self, column: str) -> str:
+        """Returns an expression for the day a datetime column falls on"""
+        return f'DATE({column})'
+
+    def has_table(self, cur: pyodbc.Cursor, table_name: str) -> bool:
+        """Returns True if the table exists"""
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;",
+                    (table_name,))
+        return cur.fetchone() is not None
+
+    def delete_readings_before(self, cur: pyodbc.Cursor, cutoff: datetime,
+                               batch_size: int) -> int:
+        """Deletes up to batch_size readings taken before cutoff, returning how many"""
+        cur.execute("""
+        DELETE FROM reading
+        WHERE reading_id IN (
+            SELECT reading_id FROM reading WHERE reading_time_taken < ? LIMIT ?
+        );""", (cutoff, batch_size))
+
+        return cur.rowcount
+
+
+sqlite3.register_adapter(datetime, to_sqlite_time)
+sqlite3.register_adapter(pd.Timestamp, to_sqlite_time)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter('DATETIME2', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('BIT', lambda value: value != b'0')  # bools, as pyodbc returns
+BACKENDS = {'sqlserver': SqlServerBackend, 'sqlite': SqliteBackend}
+
+
+def get_backend(name: str = None) -> StorageBackend:
+    """Returns the named backend, or the DB_BACKEND env var's, defaulting to SQL Server"""
+    name = name or environ.get('DB_BACKEND', 'sqlserver')
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+
+    return _backends[name]
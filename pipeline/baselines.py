@@ -0,0 +1,79 @@
+"""Running per-plant mean and standard deviation of readings, kept between runs"""
+import math
+import pandas as pd
+from pipeline.state import load_state, save_state
+
+BASELINE_STATE = 'plant_baselines'
+BASELINE_COLUMNS = ('reading_temperature', 'reading_soil_moisture')
+MIN_BASELINE_READINGS = 10  # The number of readings a plant needs before its own baseline is used
+
+
+class PlantBaselines:
+    """
+    Keeps a running count, mean and sum of squared differences (Welford's
+    method) of each plant's temperature and soil moisture. Each reading
+    updates them in O(1), so a plant's history never has to be re-read
+    """
+
+    def __init__(self):
+        self.plants = load_state(BASELINE_STATE, {})
+
+    def get_baseline(self, plant_id, column: str) -> tuple[int, float, float]:
+        """Returns the count, mean and sample standard deviation for a plant's column"""
+        count, mean, squared_diffs = self.plants.get(str(plant_id), {}).get(
+            column, (0, 0.0, 0.0))
+        stdev = math.sqrt(squared_diffs / (count - 1)) if count > 1 else math.nan
+
+        return count, mean, stdev
+
+    def get_thresholds(self, data: pd.DataFrame, column: str) -> tuple[pd.Series, pd.Series]:
+        """
+        Returns the mean and standard deviation to judge each row against: the
+        plant's own baseline once it has MIN_BASELINE_READINGS, otherwise the
+        batch's
+        """
+        means, stdevs = {}, {}
+        for plant_id in data['plant_id'].unique():
+            count, mean, stdev = self.get_baseline(plant_id, column)
+            if count >= MIN_BASELINE_READINGS:
+                means[plant_id] = mean
+                stdevs[plant_id] = stdev
+
+        mean = data['plant_id'].map(means).astype(float).fillna(data[column].mean())
+        stdev = data['plant_id'].map(stdevs).astype(float).fillna(data[column].std())
+
+        return mean, stdev
+
+    def update(self, plant_id, time_taken: str, values: dict) -> bool:
+        """
+        Adds one reading to a plant's baselines, unless a reading at or after
+        time_taken has already been added. Returns True if it was added
+        """
+        plant = self.plants.setdefault(str(plant_id), {})
+        if plant.get('last_reading') is not None and time_taken <= plant['last_reading']:
+            return False
+
+        plant['last_reading'] = time_taken
+        for column, value in values.items():
+            if value is None or pd.isna(value):
+                continue
+            count, mean, squared_diffs = plant.get(column, (0, 0.0, 0.0))
+            count += 1
+            delta = value - mean
+            mean += delta / count
+            squared_diffs += delta * (value - mean)
+            plant[column] = (count, mean, squared_diffs)
+
+        return True
+
+    def update_from(self, data: pd.DataFrame) -> None:
+        """Adds every reading that isn't an error to the baselines"""
+        readings = data[~data['reading_error'].astype(bool)]
+        for row in readings[['plant_id', 'reading_time_taken', *BASELINE_COLUMNS]].itertuples(
+                index=False):
+            self.update(row.plant_id, str(row.reading_time_taken),
+                        {column: getattr(row, column) for column in BASELINE_COLUMNS})
+
+    def save(self) -> None:
+        """Saves every baseline for the next run"""
+        save_state(BASELINE_STATE, self.plants)
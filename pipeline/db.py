@@ -0,0 +1,181 @@
+# pylint: disable=c-extension-no-member
+"""
+Shared database access for the pipeline, summary and dashboard: a pool of
+live connections that is kept for the life of the process, so warm Lambda
+invocations and Streamlit reruns reuse connections instead of opening new ones
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from os import environ
+from queue import LifoQueue, Empty
+from dotenv import load_dotenv
+import numpy as np
+import pyodbc
+
+POOL_SIZE = 4  # Most connections open at once, overridden by the DB_POOL_SIZE env var
+ACQUIRE_TIMEOUT = 30  # Time in seconds to wait for a free connection
+HEALTH_CHECK_INTERVAL = 60  # Time in seconds a connection can sit idle before it is checked
+METRIC_WINDOW = 1000  # Number of recent acquire times kept for metrics
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_db_connection() -> pyodbc.Connection:
+    """Returns a new live connection to the database"""
+    load_dotenv()
+    conn = pyodbc.connect(
+        f"DRIVER={{ODBC Driver 18 for SQL Server}};"
+        f"SERVER={environ['DB_HOST']}, {environ['DB_PORT']};"
+        f"DATABASE={environ['DB_NAME']};"
+        f"UID={environ['DB_USER']};"
+        f"PWD={environ['DB_PASSWORD']};"
+        'TrustServerCertificate=yes;'
+    )
+
+    return conn
+
+
+def is_healthy(conn: pyodbc.Connection) -> bool:
+    """Returns True if the connection can still run a query"""
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1;')
+        cur.fetchone()
+        cur.close()
+        return True
+    except pyodbc.Error:
+        return False
+
+
+class ConnectionPool:
+    """
+    Hands out up to size connections, reusing the most recently returned
+    one first. Connections that have been idle for longer than the health
+    check interval are checked before they are handed out, and replaced if
+    they have gone stale
+    """
+
+    def __init__(self, size: int = None, connect=None, health_check_interval: float = None):
+        self.size = size or POOL_SIZE
+        self.connect = connect or get_db_connection
+        self.health_check_interval = health_check_interval or HEALTH_CHECK_INTERVAL
+        self.idle = LifoQueue()
+        self.opened = 0
+        self.discarded = 0
+        self.acquired = 0
+        self.acquire_times = deque(maxlen=METRIC_WINDOW)
+        self._lock = threading.Lock()
+
+    def _open(self) -> pyodbc.Connection:
+        """Opens a new connection, counting it against the pool size"""
+        try:
+            return self.connect()
+        except Exception:
+            with self._lock:
+                self.opened -= 1
+            raise
+
+    def _discard(self, conn: pyodbc.Connection) -> None:
+        """Closes a connection and frees its place in the pool"""
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+        with self._lock:
+            self.opened -= 1
+            self.discarded += 1
+
+    def acquire(self, timeout: float = None) -> pyodbc.Connection:
+        """
+        Returns a healthy connection, opening one if the pool isn't full,
+        otherwise waiting up to timeout seconds for one to be released
+        """
+        timeout = ACQUIRE_TIMEOUT if timeout is None else timeout
+        start = time.perf_counter()
+        while True:
+            try:
+                conn, released_at = self.idle.get_nowait()
+            except Empty:
+                with self._lock:
+                    can_open = self.opened < self.size
+                    if can_open:
+                        self.opened += 1
+                if can_open:
+                    conn = self._open()
+                    break
+                remaining = timeout - (time.perf_counter() - start)
+                try:
+                    conn, released_at = self.idle.get(timeout=max(remaining, 0))
+                except Empty as err:
+                    raise TimeoutError(
+                        f'No database connection free after {timeout}s') from err
+
+            if time.monotonic() - released_at < self.health_check_interval or is_healthy(conn):
+                break
+            self._discard(conn)
+
+        self.acquired += 1
+        self.acquire_times.append(time.perf_counter() - start)
+        return conn
+
+    def release(self, conn: pyodbc.Connection, discard: bool = False) -> None:
+        """Returns a connection to the pool, or closes it if it is broken"""
+        if discard:
+            self._discard(conn)
+        else:
+            self.idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """
+        Lends a connection for the block, committing if the block finishes and
+        rolling back if it raises. Connections that raise a database error are
+        closed rather than returned to the pool
+        """
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+            conn.commit()
+        except pyodbc.Error:
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            conn.rollback()
+            self.release(conn)
+            raise
+        self.release(conn)
+
+    def close(self) -> None:
+        """Closes every idle connection"""
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except Empty:
+                return
+            self._discard(conn)
+
+    def get_metrics(self) -> dict:
+        """Returns connection counts and acquire latencies in milliseconds"""
+        times = np.array(self.acquire_times) * 1000
+        metrics = {'open': self.opened, 'idle': self.idle.qsize(),
+                   'discarded': self.discarded, 'acquired': self.acquired}
+        if len(times):
+            metrics.update({'acquire_mean_ms': float(times.mean()),
+                            'acquire_p95_ms': float(np.percentile(times, 95)),
+                            'acquire_max_ms': float(times.max())})
+
+        return metrics
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide pool, creating it on first use"""
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            load_dotenv()
+            _pool = ConnectionPool(int(environ.get('DB_POOL_SIZE', POOL_SIZE)))
+
+    return _pool
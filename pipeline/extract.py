@@ -5,27 +5,60 @@ import logging
 import argparse
 import os
 import multiprocessing
-import requests as req
+import asyncio
+import contextlib
+import hashlib
 import time
+from datetime import datetime, timezone
+import requests as req
+import aiohttp
+from pipeline.state import load_state, save_state
+from pipeline.ndjson import NdjsonWriter
 
 BASE_URL = 'http://sigma-labs-bot.herokuapp.com/api/plants/'
 OUTPUT_FOLDER = './data/raw_data/'
 OUTPUT_FILE = f'{OUTPUT_FOLDER}plant_data_raw.json'
+NDJSON_OUTPUT_FILE = f'{OUTPUT_FOLDER}plant_data_raw.ndjson'
+OUTPUT_FORMATS = {'json': None, 'ndjson': '', 'ndjson.gz': '.gz', 'ndjson.zst': '.zst'}
 BASE_NUM_ENDPOINTS = 50  # The number of endpoints to fetch from by default
 NUM_PROCESSES_FETCH = 32  # The number of processes to use for reading the api
 NUM_PROCESSES_CHECK = 4  # The number of processes to use for checking new endpoints
 REQUEST_TIMEOUT = 5  # Time in seconds for each request timeout
+MAX_CONCURRENCY = 32  # The number of requests the async engine keeps in flight
+MAX_RETRIES = 3  # The number of times the async engine retries a failed request
+RETRY_BACKOFF = 0.5  # Base delay in seconds between retries, doubled each attempt
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}  # Responses worth retrying
+ENGINES = ('async', 'pool')
+DISCOVERY_GAP_WIDTH = 5  # The number of missing ids in a row tolerated before the last plant
+HIGH_WATER_MARK_STATE = 'endpoint_high_water_mark'
+PLANT_READINGS_STATE = 'plant_readings'
+CIRCUIT_STATE = 'plant_circuits'
+FAILURE_THRESHOLD = 3  # The number of failed runs in a row before a plant's circuit opens
+COOLDOWN_RUNS = 5  # The number of runs a plant is skipped for once its circuit opens
+MAX_COOLDOWN_RUNS = 60  # Cooldown doubles each time a circuit re-opens, up to this
+FAILURE_KINDS = ('timeout', 'connection_error', 'http_error', 'malformed_body')
+REPORT_FOLDER = './data/reports/'
+REPORT_FILE = f'{REPORT_FOLDER}extract_report.json'
 
 
-def set_up_logging() -> None:
-    """Configures logging based on --verbose flag"""
+def get_args() -> argparse.Namespace:
+    """Parses the command line arguments for the extract script"""
     parser = argparse.ArgumentParser()
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Log extra information to console')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='async',
+                        help='Fetch plants with a single asyncio client or a process pool')
+    parser.add_argument('-o', '--output-format', choices=OUTPUT_FORMATS, default='json',
+                        help='Save one json array, or stream one record per line')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only output plants whose reading changed since the last run')
+
+    return parser.parse_args()
 
-    args = parser.parse_args()
 
-    if args.verbose:
+def set_up_logging(verbose: bool) -> None:
+    """Configures logging based on --verbose flag"""
+    if verbose:
         logging.basicConfig(level=logging.INFO)
         return
 
@@ -33,13 +66,248 @@ def set_up_logging() -> None:
 
 
 def fetch_data_by_id(plant_id: int) -> dict:
-    """Returns a dict with status code and response data"""
-    response = req.get(f"{BASE_URL}{plant_id}", timeout=REQUEST_TIMEOUT)
+    """
+    Returns a dict with status code, response data and the kind of failure,
+    if any. Never raises, so one dead sensor can't stop the whole extract
+    """
+    try:
+        response = req.get(f"{BASE_URL}{plant_id}", timeout=REQUEST_TIMEOUT)
+    except req.Timeout:
+        return {'status_code': None, 'body': None, 'error': 'timeout'}
+    except req.RequestException:
+        return {'status_code': None, 'body': None, 'error': 'connection_error'}
 
     status_code = response.status_code
-    body = response.json()
+    try:
+        body = response.json()
+    except ValueError:
+        return {'status_code': status_code, 'body': None, 'error': 'malformed_body'}
+
+    error = None if status_code == 200 else 'http_error'
+    return {'status_code': status_code, 'body': body, 'error': error}
+
+
+def classify_failure(response: dict) -> str | None:
+    """Returns which of FAILURE_KINDS a response is, or None if it succeeded"""
+    if response.get('error'):
+        return response['error']
+    if response.get('status_code') is None:
+        return 'connection_error'
+    if response.get('status_code') != 200:
+        return 'http_error'
+    return None
+
+
+def fetch_with_pool(plant_ids: range, processes: int = NUM_PROCESSES_FETCH) -> list[dict]:
+    """Fetches all the given ids using a pool of worker processes"""
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(fetch_data_by_id, plant_ids)
+
+
+class AsyncPlantClient:
+    """
+    Fetches plants over a single pooled, keep-alive HTTP session.
+    Used as a context manager, fetch_many can be called any number of
+    times and every call reuses the same event loop and connections.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY,
+                 timeout: float = REQUEST_TIMEOUT, max_retries: int = MAX_RETRIES,
+                 backoff: float = RETRY_BACKOFF):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._runner = asyncio.Runner()
+        self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """Closes the HTTP session and the event loop"""
+        if self._session is not None:
+            self._runner.run(self._session.close())
+            self._session = None
+        self._runner.close()
+
+    def fetch_many(self, plant_ids: range, on_result=None) -> list[dict]:
+        """
+        Returns a result dict for every id, in the same order as plant_ids.
+        If on_result is given, each id and its result are passed to it as
+        soon as they arrive instead of being collected, and an empty list
+        is returned
+        """
+        return self._runner.run(self._fetch_many(plant_ids, on_result))
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Creates the shared session on first use, inside the running loop"""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency,
+                                             keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def _fetch_many(self, plant_ids: range, on_result=None) -> list[dict]:
+        """Fetches all ids concurrently, never exceeding max_concurrency"""
+        session = await self._get_session()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded_fetch(plant_id: int) -> dict | None:
+            async with semaphore:
+                result = await self.fetch_data_by_id(session, plant_id)
+            if on_result is None:
+                return result
+            on_result(plant_id, result)
+            return None
+
+        results = await asyncio.gather(*(bounded_fetch(i) for i in plant_ids))
+
+        return results if on_result is None else []
+
+    async def fetch_data_by_id(self, session: aiohttp.ClientSession, plant_id: int) -> dict:
+        """
+        Returns a dict with status code, response data and the kind of
+        failure, if any. Timeouts, connection errors and retryable status
+        codes are retried with exponential backoff
+        """
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.get(f"{BASE_URL}{plant_id}") as response:
+                    if response.status in RETRY_STATUS_CODES and attempt < self.max_retries:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, (), status=response.status)
+                    try:
+                        body = await response.json(content_type=None)
+                    except ValueError:
+                        return {'status_code': response.status, 'body': None,
+                                'error': 'malformed_body'}
+                    error = None if response.status == 200 else 'http_error'
+                    return {'status_code': response.status, 'body': body, 'error': error}
+            except asyncio.TimeoutError:
+                error = 'timeout'
+            except aiohttp.ClientResponseError:
+                error = 'http_error'
+            except aiohttp.ClientError:
+                error = 'connection_error'
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+        logging.error(f'Giving up on plant {plant_id}: {error}')
+        return {'status_code': None, 'body': None, 'error': error}
+
+
+class ChangedPlantFilter:
+    """
+    Remembers the last recording_taken and a content hash for every plant,
+    so plants that haven't changed since the last run can be skipped.
+    Nothing is remembered until save is called, so a run that fails part
+    way through will see the same plants as changed next time
+    """
+
+    def __init__(self):
+        self.last_seen = load_state(PLANT_READINGS_STATE, {})
+        self.emitted = 0
+        self.skipped = 0
+        self._pending = {}
+
+    @staticmethod
+    def get_content_hash(plant: dict) -> str:
+        """Returns a stable hash of everything in a plant's response body"""
+        content = json.dumps(plant, sort_keys=True, default=str)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def is_changed(self, plant: dict) -> bool:
+        """Returns True, and counts it as emitted, if the plant has changed"""
+        plant_id = str(plant.get('plant_id'))
+        current = {'recording_taken': plant.get('recording_taken'),
+                   'hash': self.get_content_hash(plant)}
+
+        if self.last_seen.get(plant_id) == current:
+            self.skipped += 1
+            return False
 
-    return {'status_code': status_code, 'body': body}
+        self._pending[plant_id] = current
+        self.emitted += 1
+        return True
+
+    def get_counters(self) -> dict:
+        """Returns the number of plants emitted and skipped so far"""
+        return {'emitted': self.emitted, 'skipped': self.skipped}
+
+    def save(self) -> None:
+        """Remembers every plant emitted so far for the next run"""
+        self.last_seen.update(self._pending)
+        self._pending = {}
+        save_state(PLANT_READINGS_STATE, self.last_seen)
+
+
+class CircuitBreaker:
+    """
+    Tracks failures per plant across runs. Once a plant has failed
+    FAILURE_THRESHOLD runs in a row its circuit opens and it is skipped for
+    a cooldown of runs. It is then tried once more: a success closes the
+    circuit, a failure re-opens it with double the cooldown
+    """
+
+    def __init__(self, failure_threshold: int = None, cooldown_runs: int = None):
+        self.failure_threshold = failure_threshold or FAILURE_THRESHOLD
+        self.cooldown_runs = cooldown_runs or COOLDOWN_RUNS
+        self.circuits = load_state(CIRCUIT_STATE, {})
+        self.opened = []
+
+    def filter_ids(self, plant_ids: range) -> tuple[list[int], list[int]]:
+        """
+        Returns the ids to fetch this run and the ids skipped because their
+        circuit is open, counting this run towards each skipped cooldown
+        """
+        to_fetch, skipped = [], []
+        for plant_id in plant_ids:
+            circuit = self.circuits.get(str(plant_id))
+            if circuit and circuit['skip_runs'] > 0:
+                circuit['skip_runs'] -= 1
+                skipped.append(plant_id)
+            else:
+                to_fetch.append(plant_id)
+
+        return to_fetch, skipped
+
+    def record(self, plant_id: int, failure: str | None) -> None:
+        """Records the outcome of fetching a plant this run"""
+        key = str(plant_id)
+        if failure is None:
+            self.circuits.pop(key, None)
+            return
+
+        circuit = self.circuits.setdefault(
+            key, {'failures': 0, 'skip_runs': 0, 'cooldown': self.cooldown_runs})
+        circuit['failures'] += 1
+        circuit['last_failure'] = failure
+
+        if circuit['failures'] >= self.failure_threshold:
+            circuit['skip_runs'] = circuit['cooldown']
+            circuit['cooldown'] = min(circuit['cooldown'] * 2, MAX_COOLDOWN_RUNS)
+            self.opened.append(plant_id)
+
+    def save(self) -> None:
+        """Saves every circuit for the next run"""
+        save_state(CIRCUIT_STATE, self.circuits)
+
+
+def save_report(report: dict) -> None:
+    """Saves the report of the latest extract run to a json file"""
+    if not os.path.exists(REPORT_FOLDER):
+        os.makedirs(REPORT_FOLDER)
+
+    with open(REPORT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
 
 
 def save_to_json(data: list[dict]) -> None:
@@ -51,44 +319,179 @@ def save_to_json(data: list[dict]) -> None:
         json.dump(data, f, indent=4)
 
 
-def check_new_endpoints() -> int:
-    """Checks for new endpoints and returns max endpoint to be read"""
-    current_max_endpoint = BASE_NUM_ENDPOINTS
+def find_max_live_id(fetch_many, start: int, width: int) -> int | None:
+    """Returns the highest id in [start, start + width) that responds with 200"""
+    data = fetch_many(range(start, start + width))
+    live_ids = [start + i for i, endpoint in enumerate(data)
+                if endpoint.get('status_code') == 200]
+
+    return max(live_ids) if live_ids else None
+
 
-    new_endpoints = True
+def check_new_endpoints(fetch_many=None, gap_width: int = DISCOVERY_GAP_WIDTH) -> int:
+    """
+    Checks for new endpoints and returns max endpoint to be read.
+    Starts from the max endpoint found on the last run, gallops outwards in
+    exponentially growing steps, then binary searches for the edge. Every
+    probe is a window of gap_width + 1 ids, so holes of up to gap_width
+    missing ids do not end the search early.
+    fetch_many takes a range of ids and returns their result dicts, it
+    defaults to a small process pool
+    """
+    if fetch_many is None:
+        def fetch_many(plant_ids):
+            return fetch_with_pool(plant_ids, NUM_PROCESSES_CHECK)
 
-    while new_endpoints:
-        with multiprocessing.Pool(NUM_PROCESSES_CHECK) as pool:
-            data = pool.map(fetch_data_by_id, range(
-                current_max_endpoint, current_max_endpoint + 5))
+    window = gap_width + 1
+    saved = load_state(HIGH_WATER_MARK_STATE, {})
+    known_max = max(saved.get('max_endpoint', BASE_NUM_ENDPOINTS), BASE_NUM_ENDPOINTS)
 
-        for endpoint in data:
-            if endpoint.get('status_code') == 200:
-                current_max_endpoint += 5
+    # lower is always live (or the base number of endpoints), nothing at or past upper is
+    live_id = find_max_live_id(fetch_many, known_max, window)
+    if live_id is None:
+        lower, upper = BASE_NUM_ENDPOINTS, known_max
+    else:
+        lower = live_id
+        step = window
+        while True:
+            live_id = find_max_live_id(fetch_many, lower + step, window)
+            if live_id is None:
+                upper = lower + step
                 break
+            lower = live_id
+            step *= 2
+
+    while upper - lower > 1:
+        middle = (lower + upper) // 2
+        live_id = find_max_live_id(fetch_many, middle, min(window, upper - middle))
+        if live_id is None:
+            upper = middle
+        else:
+            lower = live_id
+
+    logging.info(f'Max endpoint found: {lower}')
+    save_state(HIGH_WATER_MARK_STATE, {'max_endpoint': lower})
+
+    return lower
+
+
+def fetch_all_plants(engine: str, breaker: CircuitBreaker, on_result) -> dict:
+    """
+    Discovers the max endpoint and fetches every plant whose circuit is
+    closed, passing each id and response to on_result as soon as it
+    arrives. Returns which ids were requested and which were skipped
+    """
+    if engine == 'async':
+        with AsyncPlantClient() as client:
+            max_endpoint = check_new_endpoints(client.fetch_many)
+            plant_ids, skipped = breaker.filter_ids(range(1, max_endpoint + 1))
+            client.fetch_many(plant_ids, on_result)
+    else:
+        max_endpoint = check_new_endpoints()
+        plant_ids, skipped = breaker.filter_ids(range(1, max_endpoint + 1))
+        with multiprocessing.Pool(NUM_PROCESSES_FETCH) as pool:
+            for plant_id, response in zip(plant_ids, pool.imap(fetch_data_by_id, plant_ids)):
+                on_result(plant_id, response)
+
+    return {'max_endpoint': max_endpoint, 'requested': plant_ids, 'skipped': skipped}
+
+
+def extract_plants(engine: str = 'async', output_format: str = None,
+                   changed_filter: ChangedPlantFilter = None) -> tuple[list[dict], dict]:
+    """
+    Fetches every plant and returns the successful ones, sorted by id,
+    along with a report of the run: counts of the plants emitted and
+    skipped by changed_filter, every failed id by kind of failure, and the
+    ids skipped or newly skipped by the circuit breaker.
+    With an output_format the plants are also saved, an ndjson format
+    streams them to disk as they arrive and returns an empty list instead.
+    changed_filter is not saved, so callers can save it once the plants
+    are safely stored
+    """
+    started_at = datetime.now(timezone.utc)
+    breaker = CircuitBreaker()
+    failures = {kind: [] for kind in FAILURE_KINDS}
+
+    emitted_data = []
+    output_file = None
+    if output_format not in (None, 'json'):
+        output_file = f'{NDJSON_OUTPUT_FILE}{OUTPUT_FORMATS[output_format]}'
+
+    with contextlib.ExitStack() as stack:
+        if output_file is None:
+            def emit(plant_id: int, body: dict) -> None:
+                emitted_data.append((plant_id, body))
+        else:
+            writer = stack.enter_context(NdjsonWriter(output_file))
+
+            def emit(plant_id: int, body: dict) -> None:
+                emitted_data.append((plant_id, None))
+                writer.write(body)
+
+        def on_result(plant_id: int, response: dict) -> None:
+            failure = classify_failure(response)
+            breaker.record(plant_id, failure)
+            if failure is not None:
+                failures[failure].append(plant_id)
+                return
+            body = response.get('body')
+            if changed_filter is None or changed_filter.is_changed(body):
+                emit(plant_id, body)
+
+        fetched = fetch_all_plants(engine, breaker, on_result)
+
+    plants = []
+    if output_file is None:
+        plants = [body for _, body in sorted(emitted_data, key=lambda x: x[0])]
+        if output_format == 'json':
+            save_to_json(plants)
+    else:
+        logging.info(f'Streamed {len(emitted_data)} plants to {output_file}')
+
+    breaker.save()
 
-            new_endpoints = False
+    report = {
+        'started_at': started_at.isoformat(),
+        'duration': (datetime.now(timezone.utc) - started_at).total_seconds(),
+        'engine': engine,
+        'max_endpoint': fetched['max_endpoint'],
+        'requested': len(fetched['requested']),
+        'succeeded': len(fetched['requested']) - sum(len(ids) for ids in failures.values()),
+        'emitted': len(emitted_data),
+        'skipped': changed_filter.skipped if changed_filter else 0,
+        'failures': failures,
+        'circuit_open': fetched['skipped'],
+        'circuit_opened': breaker.opened
+    }
+    save_report(report)
 
-    return current_max_endpoint
+    return plants, report
 
 
-def extract_data() -> None:
-    """Runs the extract functions for all ids and catches error"""
-    data = []
-    max_endpoint = check_new_endpoints()
-    with multiprocessing.Pool(NUM_PROCESSES_FETCH) as pool:
-        data = pool.map(fetch_data_by_id, range(1, max_endpoint + 1))
+def extract_data(engine: str = 'async', output_format: str = 'json',
+                 incremental: bool = False) -> dict:
+    """
+    Runs the extract functions for all ids and catches error.
+    Saves the plants in the given format and returns the report of the run
+    """
+    changed_filter = ChangedPlantFilter() if incremental else None
+    _, report = extract_plants(engine, output_format, changed_filter)
 
-    successful_data = [
-        response.get('body') for response in data if response.get('status_code') == 200]
+    if changed_filter is not None:
+        changed_filter.save()
 
-    save_to_json(successful_data)
+    return report
 
 
 if __name__ == "__main__":
     start_time = time.time()
-    set_up_logging()
-    extract_data()
+    arguments = get_args()
+    set_up_logging(arguments.verbose)
+    run_report = extract_data(arguments.engine, arguments.output_format,
+                              arguments.incremental)
+    logging.info(f'Plants emitted = {run_report["emitted"]}, '
+                 f'skipped = {run_report["skipped"]}, '
+                 f'circuit open = {len(run_report["circuit_open"])}')
     end_time = time.time()
     time_taken = end_time - start_time
     logging.info('Time taken = %s', time_taken)
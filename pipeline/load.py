@@ -1,15 +1,22 @@
 # pylint: disable=c-extension-no-member
 
 """Loads all local table data and uploads them to the RDS"""
-from os import environ
-from dotenv import load_dotenv
+import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 import pandas as pd
+import pyarrow as pa
 import pyodbc
 import numpy as np
 from datetime import datetime
 from pprint import pprint
+from pipeline.state import load_state, save_state
+from pipeline.backends import StorageBackend, get_backend, BACKENDS
+from pipeline.rollups import get_rollup_deltas, add_to_rollups, refresh_rollups
 
 DATA_FILEPATH = './data/clean_data.csv'
+FINGERPRINT_STATE = 'dimension_fingerprints'
 
 TABLES = [
     {
@@ -64,19 +71,48 @@ FOREIGN_TABLES = [
 ]
 
 
-def get_db_connection() -> pyodbc.Connection:
-    """Returns a live connection to the database"""
-    load_dotenv()
-    conn = pyodbc.connect(
-        f"DRIVER={{ODBC Driver 18 for SQL Server}};"
-        f"SERVER={environ['DB_HOST']}, {environ['DB_PORT']};"
-        f"DATABASE={environ['DB_NAME']};"
-        f"UID={environ['DB_USER']};"
-        f"PWD={environ['DB_PASSWORD']};"
-        'TrustServerCertificate=yes;'
-    )
+def read_clean_table(path: str) -> pd.DataFrame:
+    """
+    Reads the clean table saved by transform. Parquet and Arrow files keep
+    their types, and .arrow files are memory mapped rather than read into a
+    buffer first
+    """
+    path = str(path)
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.arrow'):
+        with pa.memory_map(path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    return pd.read_csv(path)
+
+
+def get_column_values(column: pd.Series) -> list:
+    """
+    Returns a column as a list of native python values, datetimes, floats,
+    ints and bools, with missing values as None
+    """
+    if pd.api.types.is_datetime64_any_dtype(column):
+        values = column.array.to_pydatetime().tolist()
+    else:
+        values = column.to_numpy().tolist()
+
+    missing = column.isna().to_numpy()
+    if missing.any():
+        values = [None if is_missing else value
+                  for value, is_missing in zip(values, missing)]
 
-    return conn
+    return values
+
+
+def to_sql_params(df: pd.DataFrame) -> list[tuple]:
+    """
+    Returns one tuple per row for executemany, built a column at a time so
+    each value keeps its own python type
+    """
+    columns = [get_column_values(df.iloc[:, i]) for i in range(df.shape[1])]
+    return list(zip(*columns))
 
 
 def upload_table_data_with_foreign_key(conn: pyodbc.Connection, table_dict: dict, df: pd.DataFrame) -> None:
@@ -131,33 +167,29 @@ def upload_table_data_with_foreign_key(conn: pyodbc.Connection, table_dict: dict
                 {foreign_table['unique_column']} = ?),"""
     sql_query = sql_query[:-1]
 
+    # a reading is only a duplicate of one taken by the same plant at the same time
+    unique_cols = ['plant_id', unique_col] if table_name == 'reading' else [unique_col]
     sql_query += f"""
         WHERE NOT EXISTS
-            (SELECT 1 FROM {table_name} WHERE {unique_col} = ?);"""
+            (SELECT 1 FROM {table_name} WHERE {' AND '.join(f'{col} = ?' for col in unique_cols)});"""
 
-    df = df[all_foreign_unique_columns]
+    df = df[all_foreign_unique_columns].copy()
     if table_dict['table_name'] != 'reading':
-        df = df.dropna().reset_index()
+        df = df.dropna()
     else:
-        df = df.fillna(np.nan).replace([np.nan], None)
-
-        df['reading_last_watered'] = pd.to_datetime(
-            df['reading_last_watered'],
-            format="ISO8601", utc=True)
-
-        df['reading_time_taken'] = pd.to_datetime(
-            df['reading_time_taken'],
-            format="ISO8601", utc=True)
+        # typed tables already hold datetimes, only text from a csv needs parsing
+        for column in ['reading_last_watered', 'reading_time_taken']:
+            if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = pd.to_datetime(df[column], format="ISO8601", utc=True)
+            elif df[column].dt.tz is None:
+                df[column] = df[column].dt.tz_localize('UTC')
+            else:
+                df[column] = df[column].dt.tz_convert('UTC')
 
     # params for executemany must be a tuple, and must include the
     # values we want to insert, and the unique value to check against
     # e.g. ('Albania', 'Albania') inserts Albania only if Albania doesn't exist
-    sql_params = []
-    for index, row in enumerate(df.to_numpy()):
-        if table_dict['table_name'] == 'reading':
-            sql_params.append(tuple(np.append(row, df[unique_col][index])))
-        else:
-            sql_params.append(tuple(np.append(row[1:], df[unique_col][index])))
+    sql_params = to_sql_params(df[[*df.columns, *unique_cols]])
 
     cur = conn.cursor()
     cur.executemany(sql_query, sql_params)
@@ -182,32 +214,462 @@ def upload_table_data(conn: pyodbc.Connection, table_dict: dict, df: pd.DataFram
         ;
     """
 
-    df = df.dropna().reset_index()
+    df = df.dropna()
 
     # params for executemany must be a tuple, and must include the
     # values we want to insert, and the unique value to check against
     # e.g. ('Albania', 'Albania') inserts Albania only if Albania doesn't exist
-    sql_params = []
-    for index, row in enumerate(df.to_numpy()):
-        sql_params.append(tuple(np.append(row[1:], df[unique_col][index])))
+    sql_params = to_sql_params(df[[*df.columns, unique_col]])
 
     cur = conn.cursor()
     cur.executemany(sql_query, sql_params)
     cur.close()
 
 
-if __name__ == '__main__':
-    clean_table = pd.read_csv(DATA_FILEPATH)
-    with get_db_connection() as connection:
+def get_table(table_name: str) -> dict:
+    """Returns the table dict with the given name"""
+    for table in TABLES + FOREIGN_TABLES:
+        if table['table_name'] == table_name:
+            return table
+    raise KeyError(f'No table called {table_name}')
 
-        for table in TABLES:
-            upload_table_data(
-                conn=connection, table_dict=table, df=clean_table[table['columns']])
 
-        for table in FOREIGN_TABLES:
-            if table['table_name'] == 'reading':
-                upload_table_data_with_foreign_key(
-                    conn=connection, table_dict=table, df=clean_table)
-            else:
-                upload_table_data_with_foreign_key(
-                    conn=connection, table_dict=table, df=clean_table)
+def get_foreign_keys(table_dict: dict) -> list[str]:
+    """Returns the id columns of a table that point at another table"""
+    own_id = f"{table_dict['table_name']}_id"
+    return [col for col in table_dict['columns']
+            if col.endswith('_id') and col != own_id]
+
+
+DIMENSION_TABLES = [table for table in TABLES + FOREIGN_TABLES
+                    if table['table_name'] != 'reading']
+READING_TABLE = get_table('reading')
+
+
+def lookup_dimension_keys(conn: pyodbc.Connection, backend: StorageBackend = None) -> dict:
+    """Returns a mapping of each dimension table's unique column to its id, a SELECT per table"""
+    backend = backend or get_backend()
+    cur = conn.cursor()
+    keys = {table['table_name']: backend.lookup_keys(cur, table['table_name'],
+                                                     table['unique_column'],
+                                                     f"{table['table_name']}_id")
+            for table in DIMENSION_TABLES}
+    cur.close()
+
+    return keys
+
+
+class DimensionKeyCache:
+    """
+    Maps each dimension table's unique column to its id, so foreign keys can
+    be resolved in python instead of with a subquery per row. Also keeps the
+    latest reading time of each plant, so readings already loaded are
+    dropped without a NOT EXISTS check
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.latest_readings = {}
+
+    def warm(self, conn: pyodbc.Connection, backend: StorageBackend = None) -> None:
+        """Loads every key with a single SELECT per table"""
+        self.keys.update(lookup_dimension_keys(conn, backend))
+
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT plant_id, MAX(reading_time_taken)
+            FROM reading
+            GROUP BY plant_id;""")
+        self.latest_readings = {plant_id: pd.Timestamp(time_taken).to_pydatetime()
+                                for plant_id, time_taken in cur.fetchall()}
+        cur.close()
+
+    def resolve_foreign_keys(self, table_dict: dict, df: pd.DataFrame) -> pd.DataFrame:
+        """Returns df with each foreign id column filled in from the cache"""
+        df = df.copy()
+        for foreign_key in get_foreign_keys(table_dict):
+            foreign_table = get_table(foreign_key.removesuffix('_id'))
+            df[foreign_key] = df[foreign_table['unique_column']].map(
+                self.keys.get(foreign_table['table_name'], {}))
+
+        return df
+
+
+def upload_dimension_data(conn: pyodbc.Connection, table_dict: dict, df: pd.DataFrame,
+                          cache: DimensionKeyCache, backend: StorageBackend = None) -> None:
+    """
+    Inserts only the rows whose unique column isn't in the cache yet, and
+    adds the ids they are given to the cache
+    """
+    table_name = table_dict['table_name']
+    unique_col = table_dict['unique_column']
+    columns = table_dict['columns']
+    known_keys = cache.keys.setdefault(table_name, {})
+
+    df = df[get_staging_columns(table_dict)].dropna()
+    df = df.drop_duplicates(subset=unique_col)
+    df = df[~df[unique_col].isin(list(known_keys))]
+    if df.empty:
+        return
+    df = cache.resolve_foreign_keys(table_dict, df)[columns]
+
+    backend = backend or get_backend()
+    cur = conn.cursor()
+    unique_index = columns.index(unique_col)
+    for params in to_sql_params(df):
+        known_keys[params[unique_index]] = backend.insert_returning_id(
+            cur, table_name, columns, unique_col, params)
+    cur.close()
+
+
+def upload_reading_data(conn: pyodbc.Connection, df: pd.DataFrame,
+                        cache: DimensionKeyCache, backend: StorageBackend = None) -> None:
+    """
+    Inserts the readings taken after each plant's latest loaded reading, with
+    every foreign key already resolved, as plain parameterised inserts, and
+    adds them to their plant's daily rollups
+    """
+    columns = READING_TABLE['columns']
+    df = cache.resolve_foreign_keys(READING_TABLE, df)
+
+    for column in ['reading_last_watered', 'reading_time_taken']:
+        df[column] = pd.to_datetime(df[column], format='ISO8601', utc=True)
+        df[column] = df[column].dt.tz_localize(None)
+
+    latest = pd.to_datetime(df['plant_id'].map(cache.latest_readings))
+    df = df[latest.isna() | (df['reading_time_taken'] > latest)]
+    df = df.drop_duplicates(subset=['plant_id', 'reading_time_taken'])
+    if df.empty:
+        return
+
+    backend = backend or get_backend()
+    cur = conn.cursor()
+    backend.bulk_insert(cur, 'reading', columns, to_sql_params(df[columns]))
+    add_to_rollups(cur, get_rollup_deltas(df))
+    cur.close()
+
+    for plant_id, time_taken in df.groupby('plant_id')['reading_time_taken'].max().items():
+        cache.latest_readings[plant_id] = time_taken.to_pydatetime()
+
+
+COLUMN_TYPES = {
+    'country_name': 'VARCHAR(255)',
+    'botanist_name': 'VARCHAR(255)',
+    'botanist_email': 'VARCHAR(255)',
+    'botanist_phone': 'VARCHAR(255)',
+    'license_name': 'VARCHAR(255)',
+    'license_number': 'INT',
+    'license_url': 'VARCHAR(255)',
+    'city_name': 'VARCHAR(255)',
+    'origin_longitude': 'FLOAT',
+    'origin_latitude': 'FLOAT',
+    'image_original_url': 'VARCHAR(255)',
+    'image_regular_url': 'VARCHAR(255)',
+    'image_medium_url': 'VARCHAR(255)',
+    'image_small_url': 'VARCHAR(255)',
+    'image_thumbnail_url': 'VARCHAR(255)',
+    'species_name': 'VARCHAR(255)',
+    'species_scientific_name': 'VARCHAR(255)',
+    'plant_id': 'INT',
+    'reading_last_watered': 'DATETIME2',
+    'reading_time_taken': 'DATETIME2',
+    'reading_soil_moisture': 'FLOAT',
+    'reading_temperature': 'FLOAT',
+    'reading_error': 'BIT',
+    'reading_alert': 'BIT'
+}
+
+
+def get_staging_columns(table_dict: dict) -> list[str]:
+    """
+    Returns the columns a table is staged with: its own values, plus the
+    unique column of every table it points at in place of that table's id
+    """
+    foreign_keys = get_foreign_keys(table_dict)
+    staging_columns = [col for col in table_dict['columns'] if col not in foreign_keys]
+    for foreign_key in foreign_keys:
+        unique_col = get_table(foreign_key.removesuffix('_id'))['unique_column']
+        if unique_col not in staging_columns:
+            staging_columns.append(unique_col)
+
+    return staging_columns
+
+
+def get_merge_query(table_dict: dict, staging_table: str) -> str:
+    """
+    Returns one INSERT ... SELECT that copies every staged row not already in
+    the table, joining to the tables it points at to find their ids
+    """
+    table_name = table_dict['table_name']
+    foreign_keys = get_foreign_keys(table_dict)
+
+    select_columns = []
+    joins = []
+    for col in table_dict['columns']:
+        if col not in foreign_keys:
+            select_columns.append(f's.{col}')
+            continue
+        foreign_table = get_table(col.removesuffix('_id'))
+        foreign_name = foreign_table['table_name']
+        foreign_unique = foreign_table['unique_column']
+        select_columns.append(f'{foreign_name}.{col}')
+        joins.append(f"""
+        LEFT JOIN {foreign_name}
+            ON {foreign_name}.{foreign_unique} = s.{foreign_unique}""")
+
+    if table_name == 'reading':
+        match = ('t.plant_id = s.plant_id'
+                 ' AND t.reading_time_taken = s.reading_time_taken')
+    else:
+        match = f"t.{table_dict['unique_column']} = s.{table_dict['unique_column']}"
+
+    return f"""
+        INSERT INTO
+            {table_name} ({', '.join(table_dict['columns'])})
+        SELECT
+            {', '.join(select_columns)}
+        FROM
+            {staging_table} AS s{''.join(joins)}
+        WHERE NOT EXISTS
+            (SELECT 1 FROM {table_name} AS t WHERE {match});"""
+
+
+def upload_table_data_bulk(conn: pyodbc.Connection, table_dict: dict, df: pd.DataFrame,
+                           backend: StorageBackend = None) -> None:
+    """
+    Streams the table's rows into a temporary staging table with the
+    backend's bulk insert, then inserts the new ones with a single
+    set-based statement
+    """
+    table_name = table_dict['table_name']
+    staging_columns = get_staging_columns(table_dict)
+
+    df = df[staging_columns]
+    if table_name == 'reading':
+        df = df.copy()
+        for column in ['reading_last_watered', 'reading_time_taken']:
+            df[column] = pd.to_datetime(df[column], format='ISO8601', utc=True)
+            df[column] = df[column].dt.tz_localize(None)
+        df = df.drop_duplicates(subset=['plant_id', 'reading_time_taken'])
+    else:
+        df = df.dropna().drop_duplicates(subset=table_dict['unique_column'])
+    if df.empty:
+        return
+
+    backend = backend or get_backend()
+    cur = conn.cursor()
+    staging_table = backend.create_staging_table(
+        cur, table_name, {col: COLUMN_TYPES[col] for col in staging_columns})
+    backend.bulk_insert(cur, staging_table, staging_columns, to_sql_params(df))
+    cur.execute(get_merge_query(table_dict, staging_table))
+    backend.drop_staging_table(cur, staging_table)
+    cur.close()
+
+
+class DimensionFingerprints:
+    """
+    Remembers a hash of every row each dimension table has been sent, and a
+    fingerprint of the last batch's rows, so a dimension that hasn't changed
+    is skipped without sending it and otherwise only its new rows are sent.
+    The hashes are kept locally, not with the database, so every load checks
+    them against the keys the database has, and rows it lacks, e.g. after a
+    reset, are sent again
+    """
+
+    def __init__(self):
+        self.tables = load_state(FINGERPRINT_STATE, {})
+        self.skipped = []
+
+    def get_new_rows(self, table_dict: dict, df: pd.DataFrame,
+                     known_keys: dict = None) -> pd.DataFrame:
+        """
+        Returns the table's rows in df that haven't been sent before, or whose
+        unique column isn't in known_keys, the keys the database has for the table
+        """
+        table_name = table_dict['table_name']
+        rows = df[get_staging_columns(table_dict)].dropna().drop_duplicates()
+        digests = pd.util.hash_pandas_object(rows, index=False)
+        fingerprint = hashlib.sha1(np.sort(digests.unique()).tobytes()).hexdigest()
+
+        seen = self.tables.setdefault(table_name, {'fingerprint': None, 'members': []})
+        members = set(seen['members'])
+        unsent = ~digests.isin(members).to_numpy()
+        if known_keys is not None:
+            unsent |= ~rows[table_dict['unique_column']].isin(list(known_keys)).to_numpy()
+        if fingerprint == seen['fingerprint'] and not unsent.any():
+            self.skipped.append(table_name)
+            return rows.iloc[0:0]
+
+        seen['fingerprint'] = fingerprint
+        seen['members'] = sorted(members.union(digests.tolist()))
+
+        return rows[unsent]
+
+    def save(self) -> None:
+        """Saves the fingerprints, once the rows they describe are committed"""
+        save_state(FINGERPRINT_STATE, self.tables)
+
+
+def upload_table(conn: pyodbc.Connection, table_dict: dict, df: pd.DataFrame,
+                 cache: DimensionKeyCache = None, bulk: bool = False,
+                 backend: StorageBackend = None) -> None:
+    """Uploads df to one table, the way upload_all_tables was asked to"""
+    if bulk:
+        upload_table_data_bulk(conn, table_dict, df, backend)
+    elif cache is not None and table_dict['table_name'] == 'reading':
+        upload_reading_data(conn, df, cache, backend)
+    elif cache is not None:
+        upload_dimension_data(conn, table_dict, df, cache, backend)
+    elif table_dict in TABLES:
+        upload_table_data(conn=conn, table_dict=table_dict, df=df[table_dict['columns']])
+    else:
+        upload_table_data_with_foreign_key(conn=conn, table_dict=table_dict, df=df)
+
+    # only the cache path knows which readings were new, the others recount their days
+    if table_dict['table_name'] == 'reading' and (bulk or cache is None):
+        refresh_rollups(conn, df, backend)
+
+
+def upload_all_tables(conn: pyodbc.Connection, clean_table: pd.DataFrame,
+                      cache: DimensionKeyCache = None, bulk: bool = False,
+                      fingerprints: DimensionFingerprints = None,
+                      backend: StorageBackend = None) -> None:
+    """
+    Uploads the clean table to every table in the database, in dependency order.
+    With bulk, each table is staged and merged in one statement. With a cache,
+    foreign keys are resolved in python and only new rows are sent, otherwise
+    every row is sent with subqueries to resolve its keys. With fingerprints,
+    dimension rows sent by an earlier load are not sent again, unless the
+    database has lost them. The backend is the kind of database conn is
+    connected to, by default DB_BACKEND's
+    """
+    if cache is not None and not bulk and not cache.keys:
+        cache.warm(conn, backend)
+    known_keys = get_known_keys(conn, cache, bulk, backend) if fingerprints is not None else None
+
+    for level in get_load_levels():
+        for table, df in get_upload_jobs(level, clean_table, fingerprints, known_keys):
+            upload_table(conn, table, df, cache, bulk, backend)
+
+
+def get_load_levels(tables: list[dict] = None) -> list[list[dict]]:
+    """
+    Groups the tables into levels from their foreign keys, so every table
+    only points at tables in earlier levels and the tables in one level
+    can be loaded at the same time
+    """
+    remaining = list(tables or TABLES + FOREIGN_TABLES)
+    loaded = set()
+    levels = []
+    while remaining:
+        level = [table for table in remaining
+                 if all(foreign_key.removesuffix('_id') in loaded
+                        for foreign_key in get_foreign_keys(table))]
+        if not level:
+            raise ValueError(f'Foreign keys form a cycle between {remaining}')
+        levels.append(level)
+        loaded.update(table['table_name'] for table in level)
+        remaining = [table for table in remaining if table not in level]
+
+    return levels
+
+
+def get_known_keys(conn: pyodbc.Connection, cache: DimensionKeyCache = None,
+                   bulk: bool = False, backend: StorageBackend = None) -> dict:
+    """
+    Returns the keys the database has for each dimension table, from the
+    cache when the load keeps it up to date, otherwise looked up
+    """
+    if cache is not None and not bulk and cache.keys:
+        return cache.keys
+
+    return lookup_dimension_keys(conn, backend)
+
+
+def get_upload_jobs(tables: list[dict], clean_table: pd.DataFrame,
+                    fingerprints: DimensionFingerprints = None,
+                    known_keys: dict = None) -> list[tuple[dict, pd.DataFrame]]:
+    """
+    Returns each table with the rows it needs sent, leaving out tables with
+    none. The database's known_keys are checked against the fingerprints
+    """
+    jobs = []
+    for table in tables:
+        df = clean_table
+        if fingerprints is not None and table['table_name'] != 'reading':
+            table_keys = known_keys.get(table['table_name'], {}) if known_keys is not None else None
+            df = fingerprints.get_new_rows(table, clean_table, table_keys)
+        if table['table_name'] == 'reading' or not df.empty:
+            jobs.append((table, df))
+
+    return jobs
+
+
+def upload_all_tables_parallel(backend: StorageBackend, clean_table: pd.DataFrame,
+                               cache: DimensionKeyCache = None, bulk: bool = False,
+                               fingerprints: DimensionFingerprints = None) -> None:
+    """
+    Uploads the clean table a level at a time, loading the tables in a level
+    at the same time on their own connections. A level is only committed
+    once every table in it has loaded, otherwise all of them are rolled
+    back. Backends that can't lend enough connections load a level's tables
+    one after another
+    """
+    if cache is not None and not bulk and not cache.keys:
+        with backend.connection() as conn:
+            cache.warm(conn, backend)
+    known_keys = None
+    if fingerprints is not None:
+        with backend.connection() as conn:
+            known_keys = get_known_keys(conn, cache, bulk, backend)
+
+    for level in get_load_levels():
+        jobs = get_upload_jobs(level, clean_table, fingerprints, known_keys)
+        with ExitStack() as stack:
+            if 1 < len(jobs) <= backend.get_max_connections():
+                conns = [stack.enter_context(backend.connection()) for _ in jobs]
+                with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+                    futures = [executor.submit(upload_table, conn, table, df, cache, bulk, backend)
+                               for conn, (table, df) in zip(conns, jobs)]
+                    for future in futures:
+                        future.result()
+            elif jobs:
+                conn = stack.enter_context(backend.connection())
+                for table, df in jobs:
+                    upload_table(conn, table, df, cache, bulk, backend)
+
+
+def get_args() -> argparse.Namespace:
+    """Parses the command line arguments for the load script"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', default=DATA_FILEPATH,
+                        help='Clean table saved by transform, .csv, .parquet or .arrow')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Resolve foreign keys with a subquery per row instead of a key cache')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Stage each table and merge it with one set-based statement')
+    parser.add_argument('--skip-unchanged-dimensions', action='store_true',
+                        help='Only send dimension rows an earlier load from here did not send')
+    parser.add_argument('-p', '--parallel', action='store_true',
+                        help='Load independent tables at the same time, committing a level at a time')
+    parser.add_argument('--backend', choices=tuple(BACKENDS),
+                        help='Database to load into, by default the DB_BACKEND env var or sqlserver')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = get_args()
+    key_cache = None if arguments.no_cache else DimensionKeyCache()
+    dimension_fingerprints = (DimensionFingerprints() if arguments.skip_unchanged_dimensions
+                              else None)
+    storage_backend = get_backend(arguments.backend)
+    if arguments.parallel:
+        upload_all_tables_parallel(storage_backend, read_clean_table(arguments.input),
+                                   key_cache, arguments.bulk, dimension_fingerprints)
+    else:
+        with storage_backend.connection() as connection:
+            upload_all_tables(connection, read_clean_table(arguments.input), key_cache,
+                              arguments.bulk, dimension_fingerprints, storage_backend)
+    if dimension_fingerprints is not None:
+        dimension_fingerprints.save()
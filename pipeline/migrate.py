@@ -0,0 +1,142 @@
+# pylint: disable=c-extension-no-member, logging-fstring-interpolation
+"""
+Versioned schema migrations on top of schema.sql, and the retention purge
+that keeps the reading table to the short-term store's window.
+Migrations are numbered .sql files in migrations/, each applied once, in
+order, and recorded in the schema_migrations table
+
+Run from the repository root:
+    python -m pipeline.migrate
+    python -m pipeline.migrate --purge
+"""
+import argparse
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
+import pyodbc
+
+if TYPE_CHECKING:
+    from pipeline.backends import StorageBackend
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+MIGRATIONS_TABLE = 'schema_migrations'
+RETENTION_HOURS = 48  # Readings older than this are purged, the summary reads the last 24
+PURGE_BATCH_SIZE = 5_000  # Most readings deleted in one statement, to keep locks short
+
+
+def get_migrations(folder: str = None) -> list[tuple[int, str, str]]:
+    """Returns the version, name and path of every migration file, in version order"""
+    folder = folder or MIGRATIONS_FOLDER
+    migrations = []
+    for file_name in os.listdir(folder):
+        match = re.fullmatch(r'(\d+)_(\w+)\.sql', file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2),
+                               os.path.join(folder, file_name)))
+
+    return sorted(migrations)
+
+
+def get_statements(path: str) -> list[str]:
+    """Returns the statements in a migration file, which end with a ; at the end of a line"""
+    with open(path, 'r', encoding='utf-8') as f:
+        sql = f.read()
+
+    sql = re.sub(r'--.*$', '', sql, flags=re.MULTILINE)
+    return [statement.strip() for statement in re.split(r';\s*$', sql, flags=re.MULTILINE)
+            if statement.strip()]
+
+
+def get_applied_versions(cur: pyodbc.Cursor, backend: 'StorageBackend') -> set[int]:
+    """Returns the version of every applied migration, creating the record table if needed"""
+    if not backend.has_table(cur, MIGRATIONS_TABLE):
+        cur.execute(f"""
+        CREATE TABLE {MIGRATIONS_TABLE} (
+            migration_version INT NOT NULL PRIMARY KEY,
+            migration_name VARCHAR(255) NOT NULL,
+            migration_applied_at DATETIME2 NOT NULL
+        );""")
+
+    cur.execute(f'SELECT migration_version FROM {MIGRATIONS_TABLE};')
+    return {row[0] for row in cur.fetchall()}
+
+
+def apply_migrations(conn: pyodbc.Connection, backend: 'StorageBackend',
+                     folder: str = None, target: int = None) -> list[int]:
+    """
+    Applies every migration not yet recorded, up to the target version,
+    committing each with its record so a failed one can be fixed and rerun.
+    Returns the versions applied
+    """
+    cur = conn.cursor()
+    applied = get_applied_versions(cur, backend)
+    conn.commit()
+
+    newly_applied = []
+    for version, name, path in get_migrations(folder):
+        if version in applied or (target is not None and version > target):
+            continue
+
+        logging.info(f'Applying migration {version:03d} {name}')
+        for statement in get_statements(path):
+            cur.execute(statement)
+        cur.execute(f"""
+        INSERT INTO {MIGRATIONS_TABLE} (migration_version, migration_name, migration_applied_at)
+        VALUES (?, ?, ?);""", (version, name, datetime.now(timezone.utc)))
+        conn.commit()
+        newly_applied.append(version)
+
+    cur.close()
+    return newly_applied
+
+
+def purge_readings(conn: pyodbc.Connection, backend: 'StorageBackend',
+                   retention_hours: float = None, now: datetime = None) -> int:
+    """
+    Deletes readings taken more than retention_hours ago, PURGE_BATCH_SIZE
+    at a time, committing each batch. Returns the number of readings deleted
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(hours=retention_hours or RETENTION_HOURS)
+
+    cur = conn.cursor()
+    deleted = 0
+    while (batch := backend.delete_readings_before(cur, cutoff, PURGE_BATCH_SIZE)) > 0:
+        conn.commit()
+        deleted += batch
+    cur.close()
+
+    logging.info(f'Purged {deleted} readings taken before {cutoff}')
+    return deleted
+
+
+def main() -> None:
+    """Applies pending migrations, or purges old readings, on the chosen backend"""
+    # imported here as new SQLite databases apply the migrations themselves
+    from pipeline.backends import get_backend, BACKENDS  # pylint: disable=import-outside-toplevel
+
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', type=int,
+                        help='Only apply migrations up to this version')
+    parser.add_argument('--purge', action='store_true',
+                        help='Delete readings older than the retention window instead')
+    parser.add_argument('--retention-hours', type=float,
+                        help=f'Hours of readings to keep, {RETENTION_HOURS} by default')
+    parser.add_argument('--backend', choices=BACKENDS,
+                        help='Database to migrate, the DB_BACKEND env var by default')
+    args = parser.parse_args()
+
+    storage = get_backend(args.backend)
+    with storage.connection() as connection:
+        if args.purge:
+            purge_readings(connection, storage, args.retention_hours)
+        else:
+            apply_migrations(connection, storage, target=args.target)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Reads and writes newline delimited json, optionally gzip or zstd compressed"""
+import gzip
+import json
+import os
+import time
+import uuid
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {'': None, '.gz': 'gzip', '.zst': 'zstd'}
+DONE_SUFFIX = '.done'  # Marker holding the run's token, written once the writer has finished
+RUN_SUFFIX = '.run'  # Marker holding the token of the run writing the file
+POLL_INTERVAL = 0.1  # Time in seconds between checks for new lines when following
+IDLE_TIMEOUT = 60  # Time in seconds a follower waits for new lines before giving up
+
+
+def get_compression(path: str) -> str | None:
+    """Returns the compression used by a file, based on its extension"""
+    for suffix, compression in COMPRESSIONS.items():
+        if suffix and str(path).endswith(suffix):
+            return compression
+    return None
+
+
+def read_marker(path: str) -> str | None:
+    """Returns the run token in a marker file, or None if there is none"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_marker(path: str, token: str) -> None:
+    """Writes a run token to a marker file in one move"""
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        f.write(token)
+    os.replace(f'{path}.tmp', path)
+
+
+def open_ndjson(path: str, mode: str):
+    """Opens an ndjson file for text reading ('r') or writing ('w')"""
+    compression = get_compression(path)
+    if compression == 'gzip':
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('Install zstandard to read or write .zst files')
+        return zstandard.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class NdjsonWriter:
+    """
+    Writes one json record per line as soon as it is given.
+    Uncompressed files are flushed after every record, so a reader can follow
+    the file while it grows. Each run has its own token, kept in a .run
+    marker while writing and in a .done marker once the run has finished
+    without an error, so a follower never mistakes an earlier or crashed run
+    for a finished one.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.token = uuid.uuid4().hex
+        self.records_written = 0
+        self._file = None
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # the earlier run's file is removed, not truncated, so a follower of it never reads ours
+        for old_path in (f'{self.path}{DONE_SUFFIX}', self.path):
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+        write_marker(f'{self.path}{RUN_SUFFIX}', self.token)
+        self._file = open_ndjson(self.path, 'w')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+        if exc_type is None:
+            write_marker(f'{self.path}{DONE_SUFFIX}', self.token)
+
+    def write(self, record: dict) -> None:
+        """Appends a single record to the file"""
+        self._file.write(json.dumps(record) + '\n')
+        if get_compression(self.path) is None:
+            self._file.flush()
+        self.records_written += 1
+
+
+def open_run(path: str, idle_timeout: float):
+    """
+    Waits for a run of the writer that hadn't finished when this was called,
+    then returns the run's token and its file opened for reading
+    """
+    finished = read_marker(f'{path}{DONE_SUFFIX}')
+    waited = 0
+    while True:
+        token = read_marker(f'{path}{RUN_SUFFIX}')
+        if token is not None and token != finished and os.path.exists(path):
+            f = open_ndjson(path, 'r')
+            # the file opened may be a newer run's, if one started while checking
+            if read_marker(f'{path}{RUN_SUFFIX}') == token:
+                return token, f
+            f.close()
+            continue
+
+        if waited > idle_timeout:
+            raise TimeoutError(f'No new run wrote {path}')
+        time.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
+
+
+def iter_records(path: str, follow: bool = False, idle_timeout: float = IDLE_TIMEOUT):
+    """
+    Yields each record in an ndjson file without loading the whole file.
+    With follow, waits for a run of the writer that hadn't finished yet and
+    keeps reading its uncompressed file until that run's .done marker
+    appears, so records can be processed while they are still being
+    written. A run that crashes never finishes, so following it times out
+    """
+    path = str(path)
+    if follow and get_compression(path) is not None:
+        raise ValueError('Only uncompressed ndjson files can be followed')
+
+    if follow:
+        token, f = open_run(path, idle_timeout)
+    else:
+        token, f = None, open_ndjson(path, 'r')
+
+    with f:
+        if not follow:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        buffer = ''
+        idle = 0
+        while True:
+            line = f.readline()
+            if line:
+                buffer += line
+                if buffer.endswith('\n'):
+                    if buffer.strip():
+                        yield json.loads(buffer)
+                    buffer = ''
+                idle = 0
+                continue
+
+            if read_marker(f'{path}{DONE_SUFFIX}') == token:
+                rest = buffer + f.read()
+                for remaining in rest.splitlines():
+                    if remaining.strip():
+                        yield json.loads(remaining)
+                return
+
+            if idle > idle_timeout:
+                raise TimeoutError(f'No new records in {path} for {idle_timeout}s')
+            time.sleep(POLL_INTERVAL)
+            idle += POLL_INTERVAL
@@ -0,0 +1,151 @@
+# pylint: disable=c-extension-no-member, logging-fstring-interpolation
+"""
+Daily rollups of each plant's readings, kept in the reading_daily table. The
+loader adds each batch's counts, sums, sums of squares, minimums and maximums
+to them as it inserts readings, so summaries read a row per plant and day
+instead of every reading. Days can also be rebuilt from the reading table
+
+Run from the repository root:
+    python -m pipeline.rollups --start 2025-11-01 --end 2025-12-01
+"""
+import argparse
+import logging
+from datetime import date, datetime, time, timedelta
+import pandas as pd
+import pyodbc
+from pipeline.backends import StorageBackend, get_backend, BACKENDS
+
+ROLLUP_TABLE = 'reading_daily'
+ROLLUP_METRICS = {'temperature': 'reading_temperature', 'moisture': 'reading_soil_moisture'}
+ROLLUP_COUNTS = ['reading_count', 'error_count', 'alert_count'] + [
+    f'{metric}_{stat}' for metric in ROLLUP_METRICS for stat in ('count', 'sum', 'sumsq')]
+ROLLUP_EXTREMES = [f'{metric}_{stat}' for metric in ROLLUP_METRICS for stat in ('min', 'max')]
+
+
+def get_rollup_deltas(readings: pd.DataFrame) -> pd.DataFrame:
+    """Returns the rollup of a batch of readings, one row per plant and day"""
+    readings = readings.assign(
+        rollup_day=pd.to_datetime(readings['reading_time_taken']).dt.date,
+        reading_error=readings['reading_error'].eq(True),
+        reading_alert=readings['reading_alert'].eq(True),
+        **{f'{column}_sq': readings[column] ** 2 for column in ROLLUP_METRICS.values()})
+
+    aggregations = {'reading_count': ('reading_time_taken', 'size'),
+                    'error_count': ('reading_error', 'sum'),
+                    'alert_count': ('reading_alert', 'sum')}
+    for metric, column in ROLLUP_METRICS.items():
+        aggregations.update({f'{metric}_count': (column, 'count'),
+                             f'{metric}_sum': (column, 'sum'),
+                             f'{metric}_sumsq': (f'{column}_sq', 'sum'),
+                             f'{metric}_min': (column, 'min'),
+                             f'{metric}_max': (column, 'max')})
+
+    return (readings.dropna(subset=['plant_id'])
+            .groupby(['plant_id', 'rollup_day'])
+            .agg(**aggregations)
+            .reset_index())
+
+
+def add_to_rollups(cur: pyodbc.Cursor, deltas: pd.DataFrame) -> None:
+    """
+    Adds each delta row to its plant and day's rollup, creating the rollup
+    first if the day has none yet
+    """
+    if deltas.empty:
+        return
+
+    cur.executemany(f"""
+        INSERT INTO
+            {ROLLUP_TABLE} (plant_id, rollup_day)
+        SELECT ?, ?
+        WHERE NOT EXISTS
+            (SELECT 1 FROM {ROLLUP_TABLE} WHERE plant_id = ? AND rollup_day = ?);""",
+                    [(*key, *key) for key in zip(deltas['plant_id'].tolist(),
+                                                 deltas['rollup_day'].tolist())])
+
+    # a new min or max replaces the rollup's own, a null one leaves it
+    extremes = []
+    for column in ROLLUP_EXTREMES:
+        beaten = '>' if column.endswith('_min') else '<'
+        extremes.append(f"""{column} = CASE WHEN {column} IS NULL OR {column} {beaten} ?
+                THEN COALESCE(?, {column}) ELSE {column} END""")
+    params = deltas[[*ROLLUP_COUNTS,
+                     *[column for column in ROLLUP_EXTREMES for _ in range(2)],
+                     'plant_id', 'rollup_day']].astype(object)
+    params = params.where(params.notna(), None)
+    cur.executemany(f"""
+        UPDATE {ROLLUP_TABLE}
+        SET
+            {', '.join(f'{column} = {column} + ?' for column in ROLLUP_COUNTS)},
+            {', '.join(extremes)}
+        WHERE plant_id = ? AND rollup_day = ?;""",
+                    list(params.itertuples(index=False, name=None)))
+
+
+def rebuild_rollups(conn: pyodbc.Connection, start: date, end: date,
+                    backend: StorageBackend = None) -> int:
+    """
+    Replaces the rollups of every day from start up to end with ones computed
+    from the reading table, returning the number of rollups written. Days whose
+    readings have been purged lose their rollups, so only rebuild retained days
+    """
+    backend = backend or get_backend()
+    day = backend.get_day_expression('reading_time_taken')
+    aggregations = {'reading_count': 'COUNT(*)',
+                    'error_count': 'SUM(CASE WHEN reading_error = 1 THEN 1 ELSE 0 END)',
+                    'alert_count': 'SUM(CASE WHEN reading_alert = 1 THEN 1 ELSE 0 END)'}
+    for metric, column in ROLLUP_METRICS.items():
+        aggregations.update({f'{metric}_count': f'COUNT({column})',
+                             f'{metric}_sum': f'COALESCE(SUM({column}), 0)',
+                             f'{metric}_sumsq': f'COALESCE(SUM({column} * {column}), 0)',
+                             f'{metric}_min': f'MIN({column})',
+                             f'{metric}_max': f'MAX({column})'})
+
+    cur = conn.cursor()
+    cur.execute(f'DELETE FROM {ROLLUP_TABLE} WHERE rollup_day >= ? AND rollup_day < ?;',
+                (start, end))
+    cur.execute(f"""
+        INSERT INTO
+            {ROLLUP_TABLE} (plant_id, rollup_day, {', '.join(aggregations)})
+        SELECT
+            plant_id,
+            {day},
+            {', '.join(aggregations.values())}
+        FROM reading
+        WHERE plant_id IS NOT NULL
+            AND reading_time_taken >= ?
+            AND reading_time_taken < ?
+        GROUP BY plant_id, {day};""",
+                (datetime.combine(start, time.min), datetime.combine(end, time.min)))
+    written = cur.rowcount
+    cur.close()
+
+    logging.info(f'Rebuilt {written} rollups from {start} to {end}')
+    return written
+
+
+def refresh_rollups(conn: pyodbc.Connection, readings: pd.DataFrame,
+                    backend: StorageBackend = None) -> None:
+    """Rebuilds the rollups of every day a batch of readings was taken on"""
+    if readings.empty:
+        return
+
+    times = pd.to_datetime(readings['reading_time_taken'], format='ISO8601', utc=True)
+    rebuild_rollups(conn, times.min().date(), times.max().date() + timedelta(days=1), backend)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start', type=date.fromisoformat, required=True,
+                        help='First day to rebuild, as YYYY-MM-DD')
+    parser.add_argument('--end', type=date.fromisoformat, required=True,
+                        help='Day after the last day to rebuild, as YYYY-MM-DD')
+    parser.add_argument('--backend', choices=BACKENDS,
+                        help='Database to rebuild in, the DB_BACKEND env var by default')
+    args = parser.parse_args()
+
+    storage = get_backend(args.backend)
+    with storage.connection() as connection:
+        rebuild_rollups(connection, args.start, args.end, storage)
@@ -0,0 +1,175 @@
+# pylint: disable=logging-fstring-interpolation
+"""Runs extract, transform and load in one process, passing batches in memory"""
+import argparse
+import logging
+import time
+from contextlib import contextmanager
+from functools import partial
+import pandas as pd
+from pipeline.extract import extract_plants, set_up_logging, ChangedPlantFilter, ENGINES
+from pipeline.transform import (transform_plants, setup_output, save_clean_table,
+                                archive_clean_table, get_output_file)
+from pipeline.baselines import PlantBaselines
+from pipeline.load import upload_all_tables_parallel, DimensionKeyCache, DimensionFingerprints
+from pipeline.db import get_pool
+from pipeline.backends import get_backend
+from pipeline.spool import Spool, FLUSH_ROWS, FLUSH_AGE
+
+LOAD_TIMEOUT = 45  # Time in seconds a run waits for the spool to drain before leaving it to the next
+LOAD_MODES = ('direct', 'spool', 'micro-batch')
+
+
+@contextmanager
+def timed_stage(name: str, timings: dict):
+    """Logs how long the stage inside the block took and records it in timings"""
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+    logging.info(f'{name} took {timings[name]:.2f}s')
+
+
+def load_clean_table(clean_table: pd.DataFrame,
+                     fingerprints: DimensionFingerprints = None) -> None:
+    """
+    Uploads a clean table to the DB_BACKEND database, loading tables that
+    don't depend on each other at the same time
+    """
+    upload_all_tables_parallel(get_backend(), clean_table, DimensionKeyCache(),
+                               fingerprints=fingerprints)
+
+
+def load_spooled_table(clean_table: pd.DataFrame,
+                       skip_unchanged_dimensions: bool = False) -> None:
+    """
+    Loads a batch drained from the spool, with skip_unchanged_dimensions
+    remembering its dimensions once committed
+    """
+    fingerprints = DimensionFingerprints() if skip_unchanged_dimensions else None
+    load_clean_table(clean_table, fingerprints)
+    if fingerprints is not None:
+        fingerprints.save()
+
+
+def run_pipeline(engine: str = 'async', incremental: bool = False,
+                 checkpoint: bool = False, batch_alerts: bool = False,
+                 archive: bool = False, load_mode: str = 'direct',
+                 skip_unchanged_dimensions: bool = False, flush_rows: int = None,
+                 flush_age: float = None) -> dict:
+    """
+    Extracts, transforms and loads one batch of plants without touching disk.
+    With checkpoint the raw json and clean csv files are still written, so a
+    stage can be rerun by hand, and with archive each clean table is kept
+    as a typed parquet file. The spool load mode writes the batch to the
+    local spool before loading, and a database that is down or slow leaves
+    it there for a later run. The micro-batch mode also leaves it spooled
+    until flush_rows have collected or the oldest has waited flush_age
+    seconds, unless the batch has an alert. Alerts are judged against each plant's
+    own running baseline unless batch_alerts is set. With
+    skip_unchanged_dimensions, dimension rows an earlier run sent are not
+    sent again. Returns the time taken by each stage
+    """
+    timings = {}
+    changed_filter = ChangedPlantFilter() if incremental else None
+    baselines = None if batch_alerts else PlantBaselines()
+    fingerprints = DimensionFingerprints() if skip_unchanged_dimensions else None
+
+    with timed_stage('extract', timings):
+        plants, report = extract_plants(engine, 'json' if checkpoint else None,
+                                        changed_filter)
+    logging.info(f'Plants emitted = {report["emitted"]}, skipped = {report["skipped"]}')
+
+    if not plants:
+        logging.info('No new plant readings to transform or load')
+        if changed_filter is not None:
+            changed_filter.save()
+        return timings
+
+    with timed_stage('transform', timings):
+        clean_table = transform_plants(plants, baselines)
+        if checkpoint:
+            setup_output()
+            save_clean_table(clean_table, get_output_file('csv'))
+        if archive:
+            logging.info(f'Archived clean table to {archive_clean_table(clean_table)}')
+
+    with timed_stage('load', timings):
+        if load_mode == 'direct':
+            load_clean_table(clean_table, fingerprints)
+            if fingerprints is not None:
+                fingerprints.save()
+        else:
+            write_ahead = Spool()
+            write_ahead.append(clean_table)
+            # alerts are loaded straight away, however small the batch
+            if (load_mode == 'spool' or clean_table['reading_alert'].any()
+                    or write_ahead.is_due(flush_rows, flush_age)):
+                write_ahead.drain_in_background(
+                    partial(load_spooled_table,
+                            skip_unchanged_dimensions=skip_unchanged_dimensions), LOAD_TIMEOUT)
+            logging.info(f'Spool = {write_ahead.get_metrics()}')
+    if fingerprints is not None and fingerprints.skipped:
+        logging.info(f'Unchanged dimensions skipped = {", ".join(fingerprints.skipped)}')
+
+    # Only remember what was emitted once it is safely in the database or spool
+    if changed_filter is not None:
+        changed_filter.save()
+    if baselines is not None:
+        baselines.save()
+
+    return timings
+
+
+def get_args() -> argparse.Namespace:
+    """Parses the command line arguments for the pipeline"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log extra information to console')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='async',
+                        help='Fetch plants with a single asyncio client or a process pool')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only transform and load plants whose reading changed')
+    parser.add_argument('-c', '--checkpoint', action='store_true',
+                        help='Also write the raw json and clean csv files')
+    parser.add_argument('-b', '--batch-alerts', action='store_true',
+                        help='Alert against the whole batch instead of per-plant baselines')
+    parser.add_argument('-a', '--archive', action='store_true',
+                        help="Keep each run's clean table as a typed parquet file")
+    parser.add_argument('-l', '--load-mode', choices=LOAD_MODES, default='direct',
+                        help='Load straight away, through the local spool, '
+                             'or in micro-batches of several runs through the spool')
+    parser.add_argument('-d', '--drain', action='store_true',
+                        help='Only load the batches waiting in the spool, then exit')
+    parser.add_argument('--skip-unchanged-dimensions', action='store_true',
+                        help='Only send dimension rows an earlier run from here did not send')
+    parser.add_argument('--flush-rows', type=int,
+                        help=f'Rows a micro-batch collects before it is loaded, {FLUSH_ROWS} '
+                             'by default')
+    parser.add_argument('--flush-age', type=float,
+                        help="Seconds a micro-batch's oldest rows may wait before it is loaded, "
+                             f'{FLUSH_AGE} by default')
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Runs the whole pipeline from the command line"""
+    arguments = get_args()
+    set_up_logging(arguments.verbose)
+    if arguments.drain:
+        write_ahead = Spool()
+        write_ahead.drain(partial(load_spooled_table,
+                                  skip_unchanged_dimensions=arguments.skip_unchanged_dimensions))
+        logging.info(f'Spool = {write_ahead.get_metrics()}')
+        return
+
+    timings = run_pipeline(arguments.engine, arguments.incremental,
+                           arguments.checkpoint, arguments.batch_alerts,
+                           arguments.archive, arguments.load_mode,
+                           arguments.skip_unchanged_dimensions, arguments.flush_rows,
+                           arguments.flush_age)
+    logging.info(f'Total time taken = {sum(timings.values()):.2f}s')
+    logging.info(f'Database connections = {get_pool().get_metrics()}')
+
+
+if __name__ == '__main__':
+    main()
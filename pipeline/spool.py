@@ -0,0 +1,151 @@
+# pylint: disable=logging-fstring-interpolation
+"""
+A write-ahead spool of clean tables waiting to be loaded. Each batch is
+written to its own parquet segment before the database is touched, and a
+writer drains the segments in order, so a slow or unavailable database
+delays readings instead of losing them. Deployed, the spool folder is a
+persistent EFS mount, so segments outlive the container that wrote them
+"""
+import fcntl
+import logging
+import os
+import threading
+from os import environ
+import time
+import pandas as pd
+import pyarrow.parquet as pq
+
+SPOOL_FOLDER = './data/spool/'  # Overridden by the SPOOL_FOLDER env var
+SEGMENT_SUFFIX = '.parquet'
+LOCK_FILE = '.drain.lock'
+MAX_COALESCE_SEGMENTS = 60  # Most segments loaded together when the writer is behind
+FLUSH_ROWS = 500  # Rows a micro-batch collects before it is loaded
+FLUSH_AGE = 300  # Time in seconds a micro-batch's oldest segment may wait before it is loaded
+LOAD_GRACE = 30  # Time in seconds a load still running at a drain's timeout has to commit
+
+
+class Spool:
+    """
+    Appends each clean table as a parquet segment named by the time it was
+    written, and drains the oldest segments first. A segment is only deleted
+    once its rows are committed, and loading is idempotent, so a drain that
+    dies part way is simply repeated
+    """
+
+    def __init__(self, folder: str = None):
+        self.folder = folder or environ.get('SPOOL_FOLDER') or SPOOL_FOLDER
+        self.loaded_segments = 0
+        self.loaded_rows = 0
+        self._lock = threading.Lock()
+
+    def append(self, df: pd.DataFrame) -> str:
+        """Durably writes a batch as a new segment and returns its path"""
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        path = os.path.join(self.folder, f'{time.time_ns():020d}{SEGMENT_SUFFIX}')
+        with open(f'{path}.tmp', 'wb') as f:
+            df.to_parquet(f, index=False, compression='zstd')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{path}.tmp', path)
+
+        return path
+
+    def get_segments(self) -> list[str]:
+        """Returns the path of every segment waiting to be loaded, oldest first"""
+        if not os.path.exists(self.folder):
+            return []
+
+        return [os.path.join(self.folder, name) for name in sorted(os.listdir(self.folder))
+                if name.endswith(SEGMENT_SUFFIX)]
+
+    def get_metrics(self) -> dict:
+        """Returns how many segments and rows are waiting, and how old the oldest is"""
+        segments = self.get_segments()
+        lag = 0.0
+        if segments:
+            oldest = int(os.path.basename(segments[0]).removesuffix(SEGMENT_SUFFIX))
+            lag = (time.time_ns() - oldest) / 1e9
+
+        return {
+            'depth': len(segments),
+            'rows': sum(pq.read_metadata(path).num_rows for path in segments),
+            'lag_seconds': lag,
+            'loaded_segments': self.loaded_segments,
+            'loaded_rows': self.loaded_rows
+        }
+
+    def is_due(self, max_rows: int = None, max_age: float = None) -> bool:
+        """Returns True once the waiting rows or the oldest segment's age reach their limit"""
+        metrics = self.get_metrics()
+        max_rows = FLUSH_ROWS if max_rows is None else max_rows
+        max_age = FLUSH_AGE if max_age is None else max_age
+        return metrics['rows'] >= max_rows or metrics['lag_seconds'] >= max_age
+
+    def drain(self, load, deadline: float = None) -> int:
+        """
+        Loads every waiting segment in order, up to MAX_COALESCE_SEGMENTS at a
+        time as one clean table, deleting them once load returns. No more
+        are started once the time.monotonic() deadline has passed. Only one
+        drain runs on a spool at a time, across processes too; a second one
+        returns straight away. Returns the number of segments loaded
+        """
+        if not os.path.exists(self.folder):
+            return 0
+
+        with self._lock, open(os.path.join(self.folder, LOCK_FILE), 'w', encoding='utf-8') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+
+            loaded = 0
+            while ((deadline is None or time.monotonic() < deadline)
+                   and (segments := self.get_segments()[:MAX_COALESCE_SEGMENTS])):
+                batch = pd.concat([pd.read_parquet(path) for path in segments],
+                                  ignore_index=True)
+                load(batch)
+                for path in segments:
+                    os.remove(path)
+                loaded += len(segments)
+                self.loaded_segments += len(segments)
+                self.loaded_rows += len(batch)
+                logging.info(f'Loaded {len(segments)} spooled segments ({len(batch)} rows)')
+
+            return loaded
+
+    def drain_in_background(self, load, timeout: float, grace: float = None) -> bool:
+        """
+        Drains the spool on a writer thread for up to timeout seconds. No more
+        loads are started then, and one still running is given up to grace
+        seconds, LOAD_GRACE by default, to commit. A load still running after
+        that is abandoned on its daemon thread; its segments are only deleted
+        once it commits, so they stay spooled for the next drain. Returns True
+        if the spool was drained
+        """
+        grace = LOAD_GRACE if grace is None else grace
+        errors = []
+
+        def drain():
+            try:
+                self.drain(load, time.monotonic() + timeout)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                errors.append(err)
+
+        writer = threading.Thread(target=drain, daemon=True)
+        writer.start()
+        writer.join(timeout)
+        if writer.is_alive():
+            logging.warning(f'Database is behind after {timeout}s, waiting for the current load')
+            writer.join(grace)
+        if writer.is_alive():
+            logging.warning(f'Load still running after {grace}s more, leaving it spooled')
+
+        drained = not errors and not writer.is_alive() and not self.get_segments()
+        if errors:
+            logging.warning(f'Database load failed, batches stay spooled: {errors[0]}')
+        elif not drained:
+            logging.warning('Database is behind, batches stay spooled')
+
+        return drained
@@ -0,0 +1,36 @@
+"""Small json state store used to remember values between pipeline runs"""
+import json
+import os
+from os import environ
+
+STATE_FOLDER = './data/state/'  # Overridden by the STATE_FOLDER env var
+
+
+def get_state_folder() -> str:
+    """Returns the folder state is kept in, a persistent mount when deployed"""
+    return environ.get('STATE_FOLDER') or STATE_FOLDER
+
+
+def get_state_path(name: str) -> str:
+    """Returns the file path for the named piece of state"""
+    return os.path.join(get_state_folder(), f'{name}.json')
+
+
+def load_state(name: str, default=None):
+    """Returns the saved state with the given name, or default if there is none"""
+    try:
+        with open(get_state_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def save_state(name: str, state) -> None:
+    """Saves the state atomically, so a crashed run never leaves half a file"""
+    if not os.path.exists(get_state_folder()):
+        os.makedirs(get_state_folder())
+
+    path = get_state_path(name)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
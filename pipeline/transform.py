@@ -2,11 +2,46 @@
 """Script transform raw data, clean it, save it as csvs for each table"""
 import json
 import os
+import argparse
+from collections.abc import Iterable
+from datetime import datetime, timezone
 import pandas as pd
+import pyarrow as pa
+from pipeline.ndjson import iter_records
+from pipeline.baselines import PlantBaselines
 
 INPUT_PATH = './data/raw_data/plant_data_raw.json'
 OUTPUT_PATH = './data/'
 OUTPUT_FILE = f'{OUTPUT_PATH}clean_data.csv'
+OUTPUT_FORMATS = ('csv', 'parquet', 'arrow')
+ARCHIVE_PATH = f'{OUTPUT_PATH}archive/'
+
+# Where each column of the flattened table is found in a plant's raw data
+FIELD_PATHS = {
+    'plant_id': ('plant_id',),
+    'species_name': ('name',),
+    'species_scientific_name': ('scientific_name',),
+    'country_name': ('origin_location', 'country'),
+    'city_name': ('origin_location', 'city'),
+    'origin_latitude': ('origin_location', 'latitude'),
+    'origin_longitude': ('origin_location', 'longitude'),
+    'image_original_url': ('images', 'original_url'),
+    'image_regular_url': ('images', 'regular_url'),
+    'image_medium_url': ('images', 'medium_url'),
+    'image_small_url': ('images', 'small_url'),
+    'image_thumbnail_url': ('images', 'thumbnail'),
+    'license_number': ('images', 'license'),
+    'license_name': ('images', 'license_name'),
+    'license_url': ('images', 'license_url'),
+    'botanist_name': ('botanist', 'name'),
+    'botanist_email': ('botanist', 'email'),
+    'botanist_phone': ('botanist', 'phone'),
+    'reading_last_watered': ('last_watered',),
+    'reading_time_taken': ('recording_taken',),
+    'reading_soil_moisture': ('soil_moisture',),
+    'reading_temperature': ('temperature',),
+    'reading_error': ('error',)
+}
 
 
 def get_nested(dictionary: dict, *keys: tuple):
@@ -23,35 +58,11 @@ def get_nested(dictionary: dict, *keys: tuple):
     return dictionary
 
 
-def flatten_data(raw_data: list[dict]) -> list[dict]:
+def flatten_data(raw_data: Iterable[dict]) -> list[dict]:
     """Flattens the input data into a full denormalised table"""
     rows = []
     for plant in raw_data:
-        row = {
-            'plant_id': plant.get('plant_id'),
-            'species_name': plant.get('name'),
-            'species_scientific_name': plant.get('scientific_name'),
-            'country_name': get_nested(plant, 'origin_location', 'country'),
-            'city_name': get_nested(plant, 'origin_location', 'city'),
-            'origin_latitude': get_nested(plant, 'origin_location', 'latitude'),
-            'origin_longitude': get_nested(plant, 'origin_location', 'longitude'),
-            'image_original_url': get_nested(plant, 'images', 'original_url'),
-            'image_regular_url': get_nested(plant, 'images', 'regular_url'),
-            'image_medium_url': get_nested(plant, 'images', 'medium_url'),
-            'image_small_url': get_nested(plant, 'images', 'small_url'),
-            'image_thumbnail_url': get_nested(plant, 'images', 'thumbnail'),
-            'license_number': get_nested(plant, 'images', 'license'),
-            'license_name': get_nested(plant, 'images', 'license_name'),
-            'license_url': get_nested(plant, 'images', 'license_url'),
-            'botanist_name': get_nested(plant, 'botanist', 'name'),
-            'botanist_email': get_nested(plant, 'botanist', 'email'),
-            'botanist_phone': get_nested(plant, 'botanist', 'phone'),
-            'reading_last_watered': plant.get('last_watered'),
-            'reading_time_taken': plant.get('recording_taken'),
-            'reading_soil_moisture': plant.get('soil_moisture'),
-            'reading_temperature': plant.get('temperature'),
-            'reading_error': plant.get('error')
-        }
+        row = {column: get_nested(plant, *path) for column, path in FIELD_PATHS.items()}
         if row.get('species_scientific_name'):
             row['species_scientific_name'] = row['species_scientific_name'][0]
         rows.append(row)
@@ -59,12 +70,54 @@ def flatten_data(raw_data: list[dict]) -> list[dict]:
     return rows
 
 
-def load_data() -> pd.DataFrame:
-    """Returns a flatted (denormalised) dataframe of all data in the raw data csv"""
-    with open(INPUT_PATH, 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
+def flatten_to_columns(raw_data: Iterable[dict]) -> dict[str, list]:
+    """
+    Flattens the input data straight into one list per column, in a single
+    pass. Each nested dict is looked up once per plant rather than once per
+    field. Gives the same table as flatten_data when passed to pd.DataFrame
+    """
+    columns = {column: [] for column in FIELD_PATHS}
+    top_level = []
+    nested = {}
+    for column, path in FIELD_PATHS.items():
+        if len(path) == 1:
+            top_level.append((path[0], columns[column].append))
+        else:
+            nested.setdefault(path[0], []).append((path[1], columns[column].append))
+
+    for plant in raw_data:
+        for key, append in top_level:
+            append(plant.get(key))
+        for parent_key, fields in nested.items():
+            parent = plant.get(parent_key)
+            if isinstance(parent, dict):
+                for key, append in fields:
+                    append(parent.get(key))
+            else:
+                for _, append in fields:
+                    append(None)
 
-    return pd.DataFrame(flatten_data(raw_data))
+    columns['species_scientific_name'] = [
+        name[0] if name else name for name in columns['species_scientific_name']]
+
+    return columns
+
+
+def load_data(input_path: str = None, follow: bool = False) -> pd.DataFrame:
+    """
+    Returns a flatted (denormalised) dataframe of all data in the raw data file.
+    A .json file is read whole, .ndjson files (optionally .gz or .zst) are
+    streamed one plant at a time, and with follow are read while extract
+    is still writing them
+    """
+    input_path = str(input_path or INPUT_PATH)
+    if input_path.endswith('.json'):
+        with open(input_path, 'r', encoding='utf-8') as f:
+            raw_data = json.load(f)
+    else:
+        raw_data = iter_records(input_path, follow=follow)
+
+    return pd.DataFrame(flatten_to_columns(raw_data))
 
 
 def clean_phone(df: pd.DataFrame) -> pd.DataFrame:
@@ -96,28 +149,28 @@ def format_errors(data: pd.DataFrame) -> pd.DataFrame:
     formats the reading_error column so that it is True if there
     is an error and False if not
     """
-    for i in range(len(data['reading_temperature'])):
-
-        if pd.notna(data.loc[i, 'reading_error']):
-            data.loc[i, 'reading_error'] = True
-        else:
-            data.loc[i, 'reading_error'] = False
+    data['reading_error'] = data['reading_error'].notna()
 
     return data
 
 
-def add_alerts(data: pd.DataFrame) -> pd.DataFrame:
+def add_alerts(data: pd.DataFrame, baselines: PlantBaselines = None) -> pd.DataFrame:
     """
     adding alerts column to dataframe based on if moisture
     or temperature is beyond 1 standard deviation of the 
-    mean
+    mean. With baselines, each plant is compared to its own running
+    mean, otherwise to the mean of the whole batch
     """
+    if baselines is None:
+        temp_mean = data['reading_temperature'].mean()
+        temp_stdev = data['reading_temperature'].std()
 
-    temp_mean = data['reading_temperature'].mean()
-    temp_stdev = data['reading_temperature'].std()
-
-    moisture_mean = data['reading_soil_moisture'].mean()
-    moisture_stdev = data['reading_soil_moisture'].std()
+        moisture_mean = data['reading_soil_moisture'].mean()
+        moisture_stdev = data['reading_soil_moisture'].std()
+    else:
+        temp_mean, temp_stdev = baselines.get_thresholds(data, 'reading_temperature')
+        moisture_mean, moisture_stdev = baselines.get_thresholds(
+            data, 'reading_soil_moisture')
 
     data['reading_alert'] = (
         (~data['reading_error']) & (
@@ -130,13 +183,71 @@ def add_alerts(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
-def transform() -> None:
-    """Execute all transform processes"""
-    df = load_data()
+def transform_plants(raw_data: Iterable[dict],
+                     baselines: PlantBaselines = None) -> pd.DataFrame:
+    """Returns the clean table for raw plant data that is already in memory"""
+    return transform_dataframe(pd.DataFrame(flatten_to_columns(raw_data)), baselines)
+
+
+def transform_dataframe(df: pd.DataFrame, baselines: PlantBaselines = None) -> pd.DataFrame:
+    """
+    Cleans a flattened table, and labels its errors and alerts.
+    If baselines are given, alerts are judged against them and then the
+    new readings are added to them
+    """
     df = clean_data(df)
     df = format_errors(df)
-    df = add_alerts(df)
-    df.to_csv(OUTPUT_FILE, index=False)
+    df = add_alerts(df, baselines)
+    if baselines is not None:
+        baselines.update_from(df)
+
+    return df
+
+
+def get_output_file(output_format: str) -> str:
+    """Returns where the clean table is saved in the given format"""
+    if output_format == 'csv':
+        return OUTPUT_FILE
+    return f'{OUTPUT_PATH}clean_data.{output_format}'
+
+
+def save_clean_table(df: pd.DataFrame, path: str) -> None:
+    """
+    Saves the clean table in the format given by the file extension. Parquet
+    and Arrow keep the datetime, Int64 and bool types, and the .arrow (IPC)
+    file is left uncompressed so load can memory map it
+    """
+    path = str(path)
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False, compression='zstd')
+    elif path.endswith('.arrow'):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        df.to_csv(path, index=False)
+
+
+def archive_clean_table(df: pd.DataFrame) -> str:
+    """Saves a copy of a run's clean table as parquet, named by the time, and returns its path"""
+    if not os.path.exists(ARCHIVE_PATH):
+        os.makedirs(ARCHIVE_PATH)
+
+    run_time = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    path = f'{ARCHIVE_PATH}clean_data_{run_time}.parquet'
+    save_clean_table(df, path)
+
+    return path
+
+
+def transform(input_path: str = None, follow: bool = False,
+              use_baselines: bool = False, output_format: str = 'csv') -> None:
+    """Execute all transform processes"""
+    baselines = PlantBaselines() if use_baselines else None
+    df = transform_dataframe(load_data(input_path, follow), baselines)
+    save_clean_table(df, get_output_file(output_format))
+    if baselines is not None:
+        baselines.save()
 
 
 def setup_output() -> None:
@@ -145,6 +256,23 @@ def setup_output() -> None:
         os.makedirs(OUTPUT_PATH)
 
 
+def get_args() -> argparse.Namespace:
+    """Parses the command line arguments for the transform script"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', default=INPUT_PATH,
+                        help='Raw data file, .json or .ndjson (optionally .gz or .zst)')
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help='Read an .ndjson file while extract is still writing it')
+    parser.add_argument('-b', '--baselines', action='store_true',
+                        help="Alert on readings far from each plant's own running average")
+    parser.add_argument('-o', '--output-format', choices=OUTPUT_FORMATS, default='csv',
+                        help='Save the clean table as csv, or typed as parquet or arrow')
+
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    arguments = get_args()
     setup_output()
-    transform()
+    transform(arguments.input, arguments.follow, arguments.baselines,
+              arguments.output_format)
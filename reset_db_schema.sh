@@ -1 +1,2 @@
-sqlcmd -S c20-plants-db.c57vkec7dkkx.eu-west-2.rds.amazonaws.com -d plants -U beta -P pswd-beta1 -i schema.sql -C
\ No newline at end of file
+sqlcmd -S c20-plants-db.c57vkec7dkkx.eu-west-2.rds.amazonaws.com -d plants -U beta -P pswd-beta1 -i schema.sql -C
+python -m pipeline.migrate
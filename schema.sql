@@ -1,4 +1,6 @@
+DROP TABLE IF EXISTS schema_migrations; -- migrations are reapplied to the recreated tables
 DROP TABLE IF EXISTS reading;
+DROP TABLE IF EXISTS reading_daily;
 DROP TABLE IF EXISTS plant;
 DROP TABLE IF EXISTS origin;
 DROP TABLE IF EXISTS species;
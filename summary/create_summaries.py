@@ -1,55 +1,60 @@
 # pylint: disable=c-extension-no-member
-"""Generates and uploads summary data for plant readings from the past day"""
+# pylint: disable=logging-fstring-interpolation
+"""
+Generates summary data for plant readings from the past day, and archives
+the summary along with every raw reading of the day. Days the archive is
+missing can be backfilled, several at a time
+
+Run from the repository root:
+    python -m summary.create_summaries
+    python -m summary.create_summaries --backfill --start 2025-11-01
+"""
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os import environ
-from datetime import datetime
-import io
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterator
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pyodbc
-import boto3
-
+from pipeline.archive import Archive, ReadingArchive
+from pipeline.backends import get_backend
+from pipeline.db import get_pool, POOL_SIZE
+from pipeline.migrate import purge_readings, RETENTION_HOURS
 
-def get_db_connection() -> pyodbc.Connection:
-    """Returns a live connection to the database"""
-    load_dotenv()
-    conn = pyodbc.connect(
-        f"DRIVER={{ODBC Driver 18 for SQL Server}};"
-        f"SERVER={environ['DB_HOST']}, {environ['DB_PORT']};"
-        f"DATABASE={environ['DB_NAME']};"
-        f"UID={environ['DB_USER']};"
-        f"PWD={environ['DB_PASSWORD']};"
-        'TrustServerCertificate=yes;'
-    )
+SUMMARY_MODES = ('rollup', 'sql', 'readings')  # Overridden by the SUMMARY_MODE env var
+SUMMARY_METRICS = {'temperature': 'reading_temperature', 'moisture': 'reading_soil_moisture'}
+SUMMARY_PERCENTILES = (25, 50, 75)
+FETCH_BATCH_SIZE = 1_000  # Number of rows fetched from the database at a time
+BACKFILL_SOURCES = ('database', 'archive')  # Where backfilled days' readings are read from
+BACKFILL_DAYS = 31  # Days before today a backfill looks back over by default
+EXPORT_BATCH_SIZE = 50_000  # Readings encoded and uploaded at a time when archiving
+READING_SCHEMA = pa.schema([
+    ('reading_id', pa.int64()),
+    ('plant_id', pa.int64()),
+    ('botanist_id', pa.int64()),
+    ('reading_time_taken', pa.timestamp('us')),
+    ('reading_last_watered', pa.timestamp('us')),
+    ('reading_soil_moisture', pa.float64()),
+    ('reading_temperature', pa.float64()),
+    ('reading_error', pa.bool_()),
+    ('reading_alert', pa.bool_())
+])
 
-    return conn
 
-
-def upload_df_to_s3(df: pd.DataFrame) -> None:
-    """Takes a dataframe and uploads it to the S3 bucket"""
-    filename = f'{datetime.today().date()}.csv'
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-
-    load_dotenv()
-    session = boto3.Session(aws_access_key_id=environ["ACCESS_KEY"],
-                            aws_secret_access_key=environ["SECRET_ACCESS_KEY"],
-                            region_name=environ["REGION"])
-    s3_bucket_name = environ["BUCKET_NAME"]
-
-    s3_client = session.resource('s3')
-    s3_client.Object(s3_bucket_name, filename).put(Body=csv_buffer.getvalue())
-
-
-def get_reading_data(conn: pyodbc.Connection) -> pd.DataFrame:
-    """Fetches the reading data for the past day from the database"""
+def get_reading_data(conn: pyodbc.Connection, start: datetime, end: datetime) -> pd.DataFrame:
+    """Fetches the reading data taken from start up to end from the database"""
     sql_query = """
         SELECT *
         FROM reading
-        WHERE reading_time_taken >= DATEADD(day, -1, GETDATE());
+        WHERE reading_time_taken >= ? AND reading_time_taken < ?;
     """
 
     cur = conn.cursor()
-    cur.execute(sql_query)
+    cur.execute(sql_query, (start, end))
     columns = [column[0] for column in cur.description]
     readings_df = pd.DataFrame.from_records(cur.fetchall(), columns=columns)
     cur.close()
@@ -73,8 +78,330 @@ def generate_summary(df: pd.DataFrame) -> pd.DataFrame:
     return summary_df
 
 
+def get_rollup_data(conn: pyodbc.Connection, day: date) -> pd.DataFrame:
+    """Fetches each plant's daily rollup for the given day from the database"""
+    sql_query = """
+        SELECT
+            plant_id, temperature_sum, temperature_count, moisture_sum, moisture_count,
+            error_count, alert_count
+        FROM reading_daily
+        WHERE rollup_day = ?
+        ORDER BY plant_id;
+    """
+
+    cur = conn.cursor()
+    cur.execute(sql_query, (day,))
+    columns = [column[0] for column in cur.description]
+    rollups_df = pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+    cur.close()
+
+    return rollups_df
+
+
+def generate_summary_from_rollups(df: pd.DataFrame) -> pd.DataFrame:
+    """Takes a day's rollups and creates the same summary data as generate_summary"""
+    summary_df = pd.DataFrame({
+        'plant_id': df['plant_id'],
+        'reading_temperature': df['temperature_sum'] / df['temperature_count'],
+        'reading_soil_moisture': df['moisture_sum'] / df['moisture_count'],
+        'reading_error': df['error_count'],
+        'reading_alert': df['alert_count']
+    })
+
+    return summary_df
+
+
+def read_query(conn: pyodbc.Connection, sql_query: str, params: tuple) -> pd.DataFrame:
+    """Runs a query and reads its rows FETCH_BATCH_SIZE at a time"""
+    cur = conn.cursor()
+    cur.execute(sql_query, params)
+    columns = [column[0] for column in cur.description]
+    batches = []
+    while rows := cur.fetchmany(FETCH_BATCH_SIZE):
+        batches.append(pd.DataFrame.from_records(rows, columns=columns))
+    cur.close()
+
+    if not batches:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(batches, ignore_index=True)
+
+
+def get_aggregate_data(conn: pyodbc.Connection, start: datetime, end: datetime) -> pd.DataFrame:
+    """
+    Fetches each plant's counts, sums, sums of squares, minimums and maximums
+    of its readings from start up to end, grouped in the database
+    """
+    metrics = []
+    for metric, column in SUMMARY_METRICS.items():
+        metrics += [f'COUNT({column}) AS {metric}_count',
+                    f'COALESCE(SUM({column}), 0) AS {metric}_sum',
+                    f'COALESCE(SUM({column} * {column}), 0) AS {metric}_sumsq',
+                    f'MIN({column}) AS {metric}_min',
+                    f'MAX({column}) AS {metric}_max']
+    sql_query = f"""
+        SELECT
+            plant_id,
+            {', '.join(metrics)},
+            SUM(CASE WHEN reading_error = 1 THEN 1 ELSE 0 END) AS error_count,
+            SUM(CASE WHEN reading_alert = 1 THEN 1 ELSE 0 END) AS alert_count
+        FROM reading
+        WHERE plant_id IS NOT NULL
+            AND reading_time_taken >= ? AND reading_time_taken < ?
+        GROUP BY plant_id
+        ORDER BY plant_id;
+    """
+
+    return read_query(conn, sql_query, (start, end))
+
+
+def get_percentile_data(conn: pyodbc.Connection, column: str,
+                        start: datetime, end: datetime) -> pd.DataFrame:
+    """
+    Fetches only the ranked readings of each plant that SUMMARY_PERCENTILES
+    fall between, with the plant's count of readings, from start up to end
+    """
+    # a percentile q sits between ranks floor and ceiling of q * (count - 1) / 100
+    bounds = ' OR '.join(f'reading_rank IN (({q} * (reading_count - 1)) / 100, '
+                         f'({q} * (reading_count - 1) + 99) / 100)' for q in SUMMARY_PERCENTILES)
+    sql_query = f"""
+        SELECT plant_id, reading_rank, reading_count, reading_value
+        FROM (
+            SELECT
+                plant_id,
+                {column} AS reading_value,
+                ROW_NUMBER() OVER (PARTITION BY plant_id ORDER BY {column}) - 1 AS reading_rank,
+                COUNT(*) OVER (PARTITION BY plant_id) AS reading_count
+            FROM reading
+            WHERE plant_id IS NOT NULL AND {column} IS NOT NULL
+                AND reading_time_taken >= ? AND reading_time_taken < ?
+        ) AS ranked
+        WHERE {bounds};
+    """
+
+    return read_query(conn, sql_query, (start, end))
+
+
+def get_percentiles(ranked: pd.DataFrame, column: str) -> pd.DataFrame:
+    """Interpolates each plant's percentiles from its ranked readings, as pandas quantile does"""
+    values = ranked.set_index(['plant_id', 'reading_rank'])['reading_value']
+    counts = ranked.groupby('plant_id')['reading_count'].first()
+
+    percentiles = {}
+    for q in SUMMARY_PERCENTILES:
+        position = (q * (counts - 1) / 100).to_numpy()
+        lower, upper = np.floor(position).astype(int), np.ceil(position).astype(int)
+        low = values.reindex(list(zip(counts.index, lower))).to_numpy(dtype=float)
+        high = values.reindex(list(zip(counts.index, upper))).to_numpy(dtype=float)
+        percentiles[f'{column}_p{q}'] = low + (high - low) * (position - lower)
+
+    return pd.DataFrame(percentiles, index=counts.index)
+
+
+def generate_summary_in_sql(conn: pyodbc.Connection, start: datetime,
+                            end: datetime) -> pd.DataFrame:
+    """
+    Creates the same summary data as generate_summary, grouped in the
+    database, with each plant's minimum, maximum, standard deviation and
+    percentiles of both measurements added
+    """
+    aggregates = get_aggregate_data(conn, start, end)
+    summary_df = generate_summary_from_rollups(aggregates).set_index('plant_id')
+
+    for metric, column in SUMMARY_METRICS.items():
+        count = aggregates[f'{metric}_count'].to_numpy(dtype=float)
+        total = aggregates[f'{metric}_sum'].to_numpy(dtype=float)
+        sumsq = aggregates[f'{metric}_sumsq'].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.clip((sumsq - total ** 2 / count) / (count - 1), 0, None)
+
+        summary_df[f'{column}_min'] = aggregates[f'{metric}_min'].to_numpy(dtype=float)
+        summary_df[f'{column}_max'] = aggregates[f'{metric}_max'].to_numpy(dtype=float)
+        summary_df[f'{column}_std'] = np.where(count > 1, np.sqrt(variance), np.nan)
+        summary_df = summary_df.join(
+            get_percentiles(get_percentile_data(conn, column, start, end), column))
+
+    return summary_df.reset_index()
+
+
+def get_reading_batches(conn: pyodbc.Connection, start: datetime,
+                        end: datetime) -> Iterator[pa.RecordBatch]:
+    """
+    Yields the readings taken from start up to end, EXPORT_BATCH_SIZE at a
+    time in plant and time order, each as a record batch of READING_SCHEMA
+    """
+    sql_query = f"""
+        SELECT {', '.join(READING_SCHEMA.names)}
+        FROM reading
+        WHERE reading_time_taken >= ? AND reading_time_taken < ?
+        ORDER BY plant_id, reading_time_taken;
+    """
+
+    cur = conn.cursor()
+    cur.execute(sql_query, (start, end))
+    while rows := cur.fetchmany(EXPORT_BATCH_SIZE):
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(column, field.type) for column, field in zip(zip(*rows), READING_SCHEMA)],
+            schema=READING_SCHEMA)
+    cur.close()
+
+
+def archive_readings(conn: pyodbc.Connection, day: date, archive: Archive = None) -> str:
+    """
+    Streams every reading of a day into the reading archive, a batch at a
+    time, so memory stays the same however many readings the day has.
+    Returns the path written
+    """
+    archive = archive or ReadingArchive()
+    start = datetime.combine(day, time.min)
+
+    return archive.write_day_batches(
+        get_reading_batches(conn, start, start + timedelta(days=1)), READING_SCHEMA, day)
+
+
+def get_summary_mode(mode: str = None) -> str:
+    """Returns the summary mode, by default the SUMMARY_MODE env var's or the first"""
+    mode = mode or environ.get('SUMMARY_MODE', SUMMARY_MODES[0])
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f'Unknown summary mode {mode}, expected one of {SUMMARY_MODES}')
+
+    return mode
+
+
+def get_summary(conn: pyodbc.Connection, day: date, mode: str) -> pd.DataFrame:
+    """
+    Summarises a day's readings from the daily rollups, from grouping in the
+    database with the spread of each measurement, or from every reading
+    """
+    start = datetime.combine(day, time.min)
+    end = start + timedelta(days=1)
+    if mode == 'rollup':
+        return generate_summary_from_rollups(get_rollup_data(conn, day))
+    if mode == 'sql':
+        return generate_summary_in_sql(conn, start, end)
+    return generate_summary(get_reading_data(conn, start, end))
+
+
+def purge_archived_readings(conn: pyodbc.Connection, day: date,
+                            reading_archive: ReadingArchive = None) -> int:
+    """
+    Purges readings older than the retention window, first archiving any day
+    from the window's first up to day that the reading archive is missing,
+    so no reading is purged before it is archived. Returns the number purged
+    """
+    reading_archive = reading_archive or ReadingArchive()
+    # readings older than the window were purged by earlier runs, which checked their days
+    first_day = (datetime.now(timezone.utc) - timedelta(hours=RETENTION_HOURS)).date()
+    for missing_day in reading_archive.get_missing_days(first_day - timedelta(days=1), day):
+        archive_readings(conn, missing_day, reading_archive)
+
+    return purge_readings(conn, get_backend())
+
+
+def summarise_readings(day: date = None, mode: str = None) -> None:
+    """
+    Summarises a day's readings, by default yesterday's, and writes the
+    summary and the raw readings to the long-term archive. Readings past the
+    retention window are then purged from the database
+    """
+    load_dotenv()
+    day = day or datetime.now(timezone.utc).date() - timedelta(days=1)
+    mode = get_summary_mode(mode)
+
+    with get_pool().connection() as connection:
+        summary_data = get_summary(connection, day, mode)
+        reading_archive = ReadingArchive()
+        archive_readings(connection, day, reading_archive)
+        Archive().write_day(summary_data, day)
+        purge_archived_readings(connection, day, reading_archive)
+
+
+def backfill_day(day: date, mode: str, source: str, archive: Archive,
+                 reading_archive: ReadingArchive = None) -> int:
+    """
+    Summarises one missing day, from the database in the given mode or from
+    every archived raw reading of the day, and writes it to the archive.
+    Returns the number of plants summarised, days with no readings are left unwritten
+    """
+    if source == 'archive':
+        readings = (reading_archive or ReadingArchive()).read(day, day + timedelta(days=1))
+        summary_data = generate_summary(readings) if not readings.empty else readings
+    else:
+        with get_pool().connection() as connection:
+            summary_data = get_summary(connection, day, mode)
+
+    if summary_data.empty:
+        return 0
+    archive.write_day(summary_data, day)
+    return len(summary_data)
+
+
+def backfill_summaries(start: date, end: date, mode: str = None, source: str = None,
+                       concurrency: int = None, archive: Archive = None,
+                       reading_archive: ReadingArchive = None) -> dict[date, int]:
+    """
+    Summarises every day from start up to end that is missing from the
+    archive, concurrency days at a time, logging each as it finishes. A day
+    that fails is logged and left missing, so running again retries only
+    the days still missing. Returns the number of plants written by day
+    """
+    load_dotenv()
+    mode = get_summary_mode(mode)
+    source = source or BACKFILL_SOURCES[0]
+    if source not in BACKFILL_SOURCES:
+        raise ValueError(f'Unknown backfill source {source}, expected one of {BACKFILL_SOURCES}')
+    archive = archive or Archive()
+    if source == 'archive':
+        reading_archive = reading_archive or ReadingArchive()
+
+    missing = archive.get_missing_days(start, end)
+    logging.info(f'Backfilling {len(missing)} missing days from {start} to {end}')
+    written = {}
+    with ThreadPoolExecutor(max_workers=concurrency or POOL_SIZE) as executor:
+        futures = {executor.submit(backfill_day, day, mode, source, archive, reading_archive): day
+                   for day in missing}
+        for done, future in enumerate(as_completed(futures), 1):
+            day = futures[future]
+            try:
+                written[day] = future.result()
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                logging.error(f'Failed to backfill {day} ({done}/{len(missing)}): {err}')
+                continue
+            logging.info(f'Backfilled {day} with {written[day]} plants ({done}/{len(missing)})')
+
+    logging.info(f'Backfilled {sum(1 for plants in written.values() if plants)} days, '
+                 f'{len(missing) - len(written)} failed')
+    return written
+
+
+def handler(event, context) -> dict:  # pylint: disable=unused-argument
+    """Lambda entry point, warm invocations reuse the pooled connection"""
+    summarise_readings()
+    return {'statusCode': 200, 'connections': get_pool().get_metrics()}
+
+
 if __name__ == '__main__':
-    with get_db_connection() as connection:
-        reading_data = get_reading_data(connection)
-        summary_data = generate_summary(reading_data)
-        upload_df_to_s3(summary_data)
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backfill', action='store_true',
+                        help='Summarise every day missing from the archive instead of yesterday')
+    parser.add_argument('--start', type=date.fromisoformat,
+                        help=f'First day to backfill, as YYYY-MM-DD, {BACKFILL_DAYS} days ago '
+                        'by default')
+    parser.add_argument('--end', type=date.fromisoformat,
+                        help='Day after the last day to backfill, as YYYY-MM-DD, today by default')
+    parser.add_argument('--mode', choices=SUMMARY_MODES,
+                        help='How days are summarised, the SUMMARY_MODE env var by default')
+    parser.add_argument('--source', choices=BACKFILL_SOURCES, default=BACKFILL_SOURCES[0],
+                        help='Read backfilled days from the database or the raw reading archive')
+    parser.add_argument('--concurrency', type=int,
+                        help=f'Days summarised at once, {POOL_SIZE} by default, at most '
+                        'DB_POOL_SIZE when reading from the database')
+    args = parser.parse_args()
+
+    if args.backfill:
+        today = datetime.now(timezone.utc).date()
+        backfill_summaries(args.start or today - timedelta(days=BACKFILL_DAYS),
+                           args.end or today, args.mode, args.source, args.concurrency)
+    else:
+        summarise_readings(mode=args.mode)
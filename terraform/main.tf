@@ -32,6 +32,49 @@ resource "aws_s3_bucket" "radas-plants-s3" {
   force_destroy = true
 }
 
+#persistent storage for the pipeline's write-ahead spool and the state it keeps
+#between runs, so spooled batches, high-water marks, circuits, baselines and
+#fingerprints outlive the ECS task or Lambda that wrote them
+resource "aws_efs_file_system" "radas-plants-spool-efs" {
+  creation_token = "radas-plants-spool-efs"
+  encrypted = true
+}
+
+#security group rule to allow NFS from the pipeline to the spool
+resource "aws_security_group_rule" "allow_NFS_2049_rule" {
+    security_group_id        = aws_security_group.radas-group-project-sg.id
+    type                     = "ingress"
+    from_port                = 2049
+    protocol                 = "tcp"
+    to_port                  = 2049
+    source_security_group_id = aws_security_group.radas-group-project-sg.id
+}
+
+#mounting the spool in every subnet the pipeline runs in
+resource "aws_efs_mount_target" "radas-plants-spool-mount" {
+  for_each = toset(aws_db_subnet_group.radas-db-subnet-group.subnet_ids)
+  file_system_id = aws_efs_file_system.radas-plants-spool-efs.id
+  subnet_id = each.value
+  security_groups = [aws_security_group.radas-group-project-sg.id]
+}
+
+#the pipeline's folder, holding spool/ and state/, which the Lambda needs an access point to mount
+resource "aws_efs_access_point" "radas-plants-spool-ap" {
+  file_system_id = aws_efs_file_system.radas-plants-spool-efs.id
+  posix_user {
+    uid = 1000
+    gid = 1000
+  }
+  root_directory {
+    path = "/pipeline"
+    creation_info {
+      owner_uid = 1000
+      owner_gid = 1000
+      permissions = "750"
+    }
+  }
+}
+
 #specifies to not create a new version of the s3 every time the data is changed
 resource "aws_s3_bucket_versioning" "radas-plants-s3-version" {
   bucket = aws_s3_bucket.radas-plants-s3.id
@@ -138,11 +181,27 @@ container_definitions = jsonencode([
         {name = "ACCESS_KEY", value = var.AWS_ACCESS_KEY_ID},
         {name = "SECRET_ACCESS_KEY", value = var.AWS_SECRET_ACCESS_KEY},
         {name = "REGION", value = var.AWS_DEFAULT_REGION},
-        {name = "BUCKET_NAME", value = var.BUCKET_NAME}
+        {name = "BUCKET_NAME", value = var.BUCKET_NAME},
+        {name = "SPOOL_FOLDER", value = "/mnt/pipeline/spool/"},
+        {name = "STATE_FOLDER", value = "/mnt/pipeline/state/"}
+      ]
+      mountPoints = [
+        {sourceVolume = "pipeline", containerPath = "/mnt/pipeline"}
       ]
     }
   ])
 
+  volume {
+    name = "pipeline"
+    efs_volume_configuration {
+      file_system_id = aws_efs_file_system.radas-plants-spool-efs.id
+      transit_encryption = "ENABLED"
+      authorization_config {
+        access_point_id = aws_efs_access_point.radas-plants-spool-ap.id
+      }
+    }
+  }
+
   cpu = 512
   memory = 1024
   task_role_arn = data.aws_iam_role.ecs_task_execution_role.arn
@@ -223,6 +282,17 @@ resource "aws_iam_role_policy_attachment" "radas-lambda-etl-allow-ecr-access" {
   policy_arn = "arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly"
 }
 
+#letting the ETL Lambda join the VPC and mount the spool and state
+resource "aws_iam_role_policy_attachment" "radas-lambda-etl-vpc-access" {
+  role = aws_iam_role.radas-etl-lambda-iam-role.name
+  policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole"
+}
+
+resource "aws_iam_role_policy_attachment" "radas-lambda-etl-efs-access" {
+  role = aws_iam_role.radas-etl-lambda-iam-role.name
+  policy_arn = "arn:aws:iam::aws:policy/AmazonElasticFileSystemClientReadWriteAccess"
+}
+
 #adding policies to ETL Lambda's IAM role to allow access to RDS
 resource "aws_iam_role_policy" "radas-lambda-rds-policy" {
   name = "radas-lambda-rds-policy"
@@ -258,8 +328,26 @@ resource "aws_lambda_function" "radas-lambda-etl-pipeline" {
   image_uri = "129033205317.dkr.ecr.eu-west-2.amazonaws.com/radas-plants-etl-ecr:latest"
 
   architectures = ["x86_64"]
-  
 
+  #the spool and state are mounted from EFS, which needs the Lambda in the VPC
+  vpc_config {
+    subnet_ids = aws_db_subnet_group.radas-db-subnet-group.subnet_ids
+    security_group_ids = [aws_security_group.radas-group-project-sg.id]
+  }
+
+  file_system_config {
+    arn = aws_efs_access_point.radas-plants-spool-ap.arn
+    local_mount_path = "/mnt/pipeline"
+  }
+
+  environment {
+    variables = {
+      SPOOL_FOLDER = "/mnt/pipeline/spool/"
+      STATE_FOLDER = "/mnt/pipeline/state/"
+    }
+  }
+
+  depends_on = [aws_efs_mount_target.radas-plants-spool-mount]
 }
 
 #IAM role for the summary data Lambda
@@ -302,6 +390,7 @@ resource "aws_iam_role_policy" "radas-lambda-s3-policy" {
         Action = [
           "s3:GetObject",
           "s3:PutObject",
+          "s3:DeleteObject",
           "s3:ListBucket"
         ],
         Resource = [
@@ -322,6 +411,12 @@ resource "aws_lambda_function" "radas-lambda-summary" {
 
   architectures = ["x86_64"]
 
+  #the ECS task runs the image's script, the lambda calls its handler through the runtime interface client
+  image_config {
+    entry_point = ["python3", "-m", "awslambdaric"]
+    command = ["create_summaries.handler"]
+  }
+
 }
 
 
@@ -0,0 +1,337 @@
+"""Tests the partitioned Parquet archive of daily summaries and raw readings"""
+from datetime import date, datetime, timedelta, timezone
+import os
+import subprocess
+import sys
+from unittest.mock import MagicMock
+import pandas as pd
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pytest
+from pipeline.archive import Archive, ReadingArchive, get_months
+from pipeline.backends import SqliteBackend
+from summary.create_summaries import (archive_readings, backfill_summaries, summarise_readings,
+                                     handler, READING_SCHEMA)
+
+
+class RecordingFileSystem(pafs.LocalFileSystem):  # pylint: disable=too-few-public-methods
+    """A local stand-in for S3 that records the size of every write to an output stream"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def open_output_stream(self, path, *args, **kwargs):  # pylint: disable=unused-argument
+        """Opens a local file whose writes are recorded"""
+        return pa.PythonFile(RecordingFile(path, self.writes), mode='w')
+
+
+class S3StandIn(RecordingFileSystem):  # pylint: disable=too-few-public-methods
+    """A stand-in for S3, whose streams complete their upload when closed however writing ended"""
+    type_name = 's3'
+
+
+class RecordingFile:
+    """A writable file that appends the size of each write to a list"""
+
+    def __init__(self, path: str, writes: list):
+        self.file = open(path, 'wb')  # pylint: disable=consider-using-with
+        self.writes = writes
+        self.closed = False
+
+    def write(self, data) -> int:
+        """Writes and records the data"""
+        self.writes.append(len(data))
+        return self.file.write(data)
+
+    def close(self) -> None:
+        """Closes the file"""
+        self.file.close()
+        self.closed = True
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """An archive in a local folder"""
+    return Archive(str(tmp_path))
+
+
+def make_reading_batch(first_id: int, rows: int) -> pa.RecordBatch:
+    """Returns a batch of minute readings from ten plants"""
+    ids = range(first_id, first_id + rows)
+    taken = [datetime(2025, 11, 13) + timedelta(seconds=i) for i in ids]
+    return pa.RecordBatch.from_arrays([
+        pa.array(ids, pa.int64()),
+        pa.array([i % 10 for i in ids], pa.int64()),
+        pa.array([1] * rows, pa.int64()),
+        pa.array(taken, pa.timestamp('us')),
+        pa.array(taken, pa.timestamp('us')),
+        pa.array([float(i % 50) for i in ids]),
+        pa.array([float(i % 30) for i in ids]),
+        pa.array([i % 7 == 0 for i in ids]),
+        pa.array([False] * rows)
+    ], schema=READING_SCHEMA)
+
+
+def make_summary(day: date) -> pd.DataFrame:
+    """Returns a summary of three plants whose temperature is the day of the month"""
+    return pd.DataFrame({'plant_id': [1, 2, 3],
+                         'reading_temperature': [float(day.day)] * 3,
+                         'reading_error': [0, 1, 0]})
+
+
+def test_get_months_spans_years():
+    """Asserts that every month a date range touches is listed once"""
+    assert get_months(date(2025, 11, 20), date(2026, 2, 1)) == [(2025, 11), (2025, 12),
+                                                                (2026, 1)]
+
+
+def test_write_day_partitions_by_year_and_month(archive):
+    """Asserts that a day's summary is written under its year and month"""
+    path = archive.write_day(make_summary(date(2025, 11, 13)), date(2025, 11, 13))
+
+    assert path.endswith('year=2025/month=11/day-2025-11-13.parquet')
+    assert os.listdir(os.path.dirname(path)) == ['day-2025-11-13.parquet']
+
+
+def test_read_prunes_by_date_and_plant(archive):
+    """Asserts that only the days and plants asked for are returned"""
+    for day in (date(2025, 10, 31), date(2025, 11, 1), date(2025, 11, 2)):
+        archive.write_day(make_summary(day), day)
+
+    summaries = archive.read(date(2025, 11, 1), date(2025, 11, 2), plant_ids=[2, 3])
+
+    assert summaries['summary_date'].tolist() == [date(2025, 11, 1)] * 2
+    assert summaries['plant_id'].tolist() == [2, 3]
+
+
+def test_read_never_opens_months_out_of_range(archive):
+    """Asserts that files of months outside the range aren't read at all"""
+    archive.write_day(make_summary(date(2025, 11, 1)), date(2025, 11, 1))
+    october = archive.get_month_folder(2025, 10)
+    os.makedirs(october)
+    with open(f'{october}/day-2025-10-31.parquet', 'w', encoding='utf-8') as f:
+        f.write('not parquet')
+
+    assert len(archive.read(date(2025, 11, 1), date(2025, 12, 1))) == 3
+
+
+def test_compact_month_merges_day_files(archive):
+    """Asserts that a month's day files become one month file with the same rows"""
+    for day in range(1, 4):
+        archive.write_day(make_summary(date(2025, 11, day)), date(2025, 11, day))
+    before = archive.read(date(2025, 11, 1), date(2025, 12, 1))
+
+    assert archive.compact_month(2025, 11) == 3
+    assert os.listdir(archive.get_month_folder(2025, 11)) == ['month-2025-11.parquet']
+    pd.testing.assert_frame_equal(archive.read(date(2025, 11, 1), date(2025, 12, 1)), before)
+
+
+def test_rewritten_day_replaces_compacted_rows(archive):
+    """Asserts that a day written again after compaction replaces, not adds to, its rows"""
+    archive.write_day(make_summary(date(2025, 11, 1)), date(2025, 11, 1))
+    archive.compact_month(2025, 11)
+
+    archive.write_day(make_summary(date(2025, 11, 5)).assign(plant_id=[1, 2, 4]),
+                      date(2025, 11, 1))
+    for _ in range(2):
+        summaries = archive.read(date(2025, 11, 1), date(2025, 11, 2))
+        assert summaries['plant_id'].tolist() == [1, 2, 4]
+        assert summaries['reading_temperature'].tolist() == [5.0] * 3
+        archive.compact_month(2025, 11)
+
+
+def test_compact_only_closed_months(archive):
+    """Asserts that the current month's day files are left for later"""
+    archive.write_day(make_summary(date(2025, 10, 31)), date(2025, 10, 31))
+    archive.write_day(make_summary(date(2025, 11, 1)), date(2025, 11, 1))
+
+    assert archive.compact(before=date(2025, 11, 2)) == [(2025, 10)]
+    assert os.listdir(archive.get_month_folder(2025, 11)) == ['day-2025-11-01.parquet']
+
+
+def test_write_day_batches_uploads_each_batch_as_it_arrives(tmp_path):
+    """Asserts that batches are encoded and written while later ones are still
+    being fetched, and that the day reads back whole"""
+    filesystem = RecordingFileSystem()
+    archive = ReadingArchive(str(tmp_path), filesystem)
+    written_before_batch = []
+
+    def get_batches():
+        for first_id in range(0, 3000, 1000):
+            written_before_batch.append(sum(filesystem.writes))
+            yield make_reading_batch(first_id, 1000)
+
+    archive.write_day_batches(get_batches(), READING_SCHEMA, date(2025, 11, 13))
+    readings = archive.read(date(2025, 11, 13), date(2025, 11, 14), plant_ids=[3])
+
+    assert written_before_batch[1] < written_before_batch[2] < sum(filesystem.writes)
+    assert len(readings) == 300
+    assert set(readings['reading_date']) == {date(2025, 11, 13)}
+    assert os.listdir(archive.get_month_folder(2025, 11)) == ['day-2025-11-13.parquet']
+
+
+def test_failed_write_day_batches_leaves_no_day_file(tmp_path):
+    """Asserts that a day whose readings fail partway through isn't archived
+    truncated on S3, and that a day archived before is kept as it was"""
+    archive = ReadingArchive(str(tmp_path), S3StandIn())
+    archive.write_day_batches(iter([make_reading_batch(0, 10)]), READING_SCHEMA,
+                              date(2025, 11, 12))
+
+    def get_failing_batches():
+        yield make_reading_batch(0, 1000)
+        raise ConnectionError('cursor lost')
+
+    for day in (date(2025, 11, 12), date(2025, 11, 13)):
+        with pytest.raises(ConnectionError):
+            archive.write_day_batches(get_failing_batches(), READING_SCHEMA, day)
+
+    assert os.listdir(archive.get_month_folder(2025, 11)) == ['day-2025-11-12.parquet']
+    assert len(archive.read(date(2025, 11, 12), date(2025, 11, 13))) == 10
+    assert archive.get_missing_days(date(2025, 11, 12), date(2025, 11, 14)) == [
+        date(2025, 11, 13)]
+
+
+def test_archive_readings_exports_only_the_day(tmp_path, monkeypatch):
+    """Asserts that a day's readings are archived with their types, fetched in batches"""
+    monkeypatch.setattr('summary.create_summaries.EXPORT_BATCH_SIZE', 1)
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    with backend.connection() as conn:
+        conn.executemany('INSERT INTO plant (plant_id) VALUES (?);', [(1,), (2,)])
+        conn.executemany("""
+            INSERT INTO reading (reading_time_taken, reading_soil_moisture, reading_temperature,
+                                 reading_error, reading_alert, plant_id)
+            VALUES (?, ?, ?, ?, ?, ?);""",
+                         [(datetime(2025, 11, 13, 23, 59), 30.0, None, True, False, 1),
+                          (datetime(2025, 11, 13, 12), 31.0, 12.5, False, True, 2),
+                          (datetime(2025, 11, 14), 32.0, 13.0, False, False, 1)])
+        archive = ReadingArchive(str(tmp_path))
+        archive_readings(conn, date(2025, 11, 13), archive)
+
+    readings = archive.read(date(2025, 11, 13), date(2025, 11, 14))
+
+    assert readings['plant_id'].tolist() == [1, 2]
+    assert readings['reading_error'].tolist() == [True, False]
+    assert readings['reading_temperature'].isna().tolist() == [True, False]
+    assert readings['reading_time_taken'].iloc[0] == pd.Timestamp(2025, 11, 13, 23, 59)
+
+
+def test_write_day_batches_memory_stays_bounded(tmp_path):
+    """Asserts that peak memory grows by far less than the day's readings
+    take up, measured in a fresh process"""
+    script = f"""
+import resource
+from datetime import date
+from pipeline.archive import ReadingArchive
+from summary.create_summaries import READING_SCHEMA
+from test_archive import make_reading_batch
+
+archive = ReadingArchive({str(tmp_path)!r})
+archive.write_day_batches(iter([make_reading_batch(0, 10)]), READING_SCHEMA, date(2025, 11, 12))
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+batches = (make_reading_batch(first_id, 20_000) for first_id in range(0, 600_000, 20_000))
+archive.write_day_batches(batches, READING_SCHEMA, date(2025, 11, 13))
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+"""
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, check=True,
+                            text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    growth_mb = int(result.stdout) / 1024
+
+    # 600,000 readings are about 40 MB as arrays, written as one DataFrame they peak over 150 MB
+    assert growth_mb < 20
+
+
+def test_get_missing_days_checks_day_and_month_files(archive):
+    """Asserts that days in either a day file or a compacted month file count as archived"""
+    archive.write_day(make_summary(date(2025, 10, 30)), date(2025, 10, 30))
+    archive.compact_month(2025, 10)
+    archive.write_day(make_summary(date(2025, 11, 1)), date(2025, 11, 1))
+
+    assert archive.get_missing_days(date(2025, 10, 29), date(2025, 11, 3)) == [
+        date(2025, 10, 29), date(2025, 10, 31), date(2025, 11, 2)]
+
+
+def test_backfill_writes_only_missing_days(tmp_path, archive, monkeypatch):
+    """Asserts that days missing from the archive are summarised from the database,
+    days already archived or without readings are left alone, and a rerun writes nothing"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    monkeypatch.setattr('summary.create_summaries.get_pool', lambda: backend)
+    with backend.connection() as conn:
+        conn.executemany('INSERT INTO plant (plant_id) VALUES (?);', [(1,), (2,)])
+        conn.executemany("""
+            INSERT INTO reading (reading_time_taken, reading_temperature, reading_soil_moisture,
+                                 reading_error, reading_alert, plant_id)
+            VALUES (?, ?, ?, ?, ?, ?);""",
+                         [(datetime(2025, 11, day, 12), float(day), 30.0, False, False, plant)
+                          for day in range(1, 5) for plant in (1, 2)])
+    archive.write_day(make_summary(date(2025, 11, 2)), date(2025, 11, 2))
+
+    written = backfill_summaries(date(2025, 11, 1), date(2025, 11, 6), mode='readings',
+                                 concurrency=3, archive=archive)
+
+    assert written == {date(2025, 11, 1): 2, date(2025, 11, 3): 2, date(2025, 11, 4): 2,
+                       date(2025, 11, 5): 0}
+    summaries = archive.read(date(2025, 11, 1), date(2025, 11, 6))
+    assert summaries.groupby('summary_date')['reading_temperature'].first().tolist() == [
+        1.0, 2.0, 3.0, 4.0]
+    assert not backfill_summaries(date(2025, 11, 1), date(2025, 11, 5), mode='readings',
+                                  archive=archive)
+
+
+def test_backfill_from_reading_archive_skips_failed_days(tmp_path, archive):
+    """Asserts that days are summarised from their archived readings, and that a day
+    which fails is left missing without stopping the others"""
+    reading_archive = ReadingArchive(str(tmp_path))
+    for day in (1, 3):
+        reading_archive.write_day_batches(iter([make_reading_batch(0, 100)]), READING_SCHEMA,
+                                          date(2025, 11, day))
+    broken = reading_archive.get_day_path(date(2025, 11, 2))
+    with open(broken, 'w', encoding='utf-8') as f:
+        f.write('not parquet')
+
+    written = backfill_summaries(date(2025, 11, 1), date(2025, 11, 4), source='archive',
+                                 archive=archive, reading_archive=reading_archive)
+
+    assert written == {date(2025, 11, 1): 10, date(2025, 11, 3): 10}
+    assert archive.get_missing_days(date(2025, 11, 1), date(2025, 11, 4)) == [date(2025, 11, 2)]
+
+
+def test_summarise_readings_archives_then_purges_old_readings(tmp_path, monkeypatch):
+    """Asserts that the daily job purges readings past the retention window, archiving
+    any day of them the reading archive is missing first"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    monkeypatch.setattr('summary.create_summaries.get_pool', lambda: backend)
+    monkeypatch.setattr('summary.create_summaries.get_backend', lambda: backend)
+    monkeypatch.setenv('ARCHIVE_URI', str(tmp_path))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with backend.connection() as conn:
+        conn.execute('INSERT INTO plant (plant_id) VALUES (1);')
+        conn.executemany("""
+            INSERT INTO reading (reading_id, reading_time_taken, reading_temperature, plant_id)
+            VALUES (?, ?, 12.0, 1);""",
+                         [(1, now - timedelta(hours=72)), (2, now - timedelta(hours=30)),
+                          (3, now - timedelta(hours=2))])
+
+    summarise_readings(mode='readings')
+
+    with backend.connection() as conn:
+        kept = conn.execute('SELECT reading_id FROM reading ORDER BY 1;').fetchall()
+    purged_day = (now - timedelta(hours=72)).date()
+    archived = ReadingArchive(str(tmp_path)).read(purged_day, purged_day + timedelta(days=1))
+    yesterday = datetime.now(timezone.utc).date() - timedelta(days=1)
+
+    assert kept == [(2,), (3,)]
+    assert archived['reading_id'].tolist() == [1]
+    assert not Archive(str(tmp_path)).get_missing_days(yesterday, yesterday + timedelta(days=1))
+
+
+def test_handler_summarises_yesterday_and_reports_the_pool(monkeypatch):
+    """Asserts that the Lambda entry point runs the daily job and returns the pool's metrics"""
+    calls = []
+    monkeypatch.setattr('summary.create_summaries.summarise_readings', lambda: calls.append(1))
+    pool = MagicMock()
+    pool.get_metrics.return_value = {'opened': 1}
+    monkeypatch.setattr('summary.create_summaries.get_pool', lambda: pool)
+
+    assert handler({}, None) == {'statusCode': 200, 'connections': {'opened': 1}}
+    assert calls == [1]
@@ -0,0 +1,99 @@
+"""Tests the per-plant running baselines used for alerts"""
+import math
+import pytest
+import numpy as np
+import pandas as pd
+from pipeline.baselines import PlantBaselines
+from pipeline.transform import add_alerts
+
+
+def make_readings(plant_id: int, temperatures: list, moistures: list,
+                  first_minute: int = 0) -> pd.DataFrame:
+    """Returns a reading table for one plant, one reading a minute"""
+    return pd.DataFrame({
+        'plant_id': [plant_id] * len(temperatures),
+        'reading_time_taken': pd.date_range('2025-11-13 12:00', periods=len(temperatures),
+                                            freq='min') + pd.Timedelta(minutes=first_minute),
+        'reading_temperature': temperatures,
+        'reading_soil_moisture': moistures,
+        'reading_error': [False] * len(temperatures)
+    })
+
+
+def test_baseline_matches_mean_and_stdev():
+    """Asserts that the running baseline equals the mean and sample standard
+    deviation of every reading added"""
+    temperatures = [12.0, 14.5, 13.0, 18.25, 11.0, 15.5]
+    baselines = PlantBaselines()
+    baselines.update_from(make_readings(1, temperatures, [30.0] * 6))
+
+    count, mean, stdev = baselines.get_baseline(1, 'reading_temperature')
+
+    assert count == 6
+    assert mean == pytest.approx(np.mean(temperatures))
+    assert stdev == pytest.approx(np.std(temperatures, ddof=1))
+
+
+def test_baseline_ignores_repeated_and_error_readings():
+    """Asserts that a reading is only counted once, and errors not at all"""
+    readings = make_readings(1, [12.0, 14.0], [30.0, 31.0])
+    baselines = PlantBaselines()
+    baselines.update_from(readings)
+    baselines.update_from(readings)
+
+    errors = make_readings(1, [90.0], [0.0], first_minute=5)
+    errors['reading_error'] = True
+    baselines.update_from(errors)
+
+    assert baselines.get_baseline(1, 'reading_temperature')[0] == 2
+
+
+def test_baseline_persists_between_runs():
+    """Asserts that saved baselines are picked up by the next run"""
+    baselines = PlantBaselines()
+    baselines.update_from(make_readings(3, [10.0, 20.0], [40.0, 50.0]))
+    baselines.save()
+
+    count, mean, _ = PlantBaselines().get_baseline(3, 'reading_temperature')
+
+    assert (count, mean) == (2, 15.0)
+
+
+def test_baseline_unknown_plant():
+    """Asserts that a plant with no readings has an empty baseline"""
+    count, _, stdev = PlantBaselines().get_baseline(99, 'reading_soil_moisture')
+
+    assert count == 0
+    assert math.isnan(stdev)
+
+
+def test_add_alerts_against_each_plants_baseline(monkeypatch):
+    """Asserts that each plant is judged against its own history, so a reading
+    normal for a hot plant is not an alert just because the batch is cold"""
+    monkeypatch.setattr('pipeline.baselines.MIN_BASELINE_READINGS', 5)
+    baselines = PlantBaselines()
+    baselines.update_from(make_readings(1, [30.0, 31.0, 29.0, 30.5, 29.5], [50.0] * 5))
+    baselines.update_from(make_readings(2, [10.0, 11.0, 9.0, 10.5, 9.5], [50.0] * 5))
+
+    batch = pd.concat([make_readings(1, [30.2], [50.0], first_minute=10),
+                       make_readings(2, [20.0], [50.0], first_minute=10)],
+                      ignore_index=True)
+
+    alerts = add_alerts(batch, baselines)
+
+    assert list(alerts['reading_alert']) == [False, True]
+
+
+def test_add_alerts_falls_back_to_batch_for_new_plants():
+    """Asserts that plants without enough history are judged against the batch"""
+    batch = pd.DataFrame({
+        'plant_id': [1, 2, 3, 4],
+        'reading_temperature': [100, 50, 11, 49],
+        'reading_soil_moisture': [0.98, 0.5, 0.45, 0.14],
+        'reading_error': [True, False, False, False]
+    })
+
+    with_baselines = add_alerts(batch.copy(), PlantBaselines())
+    without_baselines = add_alerts(batch.copy())
+
+    assert list(with_baselines['reading_alert']) == list(without_baselines['reading_alert'])
@@ -0,0 +1,82 @@
+# pylint: disable=c-extension-no-member
+"""Tests the shared database connection pool"""
+from unittest.mock import MagicMock
+import pytest
+import pyodbc
+from pipeline.db import ConnectionPool
+
+
+@pytest.fixture
+def fake_connect():
+    """Returns a fake connect function that makes a new fake connection each call"""
+    return MagicMock(side_effect=lambda: MagicMock())
+
+
+def test_pool_reuses_released_connections(fake_connect):
+    """Asserts that a released connection is handed out again instead of a new one"""
+    pool = ConnectionPool(size=2, connect=fake_connect)
+
+    conn = pool.acquire()
+    pool.release(conn)
+
+    assert pool.acquire() is conn
+    assert fake_connect.call_count == 1
+
+
+def test_pool_times_out_when_full(fake_connect):
+    """Asserts that no more than size connections are opened at once"""
+    pool = ConnectionPool(size=1, connect=fake_connect)
+    pool.acquire()
+
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+    assert fake_connect.call_count == 1
+
+
+def test_pool_replaces_stale_connections(fake_connect):
+    """Asserts that an idle connection failing its health check is swapped for a new one"""
+    pool = ConnectionPool(size=1, connect=fake_connect, health_check_interval=1e-9)
+    stale = pool.acquire()
+    stale.cursor.return_value.execute.side_effect = pyodbc.Error('connection reset')
+    pool.release(stale)
+
+    conn = pool.acquire()
+
+    assert conn is not stale
+    stale.close.assert_called_once()
+    assert pool.get_metrics()['discarded'] == 1
+
+
+def test_connection_commits_and_returns_to_pool(fake_connect):
+    """Asserts that the block is committed and the connection kept for reuse"""
+    pool = ConnectionPool(size=1, connect=fake_connect)
+
+    with pool.connection() as conn:
+        pass
+
+    conn.commit.assert_called_once()
+    assert pool.get_metrics()['idle'] == 1
+
+
+def test_connection_discarded_after_database_error(fake_connect):
+    """Asserts that a connection which raised a database error isn't reused"""
+    pool = ConnectionPool(size=1, connect=fake_connect)
+
+    with pytest.raises(pyodbc.Error):
+        with pool.connection() as conn:
+            raise pyodbc.Error('communication link failure')
+
+    conn.close.assert_called_once()
+    assert pool.acquire() is not conn
+
+
+def test_get_metrics_records_acquire_latency(fake_connect):
+    """Asserts that acquire latencies are reported once a connection is acquired"""
+    pool = ConnectionPool(size=1, connect=fake_connect)
+    assert 'acquire_p95_ms' not in pool.get_metrics()
+
+    pool.release(pool.acquire())
+    metrics = pool.get_metrics()
+
+    assert metrics['acquired'] == 1
+    assert metrics['acquire_max_ms'] >= 0
@@ -1,7 +1,13 @@
 """Tests extract script edge cases, ideal and unideal behaviour"""
 import json
+from unittest.mock import MagicMock
 import pytest
+import requests
 from pipeline.extract import save_to_json, check_new_endpoints, extract_data, BASE_NUM_ENDPOINTS
+from pipeline.extract import AsyncPlantClient, CircuitBreaker, fetch_data_by_id
+from pipeline.ndjson import iter_records
+from pipeline.state import load_state, save_state
+from benchmarks.bench_extract import start_mock_api
 
 
 def test_save_to_json_contents_correct(monkeypatch, tmp_path):
@@ -36,21 +42,28 @@ def test_save_to_json_empty(monkeypatch, tmp_path):
     assert fake_output_data == []
 
 
+@pytest.fixture(autouse=True)
+def fake_data_folders(monkeypatch, tmp_path):
+    """Keeps reports and raw data out of the working directory"""
+    monkeypatch.setattr('pipeline.extract.OUTPUT_FOLDER', f'{tmp_path}/raw_data/')
+    monkeypatch.setattr('pipeline.extract.REPORT_FOLDER', f'{tmp_path}/reports/')
+    monkeypatch.setattr('pipeline.extract.REPORT_FILE', str(tmp_path/'report.json'))
+
+
 def monkeypatch_fetch_data_by_id_1(id_num):
     """Fake fetch data function to ensure the new endpoint is only one increment
     above the current known endpoint"""
-    if id_num == BASE_NUM_ENDPOINTS:
+    if id_num == BASE_NUM_ENDPOINTS + 1:
         return {"status_code": 200, "body": {"id": id_num}}
     return {"status_code": 404, "body": {}}
 
 
 def test_check_new_endpoints_new_found(monkeypatch):
-    """Asserts that if a new endpoint is found, the current_max_endpoint goes up
-    by 5 during the search"""
+    """Asserts that if a new endpoint is found, it becomes the max endpoint"""
     monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
                         monkeypatch_fetch_data_by_id_1)
     result = check_new_endpoints()
-    assert result == BASE_NUM_ENDPOINTS + 5
+    assert result == BASE_NUM_ENDPOINTS + 1
 
 
 def monkeypatch_fetch_data_by_id_2(id_num):
@@ -68,6 +81,48 @@ def test_check_new_endpoints_no_new_found(monkeypatch):
     assert result == BASE_NUM_ENDPOINTS
 
 
+def make_fake_fetch_many(live_ids: set, probed: list):
+    """Returns a fake fetch_many that records every id it is asked for"""
+    def fake_fetch_many(plant_ids):
+        probed.append(list(plant_ids))
+        return [{'status_code': 200 if i in live_ids else 404, 'body': {}}
+                for i in plant_ids]
+    return fake_fetch_many
+
+
+def test_check_new_endpoints_tolerates_gaps():
+    """Asserts that holes in the id space no wider than the gap width are
+    skipped over and the real last plant is found"""
+    live_ids = set(range(1, 1001)) - set(range(300, 303)) - {640, 900, 901}
+    result = check_new_endpoints(make_fake_fetch_many(live_ids, []), gap_width=3)
+    assert result == 1000
+
+
+def test_check_new_endpoints_few_round_trips():
+    """Asserts that a large jump in plants is found in a logarithmic number of probes"""
+    probed = []
+    check_new_endpoints(make_fake_fetch_many(set(range(1, 5001)), probed))
+    assert len(probed) < 30
+
+
+def test_check_new_endpoints_starts_from_saved_max():
+    """Asserts that the max endpoint is saved and the next run starts from it"""
+    live_ids = set(range(1, 301))
+    assert check_new_endpoints(make_fake_fetch_many(live_ids, [])) == 300
+
+    probed = []
+    assert check_new_endpoints(make_fake_fetch_many(live_ids, probed)) == 300
+    assert probed[0][0] == 300
+    assert len(probed) <= 4
+
+
+def test_check_new_endpoints_fleet_shrinks():
+    """Asserts that plants removed since the last run are searched back down to"""
+    check_new_endpoints(make_fake_fetch_many(set(range(1, 301)), []))
+    result = check_new_endpoints(make_fake_fetch_many(set(range(1, 121)), []))
+    assert result == 120
+
+
 class FakePool:
     """Fake 'Pool' class to replace multiprocessing.Pool for tests"""
 
@@ -83,6 +138,9 @@ class FakePool:
     def map(self, func, iterable):
         return [func(i) for i in iterable]
 
+    def imap(self, func, iterable):
+        return (func(i) for i in iterable)
+
 
 def monkeypatch_fetch_data_by_id_3(id_num):
     """Fake fetch data function"""
@@ -103,7 +161,7 @@ def test_extract_data(monkeypatch, tmp_path):
     monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
                         monkeypatch_fetch_data_by_id_3)
 
-    extract_data()
+    extract_data('pool')
 
     with open(fake_output, 'r', encoding='utf-8') as f:
         fake_output_data = json.load(f)
@@ -139,7 +197,7 @@ def test_extract_data_some_errors(monkeypatch, tmp_path):
     monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
                         monkeypatch_fetch_data_by_id_some_errors)
 
-    extract_data()
+    extract_data('pool')
 
     with open(fake_output, 'r', encoding='utf-8') as f:
         fake_output_data = json.load(f)
@@ -154,3 +212,243 @@ def test_extract_data_some_errors(monkeypatch, tmp_path):
         assert ids == [1, 3, 5, 7]
         assert names == ['Test plant 1', 'Test plant 3',
                          'Test plant 5', 'Test plant 7']
+
+
+@pytest.fixture
+def mock_api():
+    """Starts a local plants api serving plants 1 to 12"""
+    server = start_mock_api(num_plants=12, latency=0)
+    yield f'http://127.0.0.1:{server.server_address[1]}/api/plants/'
+    server.shutdown()
+
+
+def test_async_client_keeps_result_contract(monkeypatch, mock_api):
+    """Asserts that the async client returns status_code/body dicts in id order"""
+    monkeypatch.setattr('pipeline.extract.BASE_URL', mock_api)
+
+    with AsyncPlantClient(max_concurrency=4) as client:
+        results = client.fetch_many(range(10, 15))
+
+    assert [result['status_code'] for result in results] == [200, 200, 200, 404, 404]
+    assert [result['body']['plant_id'] for result in results] == [10, 11, 12, 13, 14]
+
+
+def test_async_client_gives_up_after_retries(monkeypatch):
+    """Asserts that an unreachable api returns an empty result instead of raising"""
+    monkeypatch.setattr('pipeline.extract.BASE_URL',
+                        'http://127.0.0.1:9/api/plants/')
+
+    with AsyncPlantClient(max_retries=1, backoff=0, timeout=1) as client:
+        results = client.fetch_many(range(1, 3))
+
+    assert results == [{'status_code': None, 'body': None, 'error': 'connection_error'},
+                       {'status_code': None, 'body': None, 'error': 'connection_error'}]
+
+
+def test_extract_data_async_engine(monkeypatch, tmp_path, mock_api):
+    """Asserts that the async engine discovers and saves every live plant"""
+    fake_output = tmp_path/'plant_data_raw_test.json'
+    monkeypatch.setattr('pipeline.extract.OUTPUT_FILE', str(fake_output))
+    monkeypatch.setattr('pipeline.extract.BASE_URL', mock_api)
+    monkeypatch.setattr('pipeline.extract.BASE_NUM_ENDPOINTS', 5)
+
+    extract_data('async')
+
+    with open(fake_output, 'r', encoding='utf-8') as f:
+        fake_output_data = json.load(f)
+
+    assert [datapoint['plant_id'] for datapoint in fake_output_data] == list(range(1, 13))
+
+
+@pytest.mark.parametrize('output_format', ['ndjson', 'ndjson.gz', 'ndjson.zst'])
+def test_extract_data_streams_ndjson(monkeypatch, tmp_path, output_format):
+    """Asserts that every successful plant is written as its own ndjson line"""
+    fake_output = tmp_path/'plant_data_raw_test.ndjson'
+    monkeypatch.setattr('pipeline.extract.NDJSON_OUTPUT_FILE', str(fake_output))
+    monkeypatch.setattr('pipeline.extract.multiprocessing.Pool',
+                        lambda *a, **k: FakePool())
+    monkeypatch.setattr('pipeline.extract.check_new_endpoints', lambda: 7)
+    monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
+                        monkeypatch_fetch_data_by_id_some_errors)
+
+    extract_data('pool', output_format)
+
+    suffix = output_format.removeprefix('ndjson')
+    records = list(iter_records(f'{fake_output}{suffix}'))
+
+    assert [record['plant_id'] for record in records] == [1, 3, 5, 7]
+    assert (tmp_path/f'plant_data_raw_test.ndjson{suffix}.done').exists()
+
+
+def test_extract_data_async_engine_streams_ndjson(monkeypatch, tmp_path, mock_api):
+    """Asserts that the async engine hands results to the writer as they arrive"""
+    fake_output = tmp_path/'plant_data_raw_test.ndjson'
+    monkeypatch.setattr('pipeline.extract.NDJSON_OUTPUT_FILE', str(fake_output))
+    monkeypatch.setattr('pipeline.extract.BASE_URL', mock_api)
+    monkeypatch.setattr('pipeline.extract.BASE_NUM_ENDPOINTS', 5)
+
+    extract_data('async', 'ndjson')
+
+    ids = sorted(record['plant_id'] for record in iter_records(fake_output))
+    assert ids == list(range(1, 13))
+
+
+def monkeypatch_fetch_data_by_id_unchanged(id_num):
+    """Fake fetch function where every plant has the same reading as before"""
+    return {'status_code': 200,
+            'body': {'plant_id': id_num, 'recording_taken': '2025-11-13T12:00:00'}}
+
+
+def monkeypatch_fetch_data_by_id_changing(id_num):
+    """Fake fetch function where only plant 2 has taken a new reading"""
+    if id_num == 2:
+        return {'status_code': 200,
+                'body': {'plant_id': id_num, 'recording_taken': '2025-11-13T12:01:00'}}
+    return monkeypatch_fetch_data_by_id_unchanged(id_num)
+
+
+def test_extract_data_incremental_skips_unchanged(monkeypatch, tmp_path):
+    """Asserts that an incremental run only outputs plants that changed
+    since the previous incremental run, and counts the rest as skipped"""
+    fake_output = tmp_path/'plant_data_raw_test.json'
+    monkeypatch.setattr('pipeline.extract.OUTPUT_FILE', str(fake_output))
+    monkeypatch.setattr('pipeline.extract.multiprocessing.Pool',
+                        lambda *a, **k: FakePool())
+    monkeypatch.setattr('pipeline.extract.check_new_endpoints', lambda: 3)
+    monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
+                        monkeypatch_fetch_data_by_id_unchanged)
+
+    first_report = extract_data('pool', incremental=True)
+    monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
+                        monkeypatch_fetch_data_by_id_changing)
+    second_report = extract_data('pool', incremental=True)
+
+    with open(fake_output, 'r', encoding='utf-8') as f:
+        fake_output_data = json.load(f)
+
+    assert (first_report['emitted'], first_report['skipped']) == (3, 0)
+    assert (second_report['emitted'], second_report['skipped']) == (1, 2)
+    assert fake_output_data == [{'plant_id': 2, 'recording_taken': '2025-11-13T12:01:00'}]
+
+
+def test_extract_data_incremental_ndjson(monkeypatch, tmp_path):
+    """Asserts that unchanged plants are left out of the ndjson stream"""
+    fake_output = tmp_path/'plant_data_raw_test.ndjson'
+    monkeypatch.setattr('pipeline.extract.NDJSON_OUTPUT_FILE', str(fake_output))
+    monkeypatch.setattr('pipeline.extract.multiprocessing.Pool',
+                        lambda *a, **k: FakePool())
+    monkeypatch.setattr('pipeline.extract.check_new_endpoints', lambda: 3)
+    monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
+                        monkeypatch_fetch_data_by_id_changing)
+
+    extract_data('pool', 'ndjson', incremental=True)
+    report = extract_data('pool', 'ndjson', incremental=True)
+
+    assert (report['emitted'], report['skipped']) == (0, 3)
+    assert not list(iter_records(fake_output))
+
+
+def test_fetch_data_by_id_timeout(monkeypatch):
+    """Asserts that a timeout is classified instead of raised"""
+    monkeypatch.setattr('pipeline.extract.req.get',
+                        MagicMock(side_effect=requests.Timeout()))
+
+    assert fetch_data_by_id(1) == {'status_code': None, 'body': None, 'error': 'timeout'}
+
+
+def test_fetch_data_by_id_malformed_body(monkeypatch):
+    """Asserts that a body which isn't json is classified instead of raised"""
+    fake_response = MagicMock(status_code=200)
+    fake_response.json.side_effect = ValueError('not json')
+    monkeypatch.setattr('pipeline.extract.req.get', MagicMock(return_value=fake_response))
+
+    assert fetch_data_by_id(1)['error'] == 'malformed_body'
+
+
+def test_fetch_data_by_id_http_error(monkeypatch):
+    """Asserts that a non 200 response keeps its body and is classified"""
+    fake_response = MagicMock(status_code=500)
+    fake_response.json.return_value = {'error': 'sensor fault'}
+    monkeypatch.setattr('pipeline.extract.req.get', MagicMock(return_value=fake_response))
+
+    assert fetch_data_by_id(1) == {'status_code': 500, 'body': {'error': 'sensor fault'},
+                                   'error': 'http_error'}
+
+
+def test_circuit_breaker_opens_and_recovers():
+    """Asserts that a plant is skipped after failing the threshold number of runs
+    in a row, is retried once the cooldown is over, and closes on success"""
+    for _ in range(3):
+        breaker = CircuitBreaker(failure_threshold=3, cooldown_runs=2)
+        to_fetch, skipped = breaker.filter_ids([1, 2])
+        assert (to_fetch, skipped) == ([1, 2], [])
+        breaker.record(1, 'timeout')
+        breaker.record(2, None)
+        breaker.save()
+    assert breaker.opened == [1]
+
+    for _ in range(2):
+        breaker = CircuitBreaker(failure_threshold=3, cooldown_runs=2)
+        assert breaker.filter_ids([1, 2]) == ([2], [1])
+        breaker.save()
+
+    breaker = CircuitBreaker(failure_threshold=3, cooldown_runs=2)
+    assert breaker.filter_ids([1, 2]) == ([1, 2], [])
+    breaker.record(1, None)
+    breaker.save()
+
+    assert CircuitBreaker().circuits == {}
+
+
+def test_circuit_breaker_doubles_cooldown():
+    """Asserts that a plant failing again after its cooldown is skipped for longer"""
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_runs=2)
+    breaker.record(1, 'http_error')
+    assert breaker.circuits['1']['skip_runs'] == 2
+    breaker.record(1, 'http_error')
+    assert breaker.circuits['1']['skip_runs'] == 4
+
+
+def monkeypatch_fetch_data_by_id_mixed(id_num):
+    """Fake fetch function with one of each kind of failure"""
+    failures = {2: 'timeout', 3: 'malformed_body', 4: 'http_error'}
+    if id_num in failures:
+        return {'status_code': None, 'body': None, 'error': failures[id_num]}
+    return monkeypatch_fetch_data_by_id_3(id_num)
+
+
+def test_extract_data_report(monkeypatch, tmp_path):
+    """Asserts that failures are reported by kind, and that a plant is left out
+    of later runs once its circuit opens"""
+    monkeypatch.setattr('pipeline.extract.OUTPUT_FILE', str(tmp_path/'raw.json'))
+    monkeypatch.setattr('pipeline.extract.FAILURE_THRESHOLD', 2)
+    monkeypatch.setattr('pipeline.extract.multiprocessing.Pool',
+                        lambda *a, **k: FakePool())
+    monkeypatch.setattr('pipeline.extract.check_new_endpoints', lambda: 5)
+    monkeypatch.setattr('pipeline.extract.fetch_data_by_id',
+                        monkeypatch_fetch_data_by_id_mixed)
+
+    first_report = extract_data('pool')
+    second_report = extract_data('pool')
+    third_report = extract_data('pool')
+
+    with open(tmp_path/'report.json', 'r', encoding='utf-8') as f:
+        saved_report = json.load(f)
+
+    assert first_report['failures'] == {'timeout': [2], 'connection_error': [],
+                                        'http_error': [4], 'malformed_body': [3]}
+    assert (first_report['requested'], first_report['succeeded']) == (5, 2)
+    assert second_report['circuit_opened'] == [2, 3, 4]
+    assert third_report['circuit_open'] == [2, 3, 4]
+    assert third_report['requested'] == 2
+    assert saved_report['circuit_open'] == [2, 3, 4]
+
+
+def test_state_folder_env_var_points_at_a_mount(monkeypatch, tmp_path):
+    """Asserts that state is kept in the STATE_FOLDER env var's folder when it is set"""
+    monkeypatch.setenv('STATE_FOLDER', str(tmp_path / 'mount'))
+
+    save_state('high_water_mark', {'max_id': 50})
+
+    assert (tmp_path / 'mount' / 'high_water_mark.json').exists()
+    assert load_state('high_water_mark') == {'max_id': 50}
@@ -1,8 +1,17 @@
 """Tests load script to ensure script is working as expected"""
+from datetime import datetime
 from unittest.mock import MagicMock
 import pytest
 import pandas as pd
 from pipeline.load import upload_table_data_with_foreign_key, upload_table_data
+from pipeline.load import FOREIGN_TABLES, DIMENSION_TABLES, DimensionKeyCache, get_table
+from pipeline.load import upload_dimension_data, upload_reading_data, READING_TABLE
+from pipeline.load import get_staging_columns, upload_table_data_bulk
+from pipeline.load import DimensionFingerprints, upload_all_tables, to_sql_params
+from pipeline.load import get_load_levels, upload_all_tables_parallel
+from pipeline.backends import SqliteBackend, SqlServerBackend, StorageBackend
+from pipeline.migrate import apply_migrations
+from pipeline.db import ConnectionPool
 
 
 @pytest.fixture
@@ -105,3 +114,392 @@ def test_upload_table_data_correct_args(get_fake_conn_and_cursor):
     ]
 
     assert params_used == expected_params
+
+
+def test_upload_reading_same_params_from_typed_table(get_fake_conn_and_cursor, tmp_path):
+    """Asserts that reading params are the same whether the times come from
+    csv text or an already typed datetime column"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+    reading_table = [table for table in FOREIGN_TABLES
+                     if table['table_name'] == 'reading'][0]
+
+    typed = pd.DataFrame({
+        'reading_last_watered': pd.to_datetime(['2025-11-13 10:00:00']),
+        'reading_time_taken': pd.to_datetime(['2025-11-13 12:00:00']),
+        'reading_soil_moisture': [30.5],
+        'reading_temperature': [12.25],
+        'reading_error': [False],
+        'reading_alert': [True],
+        'plant_id': [7],
+        'botanist_email': ['crabby@fakegmail.com']
+    })
+    typed.to_csv(tmp_path / 'clean.csv', index=False)
+    from_csv = pd.read_csv(tmp_path / 'clean.csv')
+
+    upload_table_data_with_foreign_key(fake_connection, reading_table, typed)
+    upload_table_data_with_foreign_key(fake_connection, reading_table, from_csv)
+
+    typed_params, csv_params = [call.args[1] for call in
+                                fake_cursor.executemany.call_args_list]
+    assert typed_params == csv_params
+
+
+@pytest.fixture
+def clean_table():
+    """A clean table with two plants, one already in the database"""
+    return pd.DataFrame({
+        'plant_id': [1, 2],
+        'species_name': ['Fern', 'Cactus'],
+        'species_scientific_name': ['Fernus', 'Cactus Spinus'],
+        'country_name': ['France', 'Mexico'],
+        'city_name': ['Lyon', 'Merida'],
+        'origin_latitude': [45.7, 20.9],
+        'origin_longitude': [4.8, -89.6],
+        'image_original_url': ['http://example.com/1.jpg', 'http://example.com/2.jpg'],
+        'image_regular_url': [None, None],
+        'image_medium_url': [None, None],
+        'image_small_url': [None, None],
+        'image_thumbnail_url': [None, None],
+        'license_number': [45, 45],
+        'license_name': ['CC-BY', 'CC-BY'],
+        'license_url': ['http://example.com/l', 'http://example.com/l'],
+        'botanist_name': ['Crabby', 'Pepper'],
+        'botanist_email': ['crabby@fakegmail.com', 'pepper@fakegmail.com'],
+        'botanist_phone': ['441234567890', '440987654321'],
+        'reading_last_watered': pd.to_datetime(['2025-11-13 10:00', '2025-11-13 10:00']),
+        'reading_time_taken': pd.to_datetime(['2025-11-13 12:00', '2025-11-13 12:01']),
+        'reading_soil_moisture': [30.5, 12.0],
+        'reading_temperature': [12.25, 25.0],
+        'reading_error': [False, True],
+        'reading_alert': [False, False]
+    })
+
+
+def test_dimension_key_cache_warm(get_fake_conn_and_cursor):
+    """Asserts that the cache is warmed with one select per table"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+    fake_cursor.fetchall.side_effect = [[('France', 1)]] + [[]] * 7 + [[(1, datetime(2025, 11, 13))]]
+
+    cache = DimensionKeyCache()
+    cache.warm(fake_connection)
+
+    assert fake_cursor.execute.call_count == len(DIMENSION_TABLES) + 1
+    assert cache.keys['country'] == {'France': 1}
+    assert cache.latest_readings == {1: datetime(2025, 11, 13)}
+
+
+def test_upload_dimension_data_only_sends_new_rows(get_fake_conn_and_cursor, clean_table):
+    """Asserts that rows already in the cache aren't sent, and new ids are cached"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+    fake_cursor.fetchone.return_value = (7,)
+    cache = DimensionKeyCache()
+    cache.keys = {'country': {'France': 1, 'Mexico': 2}, 'city': {'Lyon': 3}}
+
+    upload_dimension_data(fake_connection, get_table('city'), clean_table, cache)
+
+    fake_cursor.execute.assert_called_once()
+    assert fake_cursor.execute.call_args.args[1] == ('Merida', 2, 'Merida')
+    assert cache.keys['city'] == {'Lyon': 3, 'Merida': 7}
+
+
+def test_upload_dimension_data_nothing_new(get_fake_conn_and_cursor, clean_table):
+    """Asserts that nothing is sent when every row is already known"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+    cache = DimensionKeyCache()
+    cache.keys = {'country': {'France': 1, 'Mexico': 2}}
+
+    upload_dimension_data(fake_connection, get_table('country'), clean_table, cache)
+
+    fake_cursor.execute.assert_not_called()
+
+
+def test_upload_reading_data_resolves_keys_client_side(get_fake_conn_and_cursor, clean_table):
+    """Asserts that readings are plain inserts with ids filled in, and readings
+    that aren't newer than a plant's latest loaded reading are dropped"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+    cache = DimensionKeyCache()
+    cache.keys = {'plant': {1: 1, 2: 2},
+                  'botanist': {'crabby@fakegmail.com': 4, 'pepper@fakegmail.com': 5}}
+    cache.latest_readings = {1: datetime(2025, 11, 13, 12, 0)}
+
+    upload_reading_data(fake_connection, clean_table, cache)
+
+    sql_query, params = fake_cursor.executemany.call_args_list[0].args
+    assert 'SELECT' not in sql_query
+    assert params == [(datetime(2025, 11, 13, 10, 0), datetime(2025, 11, 13, 12, 1),
+                       12.0, 25.0, True, False, 2, 5)]
+    assert cache.latest_readings[2] == datetime(2025, 11, 13, 12, 1)
+
+
+def test_get_staging_columns_swaps_ids_for_unique_columns():
+    """Asserts that foreign ids are staged as the unique column they point at"""
+    assert get_staging_columns(get_table('plant')) == ['plant_id', 'species_name',
+                                                       'origin_longitude']
+    assert get_staging_columns(get_table('reading'))[-2:] == ['plant_id', 'botanist_email']
+
+
+def test_upload_table_data_bulk_stages_then_merges(get_fake_conn_and_cursor, clean_table):
+    """Asserts that rows are sent to a staging table in one fast executemany,
+    then copied across in one set-based statement"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+
+    upload_table_data_bulk(fake_connection, get_table('city'), clean_table)
+
+    assert fake_cursor.fast_executemany is True
+    fake_cursor.executemany.assert_called_once()
+    assert fake_cursor.executemany.call_args.args[1] == [('Lyon', 'France'),
+                                                          ('Merida', 'Mexico')]
+    statements = [call.args[0] for call in fake_cursor.execute.call_args_list]
+    assert 'CREATE TABLE #staging_city' in statements[0]
+    assert 'LEFT JOIN country' in statements[1]
+    assert 'DROP TABLE #staging_city' in statements[2]
+
+
+def test_upload_table_data_bulk_batches_rows(get_fake_conn_and_cursor, clean_table, monkeypatch):
+    """Asserts that large tables are staged in batches"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+    monkeypatch.setattr('pipeline.backends.BULK_BATCH_SIZE', 1)
+
+    upload_table_data_bulk(fake_connection, READING_TABLE, clean_table)
+
+    assert fake_cursor.executemany.call_count == 2
+
+
+def test_dimension_fingerprints_skip_unchanged_tables(clean_table):
+    """Asserts that a dimension is skipped when its rows match the last batch"""
+    fingerprints = DimensionFingerprints()
+
+    assert len(fingerprints.get_new_rows(get_table('country'), clean_table)) == 2
+    assert fingerprints.get_new_rows(get_table('country'), clean_table).empty
+    assert fingerprints.skipped == ['country']
+
+
+def test_dimension_fingerprints_only_return_new_members(clean_table):
+    """Asserts that only rows never sent before are returned when a dimension changes"""
+    fingerprints = DimensionFingerprints()
+    fingerprints.get_new_rows(get_table('plant'), clean_table.iloc[:1])
+    fingerprints.save()
+
+    new_rows = DimensionFingerprints().get_new_rows(get_table('plant'), clean_table)
+
+    assert list(new_rows.columns) == ['plant_id', 'species_name', 'origin_longitude']
+    assert list(new_rows['plant_id']) == [2]
+
+
+def test_upload_all_tables_skips_empty_dimensions(get_fake_conn_and_cursor, clean_table,
+                                                  monkeypatch):
+    """Asserts that only readings are sent once every dimension has been sent"""
+    fake_cursor, fake_connection = get_fake_conn_and_cursor
+    database_keys = {table['table_name']: dict.fromkeys(clean_table[table['unique_column']])
+                     for table in DIMENSION_TABLES}
+    monkeypatch.setattr('pipeline.load.lookup_dimension_keys', lambda *args: database_keys)
+    fingerprints = DimensionFingerprints()
+    upload_all_tables(fake_connection, clean_table, fingerprints=fingerprints)
+    fake_cursor.reset_mock()
+
+    upload_all_tables(fake_connection, clean_table, fingerprints=fingerprints)
+
+    fake_cursor.executemany.assert_called_once()
+    assert 'INSERT INTO\n            reading' in fake_cursor.executemany.call_args.args[0]
+
+
+def test_to_sql_params_keeps_native_types():
+    """Asserts that params are plain python values, with missing values as None"""
+    df = pd.DataFrame({
+        'reading_time_taken': pd.to_datetime(['2025-11-13 12:00', None]),
+        'reading_temperature': [12.5, float('nan')],
+        'reading_error': [True, False],
+        'plant_id': [1, 2],
+        'botanist_email': ['crabby@fakegmail.com', None]
+    })
+
+    params = to_sql_params(df)
+
+    assert params == [(datetime(2025, 11, 13, 12, 0), 12.5, True, 1, 'crabby@fakegmail.com'),
+                      (None, None, False, 2, None)]
+    assert [type(value) for value in params[0]] == [datetime, float, bool, int, str]
+
+
+@pytest.mark.parametrize('load_kwargs', [{}, {'cache': 'cache'}, {'bulk': True}])
+def test_upload_all_tables_into_sqlite(tmp_path, clean_table, load_kwargs):
+    """Asserts that every load path fills the local database the same way,
+    and loading the same table twice adds nothing"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    for _ in range(2):
+        kwargs = {**load_kwargs, 'backend': backend}
+        if 'cache' in kwargs:
+            kwargs['cache'] = DimensionKeyCache()
+        with backend.connection() as conn:
+            upload_all_tables(conn, clean_table, **kwargs)
+
+    with backend.connection() as conn:
+        readings = conn.execute("""
+            SELECT r.plant_id, b.botanist_email, r.reading_time_taken, r.reading_error
+            FROM reading r
+            JOIN botanist b ON b.botanist_id = r.botanist_id
+            ORDER BY r.plant_id;""").fetchall()
+        plants = conn.execute("""
+            SELECT p.plant_id, s.species_name, ci.city_name, co.country_name
+            FROM plant p
+            JOIN species s ON s.species_id = p.species_id
+            JOIN origin o ON o.origin_id = p.origin_id
+            JOIN city ci ON ci.city_id = o.city_id
+            JOIN country co ON co.country_id = ci.country_id
+            ORDER BY p.plant_id;""").fetchall()
+
+    assert readings == [(1, 'crabby@fakegmail.com', datetime(2025, 11, 13, 12, 0), 0),
+                        (2, 'pepper@fakegmail.com', datetime(2025, 11, 13, 12, 1), 1)]
+    assert plants == [(1, 'Fern', 'Lyon', 'France'), (2, 'Cactus', 'Merida', 'Mexico')]
+
+
+@pytest.mark.parametrize('load_kwargs', [{}, {'cache': 'cache'}, {'bulk': True}])
+def test_upload_all_tables_keeps_readings_taken_at_the_same_time(tmp_path, clean_table,
+                                                                 load_kwargs):
+    """Asserts that two plants read at the same time are both loaded, once,
+    under the migrated plant and time unique index"""
+    clean_table['reading_time_taken'] = pd.Timestamp('2025-11-13 12:00')
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    with backend.connection() as conn:
+        apply_migrations(conn, backend)
+
+    for _ in range(2):
+        kwargs = {**load_kwargs, 'backend': backend}
+        if 'cache' in kwargs:
+            kwargs['cache'] = DimensionKeyCache()
+        with backend.connection() as conn:
+            upload_all_tables(conn, clean_table, **kwargs)
+
+    with backend.connection() as conn:
+        readings = conn.execute(
+            'SELECT plant_id FROM reading ORDER BY plant_id;').fetchall()
+
+    assert readings == [(1,), (2,)]
+
+
+def test_dimension_fingerprints_resend_rows_a_new_database_lacks(tmp_path, clean_table):
+    """Asserts that dimensions fingerprinted against one database are still sent
+    to a fresh one, so its readings don't lose their foreign keys"""
+    fingerprints = DimensionFingerprints()
+    for path in ('plants.db', 'reset.db'):
+        backend = SqliteBackend(str(tmp_path / path))
+        with backend.connection() as conn:
+            upload_all_tables(conn, clean_table, DimensionKeyCache(),
+                              fingerprints=fingerprints, backend=backend)
+
+    with backend.connection() as conn:
+        readings = conn.execute("""
+            SELECT r.plant_id, b.botanist_email
+            FROM reading r
+            JOIN botanist b ON b.botanist_id = r.botanist_id
+            ORDER BY r.plant_id;""").fetchall()
+
+    assert readings == [(1, 'crabby@fakegmail.com'), (2, 'pepper@fakegmail.com')]
+
+
+@pytest.mark.parametrize('load_kwargs', [{}, {'bulk': True}])
+def test_dimension_fingerprints_resend_rows_a_reset_database_lacks_without_cache(
+        tmp_path, clean_table, load_kwargs):
+    """Asserts that the paths without a key cache also check the fingerprints
+    against the database's keys, so a fresh database gets its dimensions"""
+    fingerprints = DimensionFingerprints()
+    for path in ('plants.db', 'reset.db'):
+        backend = SqliteBackend(str(tmp_path / path))
+        with backend.connection() as conn:
+            upload_all_tables(conn, clean_table, fingerprints=fingerprints, backend=backend,
+                              **load_kwargs)
+
+    with backend.connection() as conn:
+        plants = conn.execute('SELECT plant_id FROM plant ORDER BY plant_id;').fetchall()
+        readings = conn.execute('SELECT COUNT(*) FROM reading;').fetchone()[0]
+
+    assert plants == [(1,), (2,)]
+    assert readings == 2
+
+
+def test_sqlite_backend_cache_warms_from_database(tmp_path, clean_table):
+    """Asserts that a new cache picks up the keys and latest readings already loaded"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    with backend.connection() as conn:
+        upload_all_tables(conn, clean_table, DimensionKeyCache(), backend=backend)
+
+    cache = DimensionKeyCache()
+    with backend.connection() as conn:
+        cache.warm(conn, backend)
+
+    assert cache.keys['country'] == {'France': 1, 'Mexico': 2}
+    assert cache.latest_readings == {1: datetime(2025, 11, 13, 12, 0),
+                                     2: datetime(2025, 11, 13, 12, 1)}
+
+
+def test_storage_backend_without_connection_fails_when_created():
+    """Asserts that a backend which can't lend connections is rejected straight away"""
+    class IncompleteBackend(StorageBackend):  # pylint: disable=abstract-method
+        """A backend that forgot to implement connection"""
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_storage_backend_without_dialect_statements_fails_when_created():
+    """Asserts that a backend has to give its own syntax for the statements databases differ on"""
+    class ConnectionOnlyBackend(StorageBackend):  # pylint: disable=abstract-method
+        """A backend that relies on another database's syntax"""
+        name = 'connection_only'
+
+        def connection(self):
+            """Lends nothing"""
+
+    with pytest.raises(TypeError, match='has_table'):
+        ConnectionOnlyBackend()
+
+
+def test_get_load_levels_follow_foreign_keys():
+    """Asserts that tables are grouped so each only depends on earlier levels"""
+    levels = [[table['table_name'] for table in level] for level in get_load_levels()]
+
+    assert levels == [['country', 'botanist', 'license'], ['city', 'image'],
+                      ['origin', 'species'], ['plant'], ['reading']]
+
+
+def test_get_load_levels_rejects_cycles():
+    """Asserts that tables pointing at each other can't be levelled"""
+    tables = [{'table_name': 'a', 'columns': ['b_id'], 'unique_column': 'b_id'},
+              {'table_name': 'b', 'columns': ['a_id'], 'unique_column': 'a_id'}]
+
+    with pytest.raises(ValueError):
+        get_load_levels(tables)
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    """Swaps the SQL Server backend's pool for one of fake connections"""
+    pool = ConnectionPool(size=4, connect=lambda: MagicMock())
+    monkeypatch.setattr('pipeline.backends.get_pool', lambda: pool)
+    return pool
+
+
+def test_upload_all_tables_parallel_uses_a_connection_per_table(fake_pool, clean_table):
+    """Asserts that the tables in a level are loaded on their own connections"""
+    upload_all_tables_parallel(SqlServerBackend(migrate=False), clean_table)
+
+    assert fake_pool.opened == 3
+    assert fake_pool.get_metrics()['acquired'] == 3 + 2 + 2 + 1 + 1
+
+
+def test_upload_all_tables_parallel_rolls_back_a_failed_level(fake_pool, clean_table, monkeypatch):
+    """Asserts that one table failing rolls back its whole level and stops the load"""
+    loaded = []
+
+    def fake_upload_table(conn, table, *args):
+        if table['table_name'] == 'image':
+            raise ValueError('bad image')
+        loaded.append((conn, table['table_name']))
+    monkeypatch.setattr('pipeline.load.upload_table', fake_upload_table)
+
+    with pytest.raises(ValueError):
+        upload_all_tables_parallel(SqlServerBackend(migrate=False), clean_table)
+
+    city_conn = [conn for conn, name in loaded if name == 'city'][0]
+    city_conn.rollback.assert_called_once()
+    assert 'origin' not in [name for _, name in loaded]
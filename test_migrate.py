@@ -0,0 +1,130 @@
+"""Tests the schema migrations and the reading retention purge"""
+import sqlite3
+from datetime import datetime
+from unittest.mock import MagicMock
+import pytest
+from pipeline.backends import SqliteBackend, SqlServerBackend, get_sqlite_schema
+from pipeline.db import ConnectionPool
+from pipeline.migrate import get_migrations, get_statements, apply_migrations, purge_readings
+
+
+@pytest.fixture
+def backend(tmp_path):
+    """A local database on the original schema with one plant"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'), migrate=False)
+    with backend.connection() as conn:
+        conn.execute('INSERT INTO plant (plant_id) VALUES (1);')
+    return backend
+
+
+def add_reading(conn, time_taken: datetime, plant_id: int = 1) -> None:
+    """Inserts a reading taken at the given time"""
+    conn.execute('INSERT INTO reading (plant_id, reading_time_taken) VALUES (?, ?);',
+                 (plant_id, time_taken))
+
+
+def test_get_migrations_in_version_order():
+    """Asserts that the migration files are found and sorted by version"""
+    versions = [version for version, _, _ in get_migrations()]
+
+    assert versions == sorted(versions)
+    assert versions[:2] == [1, 2]
+
+
+def test_get_statements_splits_and_strips_comments(tmp_path):
+    """Asserts that a migration file is split into its statements without comments"""
+    path = tmp_path / '001_example.sql'
+    path.write_text('-- a comment; with a semicolon\nDELETE FROM a;\n\nCREATE INDEX i\nON a (b);\n')
+
+    assert get_statements(str(path)) == ['DELETE FROM a', 'CREATE INDEX i\nON a (b)']
+
+
+def test_apply_migrations_once_each(backend):
+    """Asserts that every migration is applied and recorded, and rerunning applies none"""
+    with backend.connection() as conn:
+        applied = apply_migrations(conn, backend)
+    with backend.connection() as conn:
+        reapplied = apply_migrations(conn, backend)
+        recorded = conn.execute(
+            'SELECT migration_version FROM schema_migrations ORDER BY 1;').fetchall()
+        indexes = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'reading';")}
+
+    assert applied == [version for version, _, _ in get_migrations()]
+    assert not reapplied
+    assert [row[0] for row in recorded] == applied
+    assert {'ix_reading_plant_time', 'ix_reading_time'} <= indexes
+
+
+def test_reset_then_migrate_restores_indexes(backend):
+    """Asserts that rerunning schema.sql, as reset_db_schema.sh does, forgets the
+    applied migrations, so migrating again recreates what they added"""
+    with backend.connection() as conn:
+        applied = apply_migrations(conn, backend)
+        conn.executescript(get_sqlite_schema())
+        reapplied = apply_migrations(conn, backend)
+        objects = {row[0] for row in conn.execute('SELECT name FROM sqlite_master;')}
+
+    assert reapplied == applied
+    assert {'ix_reading_plant_time', 'ix_reading_time', 'reading_daily'} <= objects
+
+
+def test_apply_migrations_up_to_target(backend):
+    """Asserts that migrations after the target version are left for later"""
+    with backend.connection() as conn:
+        assert apply_migrations(conn, backend, target=1) == [1]
+        assert apply_migrations(conn, backend)[0] == 2
+
+
+def test_sql_server_backend_migrates_once_when_first_used(monkeypatch):
+    """Asserts that SQL Server applies pending migrations before the first
+    connection is lent, and only once per process"""
+    pool = ConnectionPool(size=2, connect=MagicMock)
+    monkeypatch.setattr('pipeline.backends.get_pool', lambda: pool)
+    migrated = []
+    monkeypatch.setattr('pipeline.migrate.apply_migrations',
+                        lambda conn, backend: migrated.append(backend))
+    backend = SqlServerBackend()
+
+    for _ in range(3):
+        with backend.connection():
+            pass
+
+    assert migrated == [backend]
+    with SqlServerBackend(migrate=False).connection():
+        pass
+    assert migrated == [backend]
+
+
+def test_unique_index_removes_duplicates_then_enforces(backend):
+    """Asserts that readings loaded twice are cut to one, and can't be loaded twice again"""
+    with backend.connection() as conn:
+        for _ in range(3):
+            add_reading(conn, datetime(2025, 11, 13, 12, 0))
+        add_reading(conn, datetime(2025, 11, 13, 12, 1))
+
+    with backend.connection() as conn:
+        apply_migrations(conn, backend, target=1)
+        count = conn.execute('SELECT COUNT(*) FROM reading;').fetchone()[0]
+
+    assert count == 2
+    with pytest.raises(sqlite3.IntegrityError):
+        with backend.connection() as conn:
+            add_reading(conn, datetime(2025, 11, 13, 12, 0))
+
+
+def test_purge_readings_deletes_only_old_readings_in_batches(backend, monkeypatch):
+    """Asserts that readings outside the retention window are deleted a batch at a time"""
+    monkeypatch.setattr('pipeline.migrate.PURGE_BATCH_SIZE', 2)
+    with backend.connection() as conn:
+        for hour in range(10):
+            add_reading(conn, datetime(2025, 11, 13, hour, 0))
+
+    with backend.connection() as conn:
+        deleted = purge_readings(conn, backend, retention_hours=5,
+                                 now=datetime(2025, 11, 13, 10, 0))
+        remaining = conn.execute(
+            'SELECT MIN(reading_time_taken) FROM reading;').fetchone()[0]
+
+    assert deleted == 5
+    assert remaining == '2025-11-13 05:00:00'
@@ -0,0 +1,131 @@
+"""Tests the daily reading rollups and the summaries made from them and in SQL"""
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import pytest
+from pipeline.backends import SqliteBackend
+from pipeline.load import DimensionKeyCache, upload_all_tables
+from pipeline.rollups import get_rollup_deltas, rebuild_rollups
+from summary.create_summaries import (generate_summary, generate_summary_from_rollups,
+                                     generate_summary_in_sql, get_rollup_data,
+                                     SUMMARY_PERCENTILES)
+
+
+@pytest.fixture
+def clean_table():
+    """Six readings from two plants over two days, one with no temperature"""
+    return pd.DataFrame({
+        'plant_id': [1, 2, 1, 2, 1, 2],
+        'species_name': ['Fern', 'Cactus'] * 3,
+        'species_scientific_name': ['Fernus', 'Cactus Spinus'] * 3,
+        'country_name': ['France', 'Mexico'] * 3,
+        'city_name': ['Lyon', 'Merida'] * 3,
+        'origin_latitude': [45.7, 20.9] * 3,
+        'origin_longitude': [4.8, -89.6] * 3,
+        'image_original_url': ['http://example.com/1.jpg', 'http://example.com/2.jpg'] * 3,
+        'image_regular_url': [None] * 6,
+        'image_medium_url': [None] * 6,
+        'image_small_url': [None] * 6,
+        'image_thumbnail_url': [None] * 6,
+        'license_number': [45] * 6,
+        'license_name': ['CC-BY'] * 6,
+        'license_url': ['http://example.com/l'] * 6,
+        'botanist_name': ['Crabby', 'Pepper'] * 3,
+        'botanist_email': ['crabby@fakegmail.com', 'pepper@fakegmail.com'] * 3,
+        'botanist_phone': ['441234567890', '440987654321'] * 3,
+        'reading_last_watered': pd.to_datetime(['2025-11-13 10:00'] * 6),
+        'reading_time_taken': pd.to_datetime(['2025-11-13 12:00', '2025-11-13 12:00',
+                                              '2025-11-13 12:01', '2025-11-13 12:01',
+                                              '2025-11-14 00:00', '2025-11-14 00:00']),
+        'reading_soil_moisture': [30.0, 12.0, 32.0, 14.0, 34.0, 16.0],
+        'reading_temperature': [12.0, 25.0, 14.0, np.nan, 10.0, 27.0],
+        'reading_error': [False, False, False, True, False, False],
+        'reading_alert': [False, True, False, False, True, False]
+    })
+
+
+def get_rollups(backend: SqliteBackend) -> list[tuple]:
+    """Returns every rollup in the database, in plant and day order"""
+    with backend.connection() as conn:
+        return conn.execute(
+            'SELECT * FROM reading_daily ORDER BY plant_id, rollup_day;').fetchall()
+
+
+def test_get_rollup_deltas_counts_sums_and_extremes(clean_table):
+    """Asserts that a batch is rolled up by plant and day, skipping missing values"""
+    deltas = get_rollup_deltas(clean_table).set_index(['plant_id', 'rollup_day'])
+
+    cactus = deltas.loc[(2, date(2025, 11, 13))]
+    assert cactus['reading_count'] == 2
+    assert cactus['error_count'] == 1
+    assert cactus['alert_count'] == 1
+    assert cactus['temperature_count'] == 1
+    assert cactus['temperature_sum'] == 25.0
+    assert cactus['temperature_sumsq'] == 625.0
+    assert cactus['moisture_min'] == 12.0
+    assert cactus['moisture_max'] == 14.0
+    assert len(deltas) == 4
+
+
+def test_rollups_added_batch_by_batch_match_a_rebuild(tmp_path, clean_table):
+    """Asserts that rolling up readings as each batch loads gives the same rollups
+    as rebuilding them from the reading table"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    for batch in (clean_table.iloc[:2], clean_table.iloc[2:], clean_table):
+        with backend.connection() as conn:
+            upload_all_tables(conn, batch, DimensionKeyCache(), backend=backend)
+    incremental = get_rollups(backend)
+
+    with backend.connection() as conn:
+        written = rebuild_rollups(conn, date(2025, 11, 1), date(2025, 12, 1), backend)
+
+    assert written == 4
+    assert get_rollups(backend) == incremental
+    assert incremental[0][:5] == (1, date(2025, 11, 13), 2, 0, 0)
+
+
+@pytest.mark.parametrize('load_kwargs', [{}, {'bulk': True}])
+def test_other_load_paths_recount_rollups(tmp_path, clean_table, load_kwargs):
+    """Asserts that the paths which can't tell new readings apart still keep
+    rollups exact when the same table is loaded twice"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    for _ in range(2):
+        with backend.connection() as conn:
+            upload_all_tables(conn, clean_table, backend=backend, **load_kwargs)
+
+    assert [rollup[2] for rollup in get_rollups(backend)] == [2, 1, 2, 1]
+
+
+def test_summary_from_rollups_matches_summary_from_readings(tmp_path, clean_table):
+    """Asserts that a day's summary is the same from rollups as from its readings"""
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    with backend.connection() as conn:
+        upload_all_tables(conn, clean_table, DimensionKeyCache(), backend=backend)
+        rollup_data = get_rollup_data(conn, date(2025, 11, 13))
+
+    day = clean_table[clean_table['reading_time_taken'] < datetime(2025, 11, 14)]
+    expected = generate_summary(day)
+
+    pd.testing.assert_frame_equal(generate_summary_from_rollups(rollup_data), expected,
+                                  check_dtype=False)
+
+
+def test_summary_in_sql_matches_pandas(tmp_path, clean_table, monkeypatch):
+    """Asserts that grouping in the database, fetched a row at a time, gives the
+    same means as generate_summary and the same spread as pandas"""
+    monkeypatch.setattr('summary.create_summaries.FETCH_BATCH_SIZE', 1)
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    with backend.connection() as conn:
+        upload_all_tables(conn, clean_table, DimensionKeyCache(), backend=backend)
+        summary = generate_summary_in_sql(conn, datetime(2025, 11, 13), datetime(2025, 11, 15))
+
+    readings = clean_table.groupby('plant_id')
+    expected = generate_summary(clean_table)
+    for column in ('reading_temperature', 'reading_soil_moisture'):
+        expected[f'{column}_min'] = readings[column].min().to_numpy()
+        expected[f'{column}_max'] = readings[column].max().to_numpy()
+        expected[f'{column}_std'] = readings[column].std().to_numpy()
+        for q in SUMMARY_PERCENTILES:
+            expected[f'{column}_p{q}'] = readings[column].quantile(q / 100).to_numpy()
+
+    pd.testing.assert_frame_equal(summary[expected.columns], expected, check_dtype=False)
@@ -0,0 +1,199 @@
+"""Tests the in-process pipeline runner"""
+from unittest.mock import MagicMock
+import pytest
+import pandas as pd
+from pipeline.run import run_pipeline
+from pipeline.transform import transform_plants
+from pipeline.extract import ChangedPlantFilter
+from pipeline.backends import SqliteBackend
+
+
+@pytest.fixture
+def fake_plants():
+    """Raw plant data as it comes back from the api"""
+    return [
+        {'plant_id': 1, 'name': 'fake plant', 'scientific_name': ['Plantus'],
+         'botanist': {'name': 'Crabby', 'email': 'crabby@fakegmail.com',
+                      'phone': '+44 1234567890'},
+         'soil_moisture': 30.0, 'temperature': 12.0, 'error': None,
+         'last_watered': '2025-11-13T10:00:00',
+         'recording_taken': '2025-11-13T12:00:00'},
+        {'plant_id': 2, 'name': 'fake tree', 'scientific_name': ['Treeus'],
+         'botanist': {'name': 'Pepper', 'email': 'pepper@fakegmail.com',
+                      'phone': '+44 0987654321'},
+         'soil_moisture': 80.0, 'temperature': 25.0, 'error': 'sensor fault',
+         'last_watered': '2025-11-13T10:00:00',
+         'recording_taken': '2025-11-13T12:00:00'}
+    ]
+
+
+def fake_extract_plants(plants):
+    """Returns a fake extract_plants that passes plants through any filter"""
+    def extract_plants(engine, output_format, changed_filter):
+        emitted = [plant for plant in plants
+                   if changed_filter is None or changed_filter.is_changed(plant)]
+        return emitted, {'emitted': len(emitted), 'skipped': len(plants) - len(emitted)}
+    return extract_plants
+
+
+def test_run_pipeline_passes_batches_in_memory(monkeypatch, tmp_path, fake_plants):
+    """Asserts that the clean table reaches load without any file being written"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    fake_load = MagicMock()
+    monkeypatch.setattr('pipeline.run.load_clean_table', fake_load)
+
+    timings = run_pipeline()
+
+    clean_table = fake_load.call_args.args[0]
+    assert isinstance(clean_table, pd.DataFrame)
+    assert list(clean_table['reading_error']) == [False, True]
+    assert clean_table['reading_time_taken'].dtype.name == 'datetime64[ns]'
+    assert set(timings) == {'extract', 'transform', 'load'}
+    assert not (tmp_path / 'data').exists()
+
+
+def test_run_pipeline_checkpoint_writes_files(monkeypatch, tmp_path, fake_plants):
+    """Asserts that the clean csv checkpoint is written when asked for"""
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    monkeypatch.setattr('pipeline.run.load_clean_table', MagicMock())
+    monkeypatch.setattr('pipeline.transform.OUTPUT_FILE', str(tmp_path / 'clean.csv'))
+    monkeypatch.setattr('pipeline.transform.OUTPUT_PATH', f'{tmp_path}/')
+
+    run_pipeline(checkpoint=True)
+
+    assert len(pd.read_csv(tmp_path / 'clean.csv')) == 2
+
+
+def test_run_pipeline_saves_state_only_after_load(monkeypatch, fake_plants):
+    """Asserts that plants are emitted again if the load stage fails"""
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    monkeypatch.setattr('pipeline.run.load_clean_table',
+                        MagicMock(side_effect=ConnectionError('database is down')))
+
+    with pytest.raises(ConnectionError):
+        run_pipeline(incremental=True)
+    assert ChangedPlantFilter().last_seen == {}
+
+    monkeypatch.setattr('pipeline.run.load_clean_table', MagicMock())
+    run_pipeline(incremental=True)
+    assert set(ChangedPlantFilter().last_seen) == {'1', '2'}
+
+
+def test_run_pipeline_skips_load_when_nothing_changed(monkeypatch, fake_plants):
+    """Asserts that transform and load don't run when every plant was skipped"""
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    fake_load = MagicMock()
+    monkeypatch.setattr('pipeline.run.load_clean_table', fake_load)
+
+    run_pipeline(incremental=True)
+    timings = run_pipeline(incremental=True)
+
+    assert fake_load.call_count == 1
+    assert set(timings) == {'extract'}
+
+
+def test_run_pipeline_end_to_end_into_sqlite(monkeypatch, tmp_path, fake_plants):
+    """Asserts that a run loads every plant's reading into a local database,
+    and a second run of the same readings adds nothing"""
+    for plant in fake_plants:
+        plant_id = plant['plant_id']
+        plant['origin_location'] = {'country': 'France', 'city': 'Lyon',
+                                    'latitude': 45.7, 'longitude': 4.8 + plant_id}
+        plant['images'] = {
+            'original_url': f'http://example.com/{plant_id}/original.jpg',
+            'regular_url': f'http://example.com/{plant_id}/regular.jpg',
+            'medium_url': f'http://example.com/{plant_id}/medium.jpg',
+            'small_url': f'http://example.com/{plant_id}/small.jpg',
+            'thumbnail': f'http://example.com/{plant_id}/thumbnail.jpg',
+            'license': 45, 'license_name': 'CC-BY', 'license_url': 'http://example.com/l'}
+    backend = SqliteBackend(str(tmp_path / 'plants.db'))
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    monkeypatch.setattr('pipeline.run.get_backend', lambda: backend)
+
+    run_pipeline()
+    run_pipeline()
+
+    with backend.connection() as conn:
+        readings = conn.execute("""
+            SELECT p.plant_id, b.botanist_name, r.reading_error
+            FROM reading r
+            JOIN plant p ON p.plant_id = r.plant_id
+            JOIN botanist b ON b.botanist_id = r.botanist_id
+            ORDER BY p.plant_id;""").fetchall()
+    assert readings == [(1, 'Crabby', 0), (2, 'Pepper', 1)]
+
+
+def test_run_pipeline_spools_batches_when_load_fails(monkeypatch, tmp_path, fake_plants):
+    """Asserts that a failed load leaves the batch spooled rather than raising,
+    and the next run loads it along with its own"""
+    monkeypatch.setattr('pipeline.spool.SPOOL_FOLDER', f'{tmp_path}/spool/')
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    monkeypatch.setattr('pipeline.run.load_clean_table',
+                        MagicMock(side_effect=ConnectionError('database is down')))
+
+    run_pipeline(load_mode='spool')
+    assert len(list((tmp_path / 'spool').glob('*.parquet'))) == 1
+
+    fake_load = MagicMock()
+    monkeypatch.setattr('pipeline.run.load_clean_table', fake_load)
+    run_pipeline(load_mode='spool')
+
+    assert len(fake_load.call_args.args[0]) == 4
+    assert not list((tmp_path / 'spool').glob('*.parquet'))
+
+
+def test_run_pipeline_micro_batches_until_due(monkeypatch, tmp_path, fake_plants):
+    """Asserts that readings collect in the spool until there are enough rows"""
+    monkeypatch.setattr('pipeline.spool.SPOOL_FOLDER', f'{tmp_path}/spool/')
+    monkeypatch.setattr('pipeline.spool.FLUSH_ROWS', 6)
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    fake_load = MagicMock()
+    monkeypatch.setattr('pipeline.run.load_clean_table', fake_load)
+
+    run_pipeline(load_mode='micro-batch')
+    run_pipeline(load_mode='micro-batch')
+    fake_load.assert_not_called()
+
+    run_pipeline(load_mode='micro-batch')
+    fake_load.assert_called_once()
+    assert len(fake_load.call_args.args[0]) == 6
+
+
+def test_run_pipeline_micro_batch_flush_limits_are_configurable(monkeypatch, tmp_path,
+                                                                fake_plants):
+    """Asserts that the rows and age a micro-batch flushes at can be passed in"""
+    monkeypatch.setattr('pipeline.spool.SPOOL_FOLDER', f'{tmp_path}/spool/')
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    fake_load = MagicMock()
+    monkeypatch.setattr('pipeline.run.load_clean_table', fake_load)
+
+    run_pipeline(load_mode='micro-batch', flush_rows=4, flush_age=3600)
+    fake_load.assert_not_called()
+    run_pipeline(load_mode='micro-batch', flush_rows=4, flush_age=3600)
+    assert len(fake_load.call_args.args[0]) == 4
+
+    run_pipeline(load_mode='micro-batch', flush_rows=100, flush_age=1e-9)
+    assert len(fake_load.call_args.args[0]) == 2
+
+
+def test_run_pipeline_micro_batch_flushes_alerts(monkeypatch, tmp_path, fake_plants):
+    """Asserts that a batch with an alert is loaded straight away, with the rows before it"""
+    monkeypatch.setattr('pipeline.spool.SPOOL_FOLDER', f'{tmp_path}/spool/')
+    monkeypatch.setattr('pipeline.run.extract_plants', fake_extract_plants(fake_plants))
+    fake_load = MagicMock()
+    monkeypatch.setattr('pipeline.run.load_clean_table', fake_load)
+
+    run_pipeline(load_mode='micro-batch')
+    fake_load.assert_not_called()
+
+    def transform_with_alert(plants, baselines):
+        clean_table = transform_plants(plants, baselines)
+        clean_table.loc[0, 'reading_alert'] = True
+        return clean_table
+    monkeypatch.setattr('pipeline.run.transform_plants', transform_with_alert)
+    run_pipeline(load_mode='micro-batch')
+
+    clean_table = fake_load.call_args.args[0]
+    assert len(clean_table) == 4
+    assert clean_table['reading_alert'].any()
@@ -0,0 +1,125 @@
+"""Tests the write-ahead spool of clean tables"""
+import threading
+import time
+from unittest.mock import MagicMock
+import pytest
+import pandas as pd
+from pipeline.spool import Spool
+
+
+@pytest.fixture
+def spool(tmp_path):
+    """A spool in an empty temporary folder"""
+    return Spool(str(tmp_path / 'spool'))
+
+
+def make_batch(plant_id: int) -> pd.DataFrame:
+    """Returns a one reading clean table"""
+    return pd.DataFrame({'plant_id': [plant_id],
+                         'reading_time_taken': pd.to_datetime(['2025-11-13 12:00']),
+                         'reading_error': [False]})
+
+
+def test_drain_coalesces_segments_in_order(spool):
+    """Asserts that waiting segments are loaded oldest first as one table, then removed"""
+    for plant_id in [1, 2, 3]:
+        spool.append(make_batch(plant_id))
+    fake_load = MagicMock()
+
+    assert spool.drain(fake_load) == 3
+
+    fake_load.assert_called_once()
+    batch = fake_load.call_args.args[0]
+    assert list(batch['plant_id']) == [1, 2, 3]
+    assert batch['reading_time_taken'].dtype.name == 'datetime64[ns]'
+    assert spool.get_segments() == []
+
+
+def test_drain_limits_segments_per_load(spool, monkeypatch):
+    """Asserts that a spool that is far behind is loaded in several coalesced batches"""
+    monkeypatch.setattr('pipeline.spool.MAX_COALESCE_SEGMENTS', 2)
+    for plant_id in [1, 2, 3]:
+        spool.append(make_batch(plant_id))
+    fake_load = MagicMock()
+
+    spool.drain(fake_load)
+
+    assert [len(call.args[0]) for call in fake_load.call_args_list] == [2, 1]
+
+
+def test_drain_keeps_segments_when_load_fails(spool):
+    """Asserts that segments stay spooled if the database can't be loaded"""
+    spool.append(make_batch(1))
+
+    with pytest.raises(ConnectionError):
+        spool.drain(MagicMock(side_effect=ConnectionError('database is down')))
+
+    assert len(spool.get_segments()) == 1
+    assert spool.get_metrics()['rows'] == 1
+
+
+def test_drain_in_background_finishes_the_current_load_only(spool, monkeypatch):
+    """Asserts that a run stops starting loads on a slow database, leaving the
+    rest spooled, but waits for the load in flight rather than abandoning it"""
+    monkeypatch.setattr('pipeline.spool.MAX_COALESCE_SEGMENTS', 1)
+    spool.append(make_batch(1))
+    spool.append(make_batch(2))
+    threads = threading.active_count()
+
+    assert spool.drain_in_background(lambda batch: time.sleep(0.2), timeout=0.05) is False
+    metrics = spool.get_metrics()
+
+    assert threading.active_count() == threads
+    assert metrics['loaded_segments'] == 1
+    assert metrics['depth'] == 1
+
+
+def test_drain_in_background_abandons_a_load_past_its_grace(spool):
+    """Asserts that a load which hangs past the grace period doesn't hold up
+    the run, and its batch stays spooled"""
+    spool.append(make_batch(1))
+    release = threading.Event()
+    started = time.monotonic()
+
+    assert spool.drain_in_background(lambda batch: release.wait(), timeout=0.05,
+                                     grace=0.05) is False
+    assert time.monotonic() - started < 1
+    assert spool.get_metrics()['depth'] == 1
+    release.set()
+
+
+def test_drain_stops_starting_loads_after_its_deadline(spool):
+    """Asserts that segments are left spooled once the drain's deadline has passed"""
+    spool.append(make_batch(1))
+
+    assert spool.drain(MagicMock(), deadline=time.monotonic() - 1) == 0
+    assert spool.get_metrics()['depth'] == 1
+
+
+def test_drain_in_background_reports_failed_loads(spool):
+    """Asserts that a failed load is reported instead of raised"""
+    spool.append(make_batch(1))
+
+    assert spool.drain_in_background(MagicMock(side_effect=ConnectionError()), 1) is False
+    assert spool.drain_in_background(MagicMock(), 1) is True
+    assert spool.get_metrics()['loaded_rows'] == 1
+
+
+def test_is_due_on_rows_or_age(spool, monkeypatch):
+    """Asserts that a micro-batch is due once it has enough rows, or has waited long enough"""
+    spool.append(make_batch(1))
+    assert not spool.is_due(max_rows=2, max_age=60)
+
+    spool.append(make_batch(2))
+    assert spool.is_due(max_rows=2, max_age=60)
+
+    monkeypatch.setattr('pipeline.spool.FLUSH_AGE', 1e-9)
+    assert spool.is_due(max_rows=100)
+
+
+def test_is_due_keeps_a_zero_limit(spool):
+    """Asserts that a limit of zero flushes every batch instead of using the default"""
+    spool.append(make_batch(1))
+
+    assert spool.is_due(max_rows=0, max_age=60)
+    assert spool.is_due(max_rows=100, max_age=0)
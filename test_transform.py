@@ -1,9 +1,15 @@
 """Tests transform script edge cases, ideal and unideal behaviour"""
 import json
+import threading
+import time
 import pytest
 import pandas as pd
 from pipeline.transform import get_nested, flatten_data, load_data, clean_phone
+from pipeline.transform import flatten_to_columns, transform_plants
+from pipeline.transform import save_clean_table, archive_clean_table
+from pipeline.load import read_clean_table
 from pipeline.transform import clean_data, add_alerts, format_errors, setup_output
+from pipeline.ndjson import NdjsonWriter
 
 
 def test_get_nested_is_dict():
@@ -104,6 +110,36 @@ def test_flatten_data_missing_values_2(fake_data):
     assert first_row['image_thumbnail_url'] is None
 
 
+def test_flatten_to_columns_matches_rows(fake_data):
+    """Asserts that the columnar flatten builds exactly the same table as the
+    row by row one, including for plants with missing or malformed sections"""
+    odd_plants = fake_data + [
+        {'plant_id': 13, 'name': 'Odd Plant', 'scientific_name': [],
+         'origin_location': 'unknown', 'images': None},
+        {'plant_id': 14, 'temperature': 12.5, 'botanist': {'name': 'Basil'}}
+    ]
+
+    from_columns = pd.DataFrame(flatten_to_columns(odd_plants))
+    from_rows = pd.DataFrame(flatten_data(odd_plants))
+
+    pd.testing.assert_frame_equal(from_columns, from_rows)
+
+
+def test_flatten_to_columns_no_plants():
+    """Asserts that an empty batch still gives a table with every column"""
+    columns = flatten_to_columns([])
+
+    assert 'reading_temperature' in columns
+    assert all(values == [] for values in columns.values())
+
+
+def test_transform_plants_streams_an_iterator(fake_data):
+    """Asserts that raw data can be transformed straight from a generator"""
+    clean_table = transform_plants(plant for plant in fake_data)
+
+    assert list(clean_table['plant_id']) == [11, 12]
+
+
 def test_load_data(monkeypatch, tmp_path, fake_data):
     """Assert that load_data returns a pandas DataFrame as expected"""
     tmp_file = tmp_path / "fake_data.json"
@@ -155,6 +191,71 @@ def test_load_data_all_columns_exist(monkeypatch, tmp_path, fake_data):
         assert column in test_dataframe.columns
 
 
+@pytest.mark.parametrize('file_name', ['fake_data.ndjson', 'fake_data.ndjson.gz',
+                                       'fake_data.ndjson.zst'])
+def test_load_data_ndjson(tmp_path, fake_data, file_name):
+    """Asserts that ndjson raw data loads the same as the json array"""
+    tmp_file = tmp_path / file_name
+    with NdjsonWriter(tmp_file) as writer:
+        for plant in fake_data:
+            writer.write(plant)
+
+    test_dataframe = load_data(tmp_file)
+
+    assert test_dataframe.equals(pd.DataFrame(flatten_data(fake_data)))
+
+
+def test_load_data_follows_growing_ndjson(tmp_path, fake_data):
+    """Asserts that load_data can start reading before the writer has finished"""
+    tmp_file = tmp_path / 'fake_data.ndjson'
+
+    def slow_writer():
+        with NdjsonWriter(tmp_file) as writer:
+            for plant in fake_data:
+                writer.write(plant)
+                time.sleep(0.2)
+
+    thread = threading.Thread(target=slow_writer)
+    thread.start()
+    test_dataframe = load_data(tmp_file, follow=True)
+    thread.join()
+
+    assert list(test_dataframe['plant_id']) == [11, 12]
+
+
+def test_ndjson_writer_skips_done_marker_on_error(tmp_path, fake_data):
+    """Asserts that a run which fails part way is never marked as finished"""
+    tmp_file = tmp_path / 'fake_data.ndjson'
+
+    with pytest.raises(RuntimeError):
+        with NdjsonWriter(tmp_file) as writer:
+            writer.write(fake_data[0])
+            raise RuntimeError('extract failed')
+
+    assert not (tmp_path / 'fake_data.ndjson.done').exists()
+
+
+def test_load_data_follow_ignores_finished_run(tmp_path, fake_data):
+    """Asserts that a follower started before a new run doesn't read the previous run's file"""
+    tmp_file = tmp_path / 'fake_data.ndjson'
+    with NdjsonWriter(tmp_file) as writer:
+        writer.write({**fake_data[0], 'plant_id': 99})
+
+    def slow_writer():
+        time.sleep(0.3)
+        with NdjsonWriter(tmp_file) as writer:
+            for plant in fake_data:
+                writer.write(plant)
+                time.sleep(0.2)
+
+    thread = threading.Thread(target=slow_writer)
+    thread.start()
+    test_dataframe = load_data(tmp_file, follow=True)
+    thread.join()
+
+    assert list(test_dataframe['plant_id']) == [11, 12]
+
+
 def test_clean_phone_symbols_excodes_cleaned():
     """Asserts that phone numbers with symbols such as a plus-sign, dashes and brackets,
     as well as extension codes are cleaned properly"""
@@ -202,9 +303,23 @@ def test_format_errors_reading_error_correct():
 
     formatted_dataframe = format_errors(pre_formatted_dataframe)
 
-    assert formatted_dataframe.loc[0, 'reading_error'] is False
-    assert formatted_dataframe.loc[1, 'reading_error'] is True
-    assert formatted_dataframe.loc[2, 'reading_error'] is True
+    assert formatted_dataframe['reading_error'].dtype.name == 'bool'
+    assert not formatted_dataframe.loc[0, 'reading_error']
+    assert formatted_dataframe.loc[1, 'reading_error']
+    assert formatted_dataframe.loc[2, 'reading_error']
+
+
+def test_format_errors_any_index():
+    """Asserts that errors are formatted for tables that don't have a 0 to n index,
+    such as a filtered table"""
+    pre_formatted_dataframe = pd.DataFrame({
+        'reading_temperature': [22, 64, 18],
+        'reading_error': ['sensor fault', None, float('nan')]
+    }, index=[5, 9, 2])
+
+    formatted_dataframe = format_errors(pre_formatted_dataframe)
+
+    assert list(formatted_dataframe['reading_error']) == [True, False, False]
 
 
 def test_add_alerts_expected_results():
@@ -233,3 +348,29 @@ def setup_output_creates_dir(monkeypatch, tmp_path):
     setup_output()
 
     assert test_output_dir.exists()
+
+
+@pytest.mark.parametrize('file_name', ['clean_data.parquet', 'clean_data.arrow'])
+def test_save_clean_table_keeps_types(tmp_path, fake_data, file_name):
+    """Asserts that a typed clean table reads back with the same types and values"""
+    clean_table = transform_plants(fake_data)
+    path = tmp_path / file_name
+
+    save_clean_table(clean_table, path)
+    read_back = read_clean_table(path)
+
+    pd.testing.assert_frame_equal(read_back, clean_table)
+    assert read_back['license_number'].dtype.name == 'Int64'
+    assert read_back['reading_time_taken'].dtype.name == 'datetime64[ns]'
+    assert read_back['reading_alert'].dtype.name == 'bool'
+
+
+def test_archive_clean_table(monkeypatch, tmp_path, fake_data):
+    """Asserts that each archived run is kept as its own parquet file"""
+    monkeypatch.setattr('pipeline.transform.ARCHIVE_PATH', f'{tmp_path}/archive/')
+    clean_table = transform_plants(fake_data)
+
+    path = archive_clean_table(clean_table)
+
+    assert path.endswith('.parquet')
+    assert len(read_clean_table(path)) == 2